@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Benchmarks of decoding and replaying synthetic days
+
+Run with asv from the root of the repository, e.g. `asv run` for the latest
+commit or `asv continuous master HEAD` to compare two commits.
+"""
+
+# standard libraries
+import time
+
+from process_messages import numba_engine
+from process_messages.decode_arrays import DecodedMessages
+from process_messages.decode_kernel import (
+    MESSAGE_FORMATS,
+    compile_handler_table,
+    decode_buffer,
+)
+from process_messages.process_one_day import SingleDayIMIData
+
+from .synthetic import count_messages, get_day
+
+# order events of the synthetic days
+NUM_EVENTS = [10_000, 100_000, 1_000_000]
+
+
+def skip_message(*fields):
+    pass
+
+
+class Decode:
+    """Decoding all messages, without replaying the order books"""
+
+    params = NUM_EVENTS
+    param_names = ["num_events"]
+    timeout = 600
+
+    def setup_cache(self):
+        # the days are written to the working directory, kept by asv
+        return {num_events: get_day(num_events) for num_events in NUM_EVENTS}
+
+    def setup(self, file_paths, num_events):
+        self.data = file_paths[num_events].read_bytes()
+        self.handler_table = compile_handler_table(
+            {message_type: skip_message for message_type in MESSAGE_FORMATS}
+        )
+
+    def time_decode_buffer(self, file_paths, num_events):
+        decode_buffer(self.data, 0, len(self.data), self.handler_table)
+
+    def time_decode_arrays(self, file_paths, num_events):
+        DecodedMessages(self.data)
+
+    def peakmem_decode_arrays(self, file_paths, num_events):
+        DecodedMessages(self.data)
+
+
+class Replay:
+    """Replaying the order books and recording all events of a day"""
+
+    params = (NUM_EVENTS, ["python", "numba"])
+    param_names = ["num_events", "engine"]
+    number = 1
+    repeat = (1, 5, 120.0)
+    timeout = 600
+
+    def setup_cache(self):
+        return {num_events: get_day(num_events) for num_events in NUM_EVENTS}
+
+    def setup(self, file_paths, num_events, engine):
+        if engine == "numba" and not numba_engine.NUMBA_AVAILABLE:
+            raise NotImplementedError("numba is not installed")
+        self.file_path = file_paths[num_events]
+
+    def replay(self, engine):
+        this_day_imi_data = SingleDayIMIData(self.file_path, engine=engine)
+        this_day_imi_data.process_messages()
+        this_day_imi_data.close()
+        return this_day_imi_data
+
+    def time_process_messages(self, file_paths, num_events, engine):
+        self.replay(engine)
+
+    def peakmem_process_messages(self, file_paths, num_events, engine):
+        self.replay(engine)
+
+    def track_messages_per_second(self, file_paths, num_events, engine):
+        # the numba engine is compiled on first use
+        self.replay(engine)
+        start = time.perf_counter()
+        self.replay(engine)
+        seconds = time.perf_counter() - start
+        return count_messages(self.file_path.read_bytes()) / seconds
+
+    track_messages_per_second.unit = "messages/s"
+
+
+class BookSides:
+    """Replaying with sorted or ladder book sides, on shallow and deep books"""
+
+    params = ([10, 1000], ["sorted", "ladder"])
+    param_names = ["price_levels", "book_side_type"]
+    number = 1
+    repeat = (1, 5, 120.0)
+    timeout = 600
+
+    def setup_cache(self):
+        return {
+            price_levels: get_day(300_000, num_orderbooks=2, price_levels=price_levels)
+            for price_levels in [10, 1000]
+        }
+
+    def setup(self, file_paths, price_levels, book_side_type):
+        self.file_path = file_paths[price_levels]
+
+    def replay(self, book_side_type):
+        # the compiled kernel keeps its own order books
+        this_day_imi_data = SingleDayIMIData(
+            self.file_path, book_side_type=book_side_type, engine="python"
+        )
+        this_day_imi_data.process_messages()
+        this_day_imi_data.close()
+
+    def time_process_messages(self, file_paths, price_levels, book_side_type):
+        self.replay(book_side_type)
+
+    def peakmem_process_messages(self, file_paths, price_levels, book_side_type):
+        self.replay(book_side_type)
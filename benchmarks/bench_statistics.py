@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Benchmarks of the statistics of synthetic days
+
+Every benchmark calculates one kind of statistics for all orderbooks of a
+day, from the same inputs as calculate_orderbook_stats. The functions modify
+their inputs, so each run gets a fresh copy. The cached data are only the
+paths of the pickles of each size, so the peak memory of a benchmark only
+includes the data of its own size.
+"""
+
+# third-party packages
+import pandas as pd
+
+from calculate_statistics.best_bid_ask import calculate_best_bid_ask_statistics
+from calculate_statistics.best_depths import calculate_best_depth_statistics
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    calculate_orderbook_stats,
+)
+from calculate_statistics.order_stats import calculate_order_stats
+from calculate_statistics.realized_vola import calculate_realized_vola_stats
+from calculate_statistics.snapshots import calculate_snapshot_statistics
+from calculate_statistics.trade_stats import calculate_effective_statistics
+
+from .bench_replay import NUM_EVENTS
+from .synthetic import read_pickle, write_replayed_day, write_statistics_inputs
+
+
+def copy_inputs(inputs):
+    return [
+        {
+            name: value.copy() if isinstance(value, pd.DataFrame) else value
+            for name, value in orderbook_inputs.items()
+        }
+        for orderbook_inputs in inputs
+    ]
+
+
+class Statistics:
+    """The calculate_* functions, for all orderbooks of a day"""
+
+    params = NUM_EVENTS
+    param_names = ["num_events"]
+    # each run needs its own copy of the inputs
+    number = 1
+    repeat = (1, 10, 60.0)
+    timeout = 600
+
+    def setup_cache(self):
+        return {
+            num_events: write_statistics_inputs(num_events) for num_events in NUM_EVENTS
+        }
+
+    def setup(self, file_paths, num_events):
+        self.inputs = copy_inputs(read_pickle(file_paths[num_events]))
+
+    def best_bid_ask(self):
+        for orderbook_inputs in self.inputs:
+            calculate_best_bid_ask_statistics(
+                orderbook_inputs["best_bid_ask"],
+                orderbook_inputs["trading_actions"],
+                orderbook_inputs["tick_sizes"],
+                START_MICROSECOND,
+                END_MICROSECOND,
+            )
+
+    def best_depth(self):
+        for orderbook_inputs in self.inputs:
+            calculate_best_depth_statistics(
+                orderbook_inputs["best_depths"],
+                orderbook_inputs["trading_actions"],
+                orderbook_inputs["metainfo"],
+                START_MICROSECOND,
+                END_MICROSECOND,
+            )
+
+    def snapshots(self):
+        for orderbook_inputs in self.inputs:
+            calculate_snapshot_statistics(
+                orderbook_inputs["snapshots"],
+                orderbook_inputs["trading_actions"],
+                orderbook_inputs["tick_sizes"],
+                orderbook_inputs["metainfo"],
+            )
+
+    def order_stats(self):
+        for orderbook_inputs in self.inputs:
+            calculate_order_stats(
+                orderbook_inputs["order_stats"],
+                orderbook_inputs["trading_actions"],
+                orderbook_inputs["metainfo"],
+                orderbook_inputs["tick_sizes"],
+                START_MICROSECOND,
+                END_MICROSECOND,
+            )
+
+    def effective(self):
+        for orderbook_inputs in self.inputs:
+            if not orderbook_inputs["transactions"].empty:
+                calculate_effective_statistics(
+                    orderbook_inputs["transactions"],
+                    orderbook_inputs["metainfo"],
+                    orderbook_inputs["tick_sizes"],
+                )
+
+    def realized_vola(self):
+        for orderbook_inputs in self.inputs:
+            if not orderbook_inputs["transactions"].empty:
+                calculate_realized_vola_stats(orderbook_inputs["transactions"])
+
+    def time_best_bid_ask(self, file_paths, num_events):
+        self.best_bid_ask()
+
+    def peakmem_best_bid_ask(self, file_paths, num_events):
+        self.best_bid_ask()
+
+    def time_best_depth(self, file_paths, num_events):
+        self.best_depth()
+
+    def peakmem_best_depth(self, file_paths, num_events):
+        self.best_depth()
+
+    def time_snapshots(self, file_paths, num_events):
+        self.snapshots()
+
+    def peakmem_snapshots(self, file_paths, num_events):
+        self.snapshots()
+
+    def time_order_stats(self, file_paths, num_events):
+        self.order_stats()
+
+    def peakmem_order_stats(self, file_paths, num_events):
+        self.order_stats()
+
+    def time_effective(self, file_paths, num_events):
+        self.effective()
+
+    def peakmem_effective(self, file_paths, num_events):
+        self.effective()
+
+    def time_realized_vola(self, file_paths, num_events):
+        self.realized_vola()
+
+    def peakmem_realized_vola(self, file_paths, num_events):
+        self.realized_vola()
+
+
+class OrderbookStats:
+    """All statistics of a replayed day, as in process_all.py"""
+
+    params = NUM_EVENTS
+    param_names = ["num_events"]
+    number = 1
+    repeat = (1, 5, 120.0)
+    timeout = 600
+
+    def setup_cache(self):
+        return {num_events: write_replayed_day(num_events) for num_events in NUM_EVENTS}
+
+    def setup(self, file_paths, num_events):
+        self.this_day_imi_data = read_pickle(file_paths[num_events])
+
+    def time_calculate_orderbook_stats(self, file_paths, num_events):
+        calculate_orderbook_stats(self.this_day_imi_data)
+
+    def peakmem_calculate_orderbook_stats(self, file_paths, num_events):
+        calculate_orderbook_stats(self.this_day_imi_data)
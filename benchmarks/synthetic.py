@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Synthetic IMI days for the benchmarks
+
+A day has `num_orderbooks` CHF denoted stocks with a random walk of the mid
+price. During continuous trading from 9:00 to 17:30, the messages are
+orders added, deleted, replaced and (partially) executed at random, with a
+short halt of the first orderbook. A few orders have no book side, as in
+the data. The days are written once to `SYNTHETIC_DIR` (relative to the
+working directory, which asv keeps for the whole run) and are reused. The
+replayed days and the inputs of the statistics are pickled next to them, one
+file per size, so that each benchmark only loads the data of its own size.
+"""
+
+# standard libraries
+from pathlib import Path
+import pickle
+import random
+import struct
+from typing import Dict, List
+
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    prepare_metadata,
+    prepare_tick_sizes,
+    prepare_trading_actions,
+    prepare_transactions,
+)
+from process_messages.decode_kernel import MESSAGE_STRUCTS
+from process_messages.process_one_day import SingleDayIMIData
+
+SYNTHETIC_DIR = Path("synthetic_days")
+# the name that SingleDayIMIData takes the date from
+FILE_NAME = "ITCHTV-P01_2019_07_03.bin"
+# order events by type during continuous trading
+EVENT_WEIGHTS = {b"A": 0.45, b"D": 0.2, b"U": 0.15, b"E": 0.15, b"C": 0.05}
+# book sides of added orders, a few have none, as in the data
+BOOK_SIDE_WEIGHTS = {b"B": 0.495, b"S": 0.495, b" ": 0.01}
+PRICE_DECIMALS = 4
+TICK_SIZE = 100
+
+
+def frame(message_type: bytes, *fields) -> bytes:
+    """A message with its two length bytes"""
+    payload = MESSAGE_STRUCTS[message_type].pack(*fields)
+    return struct.pack(">H", len(payload) + 1) + message_type + payload
+
+
+def generate_day(
+    num_events: int, num_orderbooks: int = 10, seed: int = 0, price_levels: int = 10
+) -> bytes:
+    """Binary IMI messages of a day with `num_events` order events
+
+    Orders are placed up to `price_levels` ticks away from the mid price.
+    """
+    rng = random.Random(seed)
+    messages = list()
+    messages.append(frame(b"T", 6 * 3600))
+    messages.append(frame(b"S", 0, b"ACoK    ", b"O", 0))
+    # price tick size tables, the statistics use table 2
+    for tick_size, price_start in [(1, 0), (5, 10000), (10, 100000), (50, 1000000)]:
+        messages.append(frame(b"L", 0, 1, tick_size, price_start))
+    messages.append(frame(b"L", 0, 2, TICK_SIZE, 0))
+
+    orderbook_nos = list(range(1001, 1001 + num_orderbooks))
+    for index, orderbook_no in enumerate(orderbook_nos):
+        messages.append(
+            frame(
+                b"R",
+                0,
+                orderbook_no,
+                b"C",
+                f"CH{orderbook_no:010d}".encode(),
+                b"CHF",
+                b"ACoK    " if index % 2 == 0 else b"ABck    ",
+                1,
+                1,
+                2,
+                PRICE_DECIMALS,
+                0,
+                0,
+            )
+        )
+
+    # trading actions in seconds after midnight, with a halt of the first book
+    trading_actions = [
+        (9 * 3600, orderbook_no, b"T", b"N") for orderbook_no in orderbook_nos
+    ]
+    trading_actions += [
+        (13 * 3600, orderbook_nos[0], b"T", b"S"),
+        (13 * 3600 + 300, orderbook_nos[0], b"T", b"N"),
+    ]
+    trading_actions += [
+        (17 * 3600 + 1800, orderbook_no, b"V", b"S") for orderbook_no in orderbook_nos
+    ]
+    trading_actions.sort()
+
+    start_ns = 9 * 3600 * 10 ** 9
+    end_ns = (17 * 3600 + 1800) * 10 ** 9
+    timestamps = sorted(rng.randrange(start_ns, end_ns) for _ in range(num_events))
+    event_types = rng.choices(
+        list(EVENT_WEIGHTS), weights=list(EVENT_WEIGHTS.values()), k=num_events
+    )
+
+    mids = {orderbook_no: 1_000_000 for orderbook_no in orderbook_nos}
+    # live orders of each orderbook, as a list for sampling and a position index
+    live_orders = {orderbook_no: list() for orderbook_no in orderbook_nos}
+    positions = dict()
+    orders = dict()
+    next_order_no = 1
+    match_number = 1
+    current_second = None
+
+    def add(orderbook_no, order_no, book_side, price, quantity):
+        orders[order_no] = [orderbook_no, book_side, price, quantity]
+        positions[order_no] = len(live_orders[orderbook_no])
+        live_orders[orderbook_no].append(order_no)
+
+    def remove(order_no):
+        orderbook_no = orders.pop(order_no)[0]
+        these_orders = live_orders[orderbook_no]
+        position = positions.pop(order_no)
+        last_order_no = these_orders.pop()
+        if last_order_no != order_no:
+            these_orders[position] = last_order_no
+            positions[last_order_no] = position
+
+    def random_price(orderbook_no, book_side):
+        distance = (1 + rng.randrange(price_levels)) * TICK_SIZE
+        if book_side == b"B":
+            return mids[orderbook_no] - distance
+        if book_side == b"S":
+            return mids[orderbook_no] + distance
+        return mids[orderbook_no]
+
+    action_index = 0
+    for timestamp, event_type in zip(timestamps, event_types):
+        second, nanoseconds = divmod(timestamp, 10 ** 9)
+        while (
+            action_index < len(trading_actions)
+            and trading_actions[action_index][0] <= second
+        ):
+            action_second, orderbook_no, trading_state, book_condition = (
+                trading_actions[action_index]
+            )
+            if action_second != current_second:
+                current_second = action_second
+                messages.append(frame(b"T", current_second))
+            messages.append(frame(b"H", 0, orderbook_no, trading_state, book_condition))
+            action_index += 1
+        if second != current_second:
+            current_second = second
+            messages.append(frame(b"T", second))
+
+        orderbook_no = rng.choice(orderbook_nos)
+        if rng.random() < 0.01:
+            mids[orderbook_no] += TICK_SIZE * rng.choice([-1, 1])
+        these_orders = live_orders[orderbook_no]
+        if not these_orders:
+            event_type = b"A"
+
+        if event_type == b"A":
+            book_side = rng.choices(
+                list(BOOK_SIDE_WEIGHTS), weights=list(BOOK_SIDE_WEIGHTS.values())
+            )[0]
+            price = random_price(orderbook_no, book_side)
+            quantity = 10 * rng.randrange(1, 20)
+            messages.append(
+                frame(
+                    b"A",
+                    nanoseconds,
+                    next_order_no,
+                    book_side,
+                    quantity,
+                    orderbook_no,
+                    price,
+                )
+            )
+            add(orderbook_no, next_order_no, book_side, price, quantity)
+            next_order_no += 1
+            continue
+
+        order_no = rng.choice(these_orders)
+        _, book_side, price, quantity = orders[order_no]
+        if event_type == b"D":
+            messages.append(frame(b"D", nanoseconds, order_no))
+            remove(order_no)
+        elif event_type == b"U":
+            new_price = random_price(orderbook_no, book_side)
+            new_quantity = 10 * rng.randrange(1, 20)
+            messages.append(
+                frame(
+                    b"U", nanoseconds, order_no, next_order_no, new_quantity, new_price
+                )
+            )
+            remove(order_no)
+            add(orderbook_no, next_order_no, book_side, new_price, new_quantity)
+            next_order_no += 1
+        else:
+            executed_quantity = rng.randint(1, quantity)
+            if event_type == b"E":
+                messages.append(
+                    frame(b"E", nanoseconds, order_no, executed_quantity, match_number)
+                )
+            else:
+                messages.append(
+                    frame(
+                        b"C",
+                        nanoseconds,
+                        order_no,
+                        executed_quantity,
+                        match_number,
+                        b"Y",
+                        price,
+                    )
+                )
+            match_number += 1
+            if executed_quantity == quantity:
+                remove(order_no)
+            else:
+                orders[order_no][3] -= executed_quantity
+
+    for action_second, orderbook_no, trading_state, book_condition in trading_actions[
+        action_index:
+    ]:
+        messages.append(frame(b"T", action_second))
+        messages.append(frame(b"H", 0, orderbook_no, trading_state, book_condition))
+    return b"".join(messages)
+
+
+def split_messages(data: bytes) -> List[bytes]:
+    """Messages of the binary data of a day, with their length bytes"""
+    messages = list()
+    position = 0
+    while position < len(data):
+        end = position + data[position + 1] + 2
+        messages.append(data[position:end])
+        position = end
+    return messages
+
+
+def add_sideless_orders(data: bytes) -> bytes:
+    """Add an order without a book side to every orderbook before trading
+
+    The pandas statistics expect events of these orders in every orderbook,
+    which few orders at random do not guarantee.
+    """
+    messages = list()
+    for message in split_messages(data):
+        messages.append(message)
+        if message[2:3] == b"R":
+            (orderbook_no,) = struct.unpack_from(">i", message, 7)
+            order_no = 10 ** 12 + orderbook_no
+            messages.append(frame(b"A", 0, order_no, b" ", 10, orderbook_no, 0))
+    return b"".join(messages)
+
+
+def count_messages(data: bytes) -> int:
+    """Number of messages in the binary data of a day"""
+    position = 0
+    number_of_messages = 0
+    while position < len(data):
+        position += data[position + 1] + 2
+        number_of_messages += 1
+    return number_of_messages
+
+
+def get_day(num_events: int, num_orderbooks: int = 10, price_levels: int = 10) -> Path:
+    """File of a synthetic day, generated on first use"""
+    directory = str(num_events)
+    if (num_orderbooks, price_levels) != (10, 10):
+        directory = f"{num_events}_{num_orderbooks}_books_{price_levels}_levels"
+    file_path = SYNTHETIC_DIR / directory / FILE_NAME
+    if not file_path.exists():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = file_path.with_suffix(".tmp")
+        temporary_path.write_bytes(
+            generate_day(num_events, num_orderbooks, price_levels=price_levels)
+        )
+        temporary_path.replace(file_path)
+    return file_path
+
+
+def replay_day(num_events: int, engine: str = "auto") -> SingleDayIMIData:
+    this_day_imi_data = SingleDayIMIData(get_day(num_events), engine=engine)
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+def write_pickle(value, file_path: Path) -> Path:
+    temporary_path = file_path.with_suffix(".tmp")
+    with open(temporary_path, "wb") as pickle_file:
+        pickle.dump(value, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+    temporary_path.replace(file_path)
+    return file_path
+
+
+def read_pickle(file_path: Path):
+    with open(file_path, "rb") as pickle_file:
+        return pickle.load(pickle_file)
+
+
+def write_replayed_day(num_events: int) -> Path:
+    """Pickle of the replayed synthetic day, replayed by the current code"""
+    this_day_imi_data = replay_day(num_events, engine="python")
+    return write_pickle(this_day_imi_data, get_day(num_events).with_suffix(".pickle"))
+
+
+def write_statistics_inputs(num_events: int) -> Path:
+    """Pickle of the inputs of the statistics of the synthetic day"""
+    inputs = statistics_inputs(replay_day(num_events, engine="python"))
+    return write_pickle(inputs, get_day(num_events).parent / "statistics_inputs.pickle")
+
+
+def statistics_inputs(this_day_imi_data) -> List[Dict]:
+    """Inputs of the calculate_* functions per orderbook, as in calculate_all"""
+    metadata = prepare_metadata(this_day_imi_data)
+    inputs = list()
+    for orderbook_no in metadata.index:
+        metainfo = metadata.loc[orderbook_no]
+        inputs.append(
+            {
+                "metainfo": metainfo,
+                "tick_sizes": prepare_tick_sizes(this_day_imi_data, metainfo),
+                "trading_actions": prepare_trading_actions(
+                    this_day_imi_data, orderbook_no
+                ),
+                "best_bid_ask": this_day_imi_data.best_bid_ask[orderbook_no].to_frame(),
+                "best_depths": this_day_imi_data.best_depths[orderbook_no].to_frame(),
+                "snapshots": this_day_imi_data.snapshots.frame(
+                    orderbook_no,
+                    int(START_MICROSECOND * 1e-6),
+                    int(END_MICROSECOND * 1e-6),
+                ),
+                "order_stats": this_day_imi_data.order_stats[orderbook_no].to_frame(),
+                "transactions": prepare_transactions(
+                    this_day_imi_data,
+                    orderbook_no,
+                    metainfo,
+                    START_MICROSECOND,
+                    END_MICROSECOND,
+                ),
+            }
+        )
+    return inputs
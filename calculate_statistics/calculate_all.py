@@ -1,24 +1,36 @@
 #!/usr/bin/env python3
 """
 """
+from contextlib import nullcontext
+
 import pandas as pd
 import numpy as np
 
-from .best_bid_ask import calculate_best_bid_ask_statistics
+from process_messages.accumulators import TimeWeightedAccumulator
+from .best_bid_ask import calculate_best_bid_ask_statistics, empty_result
 from .best_depths import calculate_best_depth_statistics
 from .order_stats import calculate_order_stats
 from .snapshots import calculate_snapshot_statistics
 from .trade_stats import calculate_effective_statistics
 from .realized_vola import calculate_realized_vola_stats
 
+# increase when the statistics change, e.g. to recalculate stored results
+STATISTICS_VERSION = 1
 
-def calculate_orderbook_stats(this_day_imi_data) -> pd.DataFrame:
+# window of the intraday statistics, in microseconds after midnight
+START_MICROSECOND = int(9.08333333 * 3600e6)
+END_MICROSECOND = int(17.25 * 3600e6)
 
-    start_microsecond = int(9.08333333 * 3600e6)
-    end_microsecond = int(17.25 * 3600e6)
 
-    # first, nicely format metadata:
+def _no_stage(name: str):
+    return nullcontext()
+
+
+def prepare_metadata(this_day_imi_data) -> pd.DataFrame:
+    """Decoded metadata of the CHF denoted Blue Chips and Mid-/Small-Caps"""
     metadata = pd.DataFrame.from_dict(this_day_imi_data.metadata, orient="index")
+    if metadata.empty:
+        return metadata
     string_columns = ["price_type", "isin", "currency", "group"]
     metadata[string_columns] = metadata[string_columns].apply(
         lambda column: column.str.decode("utf-8")
@@ -30,6 +42,90 @@ def calculate_orderbook_stats(this_day_imi_data) -> pd.DataFrame:
     metadata = metadata[metadata["group"].isin(["ACoK", "ABck"])]
     # keep only CHF denoted
     metadata = metadata[metadata["currency"] == "CHF"]
+    return metadata
+
+
+def prepare_tick_sizes(this_day_imi_data, metainfo: pd.Series) -> pd.DataFrame:
+    tick_table_id = int(metainfo.price_tick_table_id)
+    tick_sizes = pd.DataFrame.from_dict(
+        this_day_imi_data.price_tick_sizes[tick_table_id], orient="index"
+    )
+    tick_sizes = tick_sizes.reset_index()
+    tick_sizes.columns = ["tick_size", "price_start"]
+    tick_sizes["price_end"] = tick_sizes["price_start"].shift(fill_value=np.inf)
+    return tick_sizes
+
+
+def prepare_trading_actions(this_day_imi_data, orderbook_no: int) -> pd.DataFrame:
+    """Halts of continuous trading, from `timestamp` until `until`"""
+    trading_actions = pd.DataFrame(
+        this_day_imi_data.trading_actions[orderbook_no],
+        columns=["timestamp", "trading_state", "book_condition"],
+    )
+    trading_actions = trading_actions[trading_actions["trading_state"] == b"T"]
+    if not trading_actions.empty:
+        trading_actions["until"] = trading_actions["timestamp"].shift(-1)
+        trading_actions = trading_actions[trading_actions["book_condition"] != b"N"]
+        trading_actions.dropna(subset=["until"], inplace=True)
+        trading_actions["until"] = trading_actions["until"].astype(int)
+    return trading_actions
+
+
+def prepare_transactions(
+    this_day_imi_data,
+    orderbook_no: int,
+    metainfo: pd.Series,
+    start_microsecond: int,
+    end_microsecond: int,
+) -> pd.DataFrame:
+    """Transactions within the window, with prices in currency units"""
+    transactions = this_day_imi_data.transactions[orderbook_no].to_frame()
+    if transactions.empty:
+        return transactions
+    transactions.set_index("timestamp", inplace=True)
+    transactions = transactions.loc[start_microsecond:end_microsecond]
+    if transactions.empty:
+        return transactions
+    transactions["mid"] = (transactions["best_ask"] + transactions["best_bid"]) * 0.5
+    price_decimals = 10 ** metainfo.price_decimals
+    transactions[["price", "best_bid", "best_ask", "mid"]] /= price_decimals
+    return transactions
+
+
+def calculate_observed_stats(this_day_imi_data) -> pd.DataFrame:
+    """Statistics that the observers of a day collected during the replay"""
+    metadata = prepare_metadata(this_day_imi_data)
+    if not this_day_imi_data.metadata:
+        return metadata
+    for orderbook_no in metadata.index:
+        for observer in this_day_imi_data.observers:
+            for measure, value in observer.statistics(orderbook_no).items():
+                metadata.loc[orderbook_no, measure] = value
+    metadata["date"] = pd.Timestamp(this_day_imi_data.date)
+    return metadata
+
+
+def calculate_orderbook_stats(this_day_imi_data, profile=None) -> pd.DataFrame:
+    """Statistics of all selected orderbooks of a day
+
+    With a profile (see process_messages.profiling.DayProfile), the time of
+    each stage is recorded. Days that were replayed with observers only have
+    the statistics of their observers, since the built-in recorders are not
+    filled.
+    """
+    if getattr(this_day_imi_data, "observers", None) is not None:
+        return calculate_observed_stats(this_day_imi_data)
+
+    start_microsecond = START_MICROSECOND
+    end_microsecond = END_MICROSECOND
+    stage = _no_stage if profile is None else profile.stage
+
+    # first, nicely format metadata:
+    with stage("metadata"):
+        metadata = prepare_metadata(this_day_imi_data)
+    # e.g. a shard of a day without any of the selected orderbooks
+    if not this_day_imi_data.metadata:
+        return metadata
 
     # next, we calculate various statistics for each stock:
     for orderbook_no in metadata.index:
@@ -39,99 +135,114 @@ def calculate_orderbook_stats(this_day_imi_data) -> pd.DataFrame:
         metainfo = metadata.loc[orderbook_no]
 
         # tick sizes
-        tick_table_id = int(metainfo.price_tick_table_id)
-        tick_sizes = pd.DataFrame.from_dict(
-            this_day_imi_data.price_tick_sizes[tick_table_id], orient="index"
-        )
-        tick_sizes = tick_sizes.reset_index()
-        tick_sizes.columns = ["tick_size", "price_start"]
-        tick_sizes["price_end"] = tick_sizes["price_start"].shift(fill_value=np.inf)
+        with stage("tick_sizes"):
+            tick_sizes = prepare_tick_sizes(this_day_imi_data, metainfo)
 
         # trading actions (such as stop trading events)
-        trading_actions = pd.DataFrame(
-            this_day_imi_data.trading_actions[orderbook_no],
-            columns=["timestamp", "trading_state", "book_condition"],
-        )
-        trading_actions = trading_actions[trading_actions["trading_state"] == b"T"]
-        if not trading_actions.empty:
-            trading_actions["until"] = trading_actions["timestamp"].shift(-1)
-            trading_actions = trading_actions[trading_actions["book_condition"] != b"N"]
-            trading_actions.dropna(subset=["until"], inplace=True)
-            trading_actions["until"] = trading_actions["until"].astype(int)
+        with stage("trading_actions"):
+            trading_actions = prepare_trading_actions(this_day_imi_data, orderbook_no)
 
         # best bid and ask
-        best_bid_ask = pd.DataFrame(this_day_imi_data.best_bid_ask[orderbook_no])
-        best_bid_ask_stats = calculate_best_bid_ask_statistics(
-            best_bid_ask, trading_actions, tick_sizes, start_microsecond, end_microsecond
-        )
-        this_orderbook_stats["best_bid_ask_stats"] = best_bid_ask_stats
+        with stage("best_bid_ask"):
+            best_bid_ask = this_day_imi_data.best_bid_ask[orderbook_no]
+            if isinstance(best_bid_ask, TimeWeightedAccumulator):
+                # integrated during the replay, over the same window
+                spread_time_weighted = best_bid_ask.time_weighted_average()
+                if np.isnan(spread_time_weighted):
+                    best_bid_ask_stats = empty_result()
+                else:
+                    best_bid_ask_stats = {
+                        "quoted_rel_spread_bps_time_weighted": spread_time_weighted
+                    }
+            else:
+                best_bid_ask_stats = calculate_best_bid_ask_statistics(
+                    best_bid_ask.to_frame(),
+                    trading_actions,
+                    tick_sizes,
+                    start_microsecond,
+                    end_microsecond,
+                )
+            this_orderbook_stats["best_bid_ask_stats"] = best_bid_ask_stats
 
         # depth at best
-        best_depths = pd.DataFrame(this_day_imi_data.best_depths[orderbook_no])
-        best_depth_stats = calculate_best_depth_statistics(
-            best_depths, trading_actions, metainfo, start_microsecond, end_microsecond
-        )
-        this_orderbook_stats["best_depth_stats"] = best_depth_stats
+        with stage("best_depth"):
+            best_depths = this_day_imi_data.best_depths[orderbook_no]
+            if isinstance(best_depths, TimeWeightedAccumulator):
+                best_depth_stats = {
+                    "depth_time_weighted_average": best_depths.time_weighted_average()
+                }
+            else:
+                best_depth_stats = calculate_best_depth_statistics(
+                    best_depths.to_frame(),
+                    trading_actions,
+                    metainfo,
+                    start_microsecond,
+                    end_microsecond,
+                )
+            this_orderbook_stats["best_depth_stats"] = best_depth_stats
 
         # snapshots
-        snapshots = pd.DataFrame.from_dict(
-            this_day_imi_data.snapshots[orderbook_no], orient="index"
-        )
-        snapshots = snapshots.loc[
-            int(start_microsecond * 1e-6) : int(end_microsecond * 1e-6)
-        ]
-        snapshot_stats = calculate_snapshot_statistics(
-            snapshots, trading_actions, tick_sizes, metainfo
-        )
-        this_orderbook_stats["snapshot_stats"] = snapshot_stats
+        with stage("snapshots"):
+            snapshots = this_day_imi_data.snapshots.frame(
+                orderbook_no, int(start_microsecond * 1e-6), int(end_microsecond * 1e-6)
+            )
+            snapshot_stats = calculate_snapshot_statistics(
+                snapshots, trading_actions, tick_sizes, metainfo
+            )
+            this_orderbook_stats["snapshot_stats"] = snapshot_stats
 
         # order_stats
-        order_stats = pd.DataFrame.from_dict(
-            this_day_imi_data.order_stats[orderbook_no], orient="index"
+        with stage("order_stats"):
+            order_stats = this_day_imi_data.order_stats[orderbook_no].to_frame()
+            this_orderbook_stats["order_stats"] = calculate_order_stats(
+                order_stats,
+                trading_actions,
+                metainfo,
+                tick_sizes,
+                start_microsecond,
+                end_microsecond,
+            )
+
+        # message counts, sorted by type so that the columns do not depend on
+        # the order in which the engine counted them
+        message_counts = dict(
+            sorted(this_day_imi_data.message_counts[orderbook_no].items())
         )
-        this_orderbook_stats["order_stats"] = calculate_order_stats(
-            order_stats,
-            trading_actions,
-            metainfo,
-            tick_sizes,
-            start_microsecond,
-            end_microsecond,
-        )
-
-        # message counts
-        message_counts = dict(this_day_imi_data.message_counts[orderbook_no])
         message_counts["sum"] = sum(message_counts.values())
-        message_counts = {"message_counts_" + key: val for key, val in message_counts.items()}
+        message_counts = {
+            "message_counts_" + key: val for key, val in message_counts.items()
+        }
         this_orderbook_stats["message_counts"] = message_counts
 
         # preprocess transactions
-        transactions = pd.DataFrame(this_day_imi_data.transactions[orderbook_no])
-        if transactions.empty:
-            continue
-        transactions.set_index("timestamp", inplace=True)
-        transactions = transactions.loc[start_microsecond:end_microsecond]
+        with stage("transactions"):
+            transactions = prepare_transactions(
+                this_day_imi_data,
+                orderbook_no,
+                metainfo,
+                start_microsecond,
+                end_microsecond,
+            )
         if transactions.empty:
             continue
-        transactions["mid"] = (
-            transactions["best_ask"] + transactions["best_bid"]
-        ) * 0.5
-        price_decimals = 10 ** metainfo.price_decimals
-        transactions[["price", "best_bid", "best_ask", "mid"]] /= price_decimals
 
         # trade statistics
-        aggregated_statistics = calculate_effective_statistics(
-            transactions, metainfo, tick_sizes
-        )
-        this_orderbook_stats["transaction_stats"] = aggregated_statistics
+        with stage("effective"):
+            aggregated_statistics = calculate_effective_statistics(
+                transactions, metainfo, tick_sizes
+            )
+            this_orderbook_stats["transaction_stats"] = aggregated_statistics
 
         # realized volatility
-        this_orderbook_stats["realized_vola_stats"] = calculate_realized_vola_stats(
-            transactions
-        )
-
-        for measure_type, measure_stats in this_orderbook_stats.items():
-            for measure, value in measure_stats.items():
-                metadata.loc[orderbook_no, measure] = value
+        with stage("realized_vola"):
+            this_orderbook_stats["realized_vola_stats"] = calculate_realized_vola_stats(
+                transactions
+            )
+
+        with stage("collect"):
+            for measure_type, measure_stats in this_orderbook_stats.items():
+                for measure, value in measure_stats.items():
+                    metadata.loc[orderbook_no, measure] = value
 
     metadata["date"] = pd.Timestamp(this_day_imi_data.date)
 
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 """Unzips files and saves them to another location
+
+This step is optional: SingleDayIMIData also parses the .bin.gz files directly.
+Unzipped files are faster to process, but need several times the disk space.
 """
 import os
 import gzip
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Backends that run the tasks of process_all.py
+
+All executors hand out the tasks in the given order, one at a time, and
+yield the results as soon as they are done:
+
+- PoolExecutor: multiprocessing.Pool on this machine (the default)
+- FuturesExecutor: concurrent.futures.ProcessPoolExecutor on this machine
+- AdaptiveExecutor: a process pool on this machine that only starts days
+  while there is enough memory for them (the default of process_all.py)
+- DaskExecutor: a dask.distributed cluster, e.g. several hosts, or a
+  LocalCluster on this machine if no scheduler address is given
+
+Failed tasks are retried up to `retries` times, and AdaptiveExecutor also
+restarts tasks whose worker died, e.g. by the OOM killer. The local executors
+can limit the memory of each task, dask schedules tasks by abstract worker
+resources instead, e.g. resources={"memory": 8e9} with workers started as
+`dask worker --resources memory=64e9`. With several hosts, the results path
+must be on shared storage.
+"""
+
+# standard libraries
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import multiprocessing
+from multiprocessing import Pool
+from pathlib import Path
+import resource
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    from dask.distributed import Client, LocalCluster, as_completed
+
+    DASK_AVAILABLE = True
+except ImportError:
+    DASK_AVAILABLE = False
+
+from scheduling import (
+    available_memory,
+    get_default_workers,
+    resident_memory,
+    total_memory,
+)
+
+EXECUTORS = ["adaptive", "pool", "futures", "dask"]
+
+
+def _limit_memory(memory_limit: Optional[int]):
+    """Limit the heap of a worker process, in bytes
+
+    Memory maps of the binary files do not count towards this limit.
+    """
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+
+def _call_with_retries(function: Callable, retries: int, task):
+    for attempt in range(retries + 1):
+        try:
+            return function(task)
+        except Exception:
+            if attempt == retries:
+                raise
+
+
+class Executor(object):
+    """Base class of the backends, used as a context manager"""
+
+    def __init__(self, num_workers: int = None, retries: int = 0):
+        self.num_workers = num_workers or get_default_workers()
+        self.retries = retries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def map_unordered(
+        self, function: Callable, tasks: List, memory_estimates: List[float] = None
+    ) -> Iterator:
+        """Results of the tasks as they are done
+
+        `memory_estimates` are the expected peak memory of the tasks in bytes,
+        which only some executors use.
+        """
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class PoolExecutor(Executor):
+    """Workers of a multiprocessing.Pool, retried within the worker
+
+    With `max_tasks_per_child`, workers are replaced after that many tasks,
+    which returns all their memory to the system.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = None,
+        retries: int = 0,
+        memory_limit: int = None,
+        max_tasks_per_child: int = None,
+    ):
+        super().__init__(num_workers, retries)
+        self.pool = Pool(
+            processes=self.num_workers,
+            initializer=_limit_memory,
+            initargs=(memory_limit,),
+            maxtasksperchild=max_tasks_per_child,
+        )
+
+    def map_unordered(self, function, tasks, memory_estimates=None):
+        return self.pool.imap_unordered(
+            partial(_call_with_retries, function, self.retries), tasks, chunksize=1
+        )
+
+    def shutdown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class FuturesExecutor(Executor):
+    """Workers of a concurrent.futures.ProcessPoolExecutor
+
+    Failed tasks are submitted again by the parent. At most `num_workers`
+    tasks are submitted at once, so that the order of the tasks is kept.
+    """
+
+    def __init__(self, num_workers: int = None, retries: int = 0, memory_limit=None):
+        super().__init__(num_workers, retries)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_limit_memory,
+            initargs=(memory_limit,),
+        )
+
+    def map_unordered(self, function, tasks, memory_estimates=None):
+        pending_tasks = iter(tasks)
+        running = dict()
+        attempts = dict()
+
+        def submit(task, attempt=0):
+            future = self.pool.submit(function, task)
+            running[future] = task
+            attempts[future] = attempt
+
+        for task in pending_tasks:
+            submit(task)
+            if len(running) == self.num_workers:
+                break
+        while running:
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                task = running.pop(future)
+                attempt = attempts.pop(future)
+                if future.exception() is not None:
+                    if attempt >= self.retries:
+                        raise future.exception()
+                    submit(task, attempt + 1)
+                    continue
+                yield future.result()
+                task = next(pending_tasks, None)
+                if task is not None:
+                    submit(task)
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class AdaptiveExecutor(Executor):
+    """Workers of a process pool that only start days which fit into memory
+
+    The tasks are started in the given order while their expected peak
+    memory fits into the headroom: the available memory of the system minus
+    a `reserve` (a fraction of the physical memory), minus what the running
+    tasks are still expected to allocate beyond the current memory of the
+    workers. If the next task does not fit, the first later task that fits
+    is started instead, and a task is always started if none is running.
+    `memory_limit` additionally caps the memory of all workers together.
+
+    Workers are replaced after `max_tasks_per_child` tasks, by default after
+    every task, so that fragmented memory is returned to the system. Outside
+    of Linux, the peak memory of a task in a reused worker also includes that
+    of its earlier tasks. Tasks that fail are retried `retries` times. If a
+    worker dies, e.g. by the OOM killer, the pool breaks and all tasks that
+    were running in it fail. These are started again up to `crash_retries`
+    times, in a new pool and with twice their memory estimate, so that they
+    run with fewer other tasks next to them.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = None,
+        retries: int = 0,
+        memory_limit: int = None,
+        reserve: float = 0.1,
+        max_tasks_per_child: int = 1,
+        poll_interval: float = 0.5,
+        crash_retries: int = 2,
+    ):
+        super().__init__(num_workers, retries)
+        self.memory_limit = memory_limit
+        self.crash_retries = crash_retries
+        self.reserve = reserve * total_memory()
+        self.max_tasks_per_child = max_tasks_per_child
+        self.poll_interval = poll_interval
+        self.pool = self.new_pool()
+
+    def new_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.num_workers, max_tasks_per_child=self.max_tasks_per_child
+        )
+
+    def headroom(self, running: Dict) -> float:
+        """Memory in bytes that another task may use"""
+        expected_memory = sum(estimate for _, estimate, _, _, _ in running.values())
+        worker_memory = sum(
+            resident_memory(process.pid)
+            for process in multiprocessing.active_children()
+        )
+        headroom = (
+            available_memory() - self.reserve - max(expected_memory - worker_memory, 0)
+        )
+        if self.memory_limit is not None:
+            headroom = min(
+                headroom, self.memory_limit - max(expected_memory, worker_memory)
+            )
+        return headroom
+
+    def submit(self, function, task, estimate, attempt, crashes, running: Dict):
+        """Start a task in the current pool and add it to the running tasks"""
+        future = self.pool.submit(function, task)
+        running[future] = (task, estimate, attempt, crashes, self.pool)
+
+    def map_unordered(self, function, tasks, memory_estimates=None):
+        if memory_estimates is None:
+            memory_estimates = [0] * len(tasks)
+        # task, expected peak memory, failed attempts, crashed attempts
+        pending = [
+            (task, estimate, 0, 0) for task, estimate in zip(tasks, memory_estimates)
+        ]
+        running = dict()
+        while pending or running:
+            while pending and len(running) < self.num_workers:
+                headroom = self.headroom(running)
+                index = next(
+                    (
+                        index
+                        for index, (_, estimate, _, _) in enumerate(pending)
+                        if estimate <= headroom
+                    ),
+                    None if running else 0,
+                )
+                if index is None:
+                    break
+                self.submit(function, *pending.pop(index), running)
+
+            done, _ = concurrent.futures.wait(
+                running,
+                timeout=self.poll_interval,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                task, estimate, attempt, crashes, pool = running.pop(future)
+                exception = future.exception()
+                if exception is None:
+                    yield future.result()
+                    continue
+                if isinstance(exception, BrokenProcessPool):
+                    if crashes >= self.crash_retries:
+                        raise exception
+                    if pool is self.pool:
+                        # all tasks of a broken pool fail, start a new one
+                        self.pool.shutdown(wait=False)
+                        self.pool = self.new_pool()
+                    pending.insert(0, (task, 2 * estimate, attempt, crashes + 1))
+                    continue
+                if attempt >= self.retries:
+                    raise exception
+                pending.insert(0, (task, estimate, attempt + 1, crashes))
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class DaskExecutor(Executor):
+    """Workers of a dask.distributed cluster
+
+    `locality` maps a task to the workers, host names or addresses, that
+    should run it, e.g. the hosts that store its file on a local disk. Other
+    workers may still run it once these are busy. `resources` are the
+    abstract worker resources that every task needs. The tasks are given
+    decreasing priorities, so that they start in the given order. The
+    `memory_limit` of each worker only applies to a local cluster; the
+    workers of an existing cluster set their own, e.g. with
+    `dask-worker --memory-limit`.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = None,
+        retries: int = 0,
+        scheduler_address: str = None,
+        resources: Dict[str, float] = None,
+        locality: Callable[[object], Optional[List[str]]] = None,
+        memory_limit: int = None,
+    ):
+        if not DASK_AVAILABLE:
+            raise ImportError("DaskExecutor needs dask.distributed")
+        if scheduler_address is not None and memory_limit is not None:
+            raise ValueError(
+                "The memory limit of the workers of an existing cluster is set "
+                "when they are started, not by the client"
+            )
+        super().__init__(num_workers, retries)
+        self.resources = resources
+        self.locality = locality
+        if scheduler_address is None:
+            self.cluster = LocalCluster(
+                n_workers=self.num_workers,
+                threads_per_worker=1,
+                processes=True,
+                memory_limit=memory_limit or "auto",
+                resources=resources,
+            )
+            self.client = Client(self.cluster)
+        else:
+            self.cluster = None
+            self.client = Client(scheduler_address)
+            self.num_workers = len(self.client.scheduler_info()["workers"])
+
+    def map_unordered(self, function, tasks, memory_estimates=None):
+        futures = list()
+        for index, task in enumerate(tasks):
+            workers = self.locality(task) if self.locality is not None else None
+            futures.append(
+                self.client.submit(
+                    function,
+                    task,
+                    priority=-index,
+                    retries=self.retries,
+                    resources=self.resources,
+                    workers=workers,
+                    allow_other_workers=workers is not None,
+                    pure=False,
+                )
+            )
+        for future in as_completed(futures):
+            yield future.result()
+            future.release()
+
+    def shutdown(self):
+        self.client.close()
+        if self.cluster is not None:
+            self.cluster.close()
+
+
+def locality_by_directory(hosts: Dict[Path, List[str]]) -> Callable:
+    """Locality of tasks whose file is in one of the directories of `hosts`
+
+    E.g. {Path("/mnt/node1/ITCH_market_data"): ["node1"]}, for DaskExecutor.
+    """
+
+    def locality(task) -> Optional[List[str]]:
+        file_path = task[0]
+        for directory, directory_hosts in hosts.items():
+            if Path(directory) in file_path.parents:
+                return directory_hosts
+        return None
+
+    return locality
+
+
+def make_executor(name: str, **options) -> Executor:
+    """An executor by its name in EXECUTORS, with the options of its backend"""
+    executor_types = {
+        "adaptive": AdaptiveExecutor,
+        "pool": PoolExecutor,
+        "futures": FuturesExecutor,
+        "dask": DaskExecutor,
+    }
+    if name not in executor_types:
+        raise ValueError(f"unknown executor {name}, use one of {EXECUTORS}")
+    return executor_types[name](**options)
@@ -3,70 +3,470 @@
 """
 
 # standard libraries
+import argparse
+import json
+from collections import defaultdict
+from functools import partial
 from multiprocessing import Pool
 import os
 from pathlib import Path
-from typing import List, Iterator, Dict
+import socket
+import time
+from typing import Dict, List, Iterator, Tuple
 
 # third-party packages
 import pandas as pd
 from tqdm import tqdm
 
-from calculate_statistics.calculate_all import calculate_orderbook_stats
-from process_messages.process_one_day import SingleDayIMIData
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    calculate_orderbook_stats,
+)
+from executors import EXECUTORS, Executor, locality_by_directory, make_executor
+from process_messages.checkpoints import (
+    get_checkpoint_dir,
+    list_checkpoints,
+    remove_checkpoints,
+)
+from process_messages.parquet_cache import (
+    PYARROW_AVAILABLE,
+    get_checksum,
+    get_date,
+    load_day_cache,
+    write_day_cache,
+)
+from process_messages.process_one_day import OrderbookFilter, SingleDayIMIData
+from process_messages.profiling import (
+    DayProfile,
+    aggregate_profiles,
+    peak_memory,
+    reset_peak_memory,
+)
+from results_manifest import ResultsManifest, write_day_results
+from scheduling import (
+    RuntimeProfile,
+    estimate_memory,
+    estimate_runtimes,
+    get_default_workers,
+    order_largest_first,
+)
+
+DATA_PATH = Path.home() / "data/ITCH_market_data"
+
+# the same selection as in calculate_orderbook_stats, applied while parsing:
+# Blue Chips and Mid-/Small-Caps that are traded in CHF
+ORDERBOOK_FILTER = OrderbookFilter(groups=["ACoK", "ABck"], currencies=["CHF"])
+# seconds between checkpoints of the replay state of a day, e.g. 3600, so that
+# a day whose worker died is resumed at its last trading hour (None: disabled,
+# checkpoints are only taken by the python engine)
+CHECKPOINT_INTERVAL = None
+# parsed days are cached here, e.g. DATA_PATH / "parsed", so that changes of
+# the statistics do not need another replay (None: disabled, see also
+# --parquet-cache). The cache needs pyarrow and several GB of disk space.
+PARQUET_CACHE_DIR = None
+# hosts of a dask cluster that store some of the days on a local disk, e.g.
+# {Path("/mnt/node1/ITCH_market_data"): ["node1"]}, so that these days are
+# processed there (None: no preference)
+DATA_HOSTS = None
+# time-weighted spreads and depths are integrated during the replay in this
+# window (None: record all events instead). Days that are written to the
+# Parquet cache always record all events, which the cache stores.
+TIME_WEIGHTED_WINDOW = (START_MICROSECOND, END_MICROSECOND)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Daily liquidity statistics")
+    parser.add_argument(
+        "--pattern", default="*.bin", help="pattern of the days, e.g. *2019*.bin"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="only process days that are new or changed since the last run",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=get_default_workers(),
+        help="number of worker processes (default: all cores but one)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=EXECUTORS,
+        default="adaptive",
+        help="backend of the workers (default: a local pool that admits days "
+        "while there is enough memory for them)",
+    )
+    parser.add_argument(
+        "--scheduler-address",
+        help="dask scheduler to connect to, e.g. tcp://10.0.0.1:8786 "
+        "(default: a local cluster)",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=0, help="how often a failed day is retried"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=float,
+        help="memory limit in bytes, e.g. 8e9, of all workers together (adaptive) "
+        "or of each worker (pool, futures, dask without --scheduler-address)",
+    )
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        help="replace local workers after this many tasks (default: after every "
+        "task for adaptive, never for pool)",
+    )
+    parser.add_argument(
+        "--parquet-cache",
+        type=Path,
+        default=PARQUET_CACHE_DIR,
+        metavar="DIR",
+        help="cache the parsed days in this directory, and reuse them if the "
+        "binary files did not change (needs pyarrow)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile the message types and statistics stages of each day "
+        "(replays with the python engine)",
+    )
+    parser.add_argument(
+        "--resources",
+        nargs="*",
+        default=[],
+        help="dask worker resources that each day needs, e.g. memory=8e9",
+    )
+    return parser.parse_args()
+
+
+def get_executor(arguments: argparse.Namespace) -> Executor:
+    """Executor of the chosen backend, with the options that it supports"""
+    options = {"num_workers": arguments.workers, "retries": arguments.retries}
+    if arguments.memory_limit is not None:
+        options["memory_limit"] = int(arguments.memory_limit)
+    if arguments.max_tasks_per_child is not None:
+        if arguments.executor not in ("adaptive", "pool"):
+            raise ValueError(
+                "--max-tasks-per-child needs the adaptive or pool executor"
+            )
+        options["max_tasks_per_child"] = arguments.max_tasks_per_child
+    if arguments.executor == "dask":
+        options["scheduler_address"] = arguments.scheduler_address
+        if arguments.resources:
+            options["resources"] = {
+                name: float(amount)
+                for name, amount in (
+                    resource.split("=") for resource in arguments.resources
+                )
+            }
+        if DATA_HOSTS is not None:
+            options["locality"] = locality_by_directory(DATA_HOSTS)
+    elif arguments.resources:
+        raise ValueError("--resources needs the dask executor")
+    return make_executor(arguments.executor, **options)
 
 
 def main():
+    arguments = parse_arguments()
 
     start_time = pd.Timestamp("now").strftime("%Y.%m.%d %H:%M:%S")
     print(f"Started at {start_time}")
 
-    data_path = Path.home() / "data/ITCH_market_data/unzipped"
-    pattern = "*.bin"  # *2019
+    data_path = DATA_PATH
+    pattern = arguments.pattern
     print(f"Considering files with pattern {pattern}")
 
-    num_files = len(list(data_path.glob(pattern)))
-    print(f"\nProcessing {num_files} trading days...")
+    binary_file_paths = find_binary_files(data_path, pattern)
+    stats_path = Path("statistics/daily_liquidity")
+    manifest = ResultsManifest(stats_path)
+    if arguments.resume:
+        pending_file_paths = [
+            path for path in binary_file_paths if not manifest.is_done(path)
+        ]
+        print(f"{len(binary_file_paths) - len(pending_file_paths)} days are up to date")
+    else:
+        pending_file_paths = binary_file_paths
+    print(f"\nProcessing {len(pending_file_paths)} trading days...")
+    if arguments.parquet_cache is not None:
+        if not PYARROW_AVAILABLE:
+            raise ImportError("The Parquet cache needs pyarrow to be installed")
+        print(f"Caching the parsed days in {arguments.parquet_cache}")
 
-    binary_file_paths = data_path.glob(pattern)
-    results = load_and_process_all(binary_file_paths)
+    with get_executor(arguments) as executor:
+        runtime_profile = load_and_process_all(
+            pending_file_paths,
+            manifest,
+            executor=executor,
+            profile=arguments.profile,
+            parquet_cache_dir=arguments.parquet_cache,
+        )
 
     # save to csv
-    stats_path = Path("statistics/daily_liquidity")
     stats_path.mkdir(parents=True, exist_ok=True)
     timestamp = pd.Timestamp("now").strftime("%Y%m%d_%H-%M-%S")
+    profile_path = stats_path / "runtimes" / f"{timestamp}_runtime_profile.csv"
+    runtime_profile.save(profile_path)
+    summary = runtime_profile.summary()
+    print(
+        f"Makespan {summary['makespan']:.1f}s, lower bound "
+        f"{summary['lower_bound']:.1f}s ({summary['efficiency']:.0%}), "
+        f"runtimes saved to {profile_path}"
+    )
+    if runtime_profile.day_profiles:
+        save_run_profile(
+            runtime_profile.day_profiles,
+            stats_path / "runtimes" / f"{timestamp}_profile.json",
+        )
     filepath = stats_path / f"{timestamp}_liquidity_stats.csv"
-    results.to_csv(filepath, float_format="%g")
+    manifest.write_panel(binary_file_paths, filepath, float_format="%g")
     print(f"Saved statistics to {filepath}")
 
     print(f"\n {5*'    '} <<<<< Done >>>>> \n")
 
 
-def load_and_process_all(file_paths: Iterator[Path]) -> List[Dict]:
-    with Pool(processes=os.cpu_count() - 1) as pool:
-        daily_stats = list()
-        parallel_processes = pool.imap_unordered(
-            load_and_process_orderbook_stats, file_paths,
+def find_binary_files(data_path: Path, pattern: str) -> List[Path]:
+    """Collect the unzipped days and the zipped days that are not unzipped yet
+
+    Zipped files are parsed directly, so running unzip_files.py is optional.
+    """
+    file_paths = {
+        path.name: path for path in (data_path / "zipped").glob(pattern + ".gz")
+    }
+    for path in (data_path / "unzipped").glob(pattern):
+        file_paths[path.name + ".gz"] = path
+    return sorted(file_paths.values())
+
+
+def load_and_process_all(
+    file_paths: Iterator[Path],
+    manifest: ResultsManifest,
+    num_shards: int = 1,
+    executor: Executor = None,
+    profile: bool = False,
+    parquet_cache_dir: Path = None,
+) -> RuntimeProfile:
+    """Process all days in parallel and write the results of each day
+
+    The days are started longest first, as expected from their runtimes in
+    earlier runs or their file sizes, and handed out one at a time. Their
+    expected peak memory is estimated the same way, for executors that only
+    start days while there is enough memory. The
+    results of a day are written and recorded in the manifest as soon as the
+    day is done. The workers write the results themselves and only send back
+    a small status record. With `num_shards` > 1, each day is additionally split into
+    shards of orderbooks, so that more workers than days can be kept busy.
+    Since all statistics are calculated per orderbook, the results of the
+    shards are simply concatenated. Without an executor, the days are
+    processed by a local pool. With `profile`, every day is profiled and its
+    profile is saved next to its results. With a `parquet_cache_dir`, parsed
+    days are cached there and reused.
+    """
+    if executor is None:
+        with make_executor("adaptive") as executor:
+            return load_and_process_all(
+                file_paths, manifest, num_shards, executor, profile, parquet_cache_dir
+            )
+
+    file_paths = list(file_paths)
+    estimates = estimate_runtimes(file_paths, manifest.days)
+    tasks = order_largest_first(
+        [
+            (file_path, num_shards, shard)
+            for file_path in file_paths
+            for shard in range(num_shards)
+        ],
+        estimates,
+    )
+    memory_estimates = estimate_memory(file_paths, manifest.days)
+
+    # results of earlier runs, possibly with other shards, are replaced
+    for file_path in file_paths:
+        manifest.clear(file_path)
+
+    runtime_profile = RuntimeProfile(executor.num_workers)
+    shard_statuses = defaultdict(list)
+    # workers on other hosts need the absolute path of the shared results
+    parallel_processes = executor.map_unordered(
+        partial(
+            process_task,
+            days_path=manifest.days_path.resolve(),
+            profile=profile,
+            parquet_cache_dir=parquet_cache_dir,
+        ),
+        tasks,
+        memory_estimates=[memory_estimates[file_path] for file_path, _, _ in tasks],
+    )
+    for status in tqdm(parallel_processes, total=len(tasks)):
+        file_path = status["file_path"]
+        runtime_profile.add(file_path, estimates[file_path] / num_shards, status)
+        shard_statuses[file_path].append(status)
+        if len(shard_statuses[file_path]) == num_shards:
+            statuses = shard_statuses.pop(file_path)
+            results_files = [
+                status["results_file"]
+                for status in statuses
+                if status["results_file"] is not None
+            ]
+            # days that were cached have already been hashed by their worker
+            checksums = [
+                status["checksum"]
+                for status in statuses
+                if status["checksum"] is not None
+            ]
+            manifest.add(
+                file_path,
+                results_files[0] if results_files else None,
+                runtime=sum(
+                    status["finished"] - status["started"] for status in statuses
+                ),
+                peak_memory=max(status["peak_memory"] for status in statuses),
+                checksum=checksums[0] if checksums else None,
+            )
+    return runtime_profile
+
+
+def process_task(
+    task: Tuple[Path, int, int],
+    days_path: Path,
+    profile: bool = False,
+    parquet_cache_dir: Path = None,
+) -> Dict:
+    """Write the statistics of a day, or of one of its shards
+
+    Returns where they were written, when the task ran, the peak memory of
+    the task, the profile of the day if it was profiled and the
+    checksum of the file if it was calculated for the Parquet cache.
+    """
+    file_path, num_shards, shard = task
+    # workers that run several tasks only measure the peak of this one
+    reset_peak_memory()
+    date = get_date(file_path)
+    day_profile = DayProfile(date) if profile else None
+    started = time.time()
+    checksum = None
+    if num_shards > 1:
+        single_day_stats = load_and_process_shard_stats(task, day_profile)
+    else:
+        if parquet_cache_dir is not None:
+            checksum = get_checksum(file_path)
+        single_day_stats = load_and_process_orderbook_stats(
+            file_path, day_profile, parquet_cache_dir, checksum
         )
-        for single_day_statistics_output in tqdm(parallel_processes):
-            daily_stats.append(single_day_statistics_output)
+    results_file = write_day_results(single_day_stats, days_path, date, shard)
+    if day_profile is not None:
+        profile_name = date if num_shards == 1 else f"{date}-{shard}"
+        day_profile.save(days_path.parent / "profiles" / f"{profile_name}.json")
+    return {
+        "file_path": file_path,
+        "results_file": results_file,
+        "rows": len(single_day_stats),
+        "worker": f"{socket.gethostname()}:{os.getpid()}",
+        "started": started,
+        "finished": time.time(),
+        "peak_memory": peak_memory(),
+        "profile": None if day_profile is None else day_profile.to_dict(),
+        "checksum": checksum,
+    }
 
-    # combine all days into one big dataframe
-    # each row corresponds to a stock/day combination
-    results = pd.concat(daily_stats, sort=False)
-    del daily_stats
-    results.reset_index(inplace=True)
-    results.set_index("isin", inplace=True)
-    results.rename(columns={"index": "orderbook_no"}, inplace=True)
-    return results
 
+def save_run_profile(day_profiles: List[Dict], file_path: Path):
+    """Aggregate the profiles of the days of a run, and print the slowest parts"""
+    run_profile = aggregate_profiles(day_profiles)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "w") as profile_file:
+        json.dump(run_profile, profile_file, indent=1)
+    print(
+        f"Replayed {run_profile['messages']} messages in "
+        f"{run_profile['replay_seconds']:.1f}s "
+        f"({run_profile['messages_per_second'] or 0:,.0f} msgs/s), "
+        f"peak memory {run_profile['peak_memory'] / 1024 ** 2:,.0f} MB"
+    )
+    for key in ["message_types", "stages"]:
+        slowest = list(run_profile[key].items())[:3]
+        print(
+            f"Slowest {key.replace('_', ' ')}: "
+            + ", ".join(f"{name} {totals['seconds']:.1f}s" for name, totals in slowest)
+        )
+    print(f"Profile saved to {file_path}")
+
+
+def load_and_process_orderbook_stats(
+    file_path: Path,
+    profile: DayProfile = None,
+    parquet_cache_dir: Path = None,
+    checksum: str = None,
+):
+    if parquet_cache_dir is not None:
+        if checksum is None:
+            checksum = get_checksum(file_path)
+        cached_day = load_day_cache(
+            file_path, parquet_cache_dir, ORDERBOOK_FILTER, checksum
+        )
+        if cached_day is not None:
+            return calculate_orderbook_stats(cached_day, profile)
 
-def load_and_process_orderbook_stats(file_path: Path):
-    this_day_imi_data = SingleDayIMIData(file_path)
+    checkpoint_dir = get_checkpoint_dir(file_path)
+    if list_checkpoints(checkpoint_dir):
+        # an earlier worker died while processing this day
+        this_day_imi_data = SingleDayIMIData.from_checkpoint(file_path)
+        if profile is not None:
+            # only the rest of the day is profiled
+            this_day_imi_data.profile = profile
+    else:
+        this_day_imi_data = SingleDayIMIData(
+            file_path,
+            orderbook_filter=ORDERBOOK_FILTER,
+            checkpoint_interval=CHECKPOINT_INTERVAL,
+            # the cache stores all events
+            time_weighted_window=(
+                TIME_WEIGHTED_WINDOW if parquet_cache_dir is None else None
+            ),
+            profile=profile,
+        )
     this_day_imi_data.process_messages()
-    single_day_stats = calculate_orderbook_stats(this_day_imi_data)
+    if parquet_cache_dir is not None:
+        write_day_cache(this_day_imi_data, parquet_cache_dir, checksum)
+    single_day_stats = calculate_orderbook_stats(this_day_imi_data, profile)
+    this_day_imi_data.close()
+    remove_checkpoints(checkpoint_dir)
     return single_day_stats
 
 
+def load_and_process_shard(
+    task: Tuple[Path, int, int], profile: DayProfile = None
+) -> SingleDayIMIData:
+    """Replay only the orderbooks of one shard of a day"""
+    file_path, num_shards, shard = task
+    orderbook_filter = ORDERBOOK_FILTER.for_shard(num_shards, shard)
+    this_shard = SingleDayIMIData(
+        file_path,
+        orderbook_filter=orderbook_filter,
+        time_weighted_window=TIME_WEIGHTED_WINDOW,
+        profile=profile,
+    )
+    this_shard.process_messages()
+    this_shard.close()
+    return this_shard
+
+
+def load_and_process_shard_stats(
+    task: Tuple[Path, int, int], profile: DayProfile = None
+) -> pd.DataFrame:
+    return calculate_orderbook_stats(load_and_process_shard(task, profile), profile)
+
+
+def load_and_process_sharded(file_path: Path, num_shards: int) -> SingleDayIMIData:
+    """Replay a single day on `num_shards` workers, split by orderbook number
+
+    The shards are merged into one SingleDayIMIData, e.g. to debug a day.
+    """
+    tasks = [(file_path, num_shards, shard) for shard in range(num_shards)]
+    with Pool(processes=num_shards) as pool:
+        shards = pool.map(load_and_process_shard, tasks)
+    return SingleDayIMIData.merge(shards)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Time-weighted averages of the best levels, integrated during the replay
+
+The accumulators are drop-in replacements for the recorders of best prices
+and depths. Instead of keeping every event, they integrate the quoted spread
+and the depth at best over time and yield the same averages as
+calculate_best_bid_ask_statistics and calculate_best_depth_statistics, with
+constant memory.
+"""
+
+# standard libraries
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# third-party packages
+import numpy as np
+
+from .buffers import BestDepthRecorder, BestPriceRecorder
+
+# price of market orders, which do not set a best price
+MARKET_ORDER_PRICE = 2147483647
+
+
+class TimeWeightedAccumulator(object):
+    """Time-weighted average over the rows of a stream of best level events
+
+    Events with the same timestamp form one row, where the last event per
+    book side wins. Each row is valid until the next row and is weighted by
+    that duration, so the last row never counts. Rows within trading halts
+    (from a 'T' trading action whose book condition is not 'N' up to and
+    including the next 'T' trading action) are excluded. As halts end only
+    after the rows they contain, the weighted sums are kept per stretch
+    between two 'T' trading actions and per trading action timestamp, and
+    the halts are only applied in `time_weighted_average`.
+    """
+
+    def __init__(
+        self,
+        start_microsecond: int,
+        end_microsecond: int,
+        trading_actions: List[Tuple[int, bytes, bytes]],
+    ):
+        self.start_microsecond = start_microsecond
+        self.end_microsecond = end_microsecond
+        # shared with SingleDayIMIData.trading_actions, filled during the replay
+        self.trading_actions = trading_actions
+        self.number_of_trading_actions = 0
+        self.action_timestamps = list()
+        self.action_conditions = list()
+
+        # sums and durations per (stretch, is at a trading action)
+        self.weighted_sums: Dict[Tuple[int, bool], float] = dict()
+        self.durations: Dict[Tuple[int, bool], int] = dict()
+
+        self.row_timestamp = None
+        self.row_updates = dict()
+        # the latest row, valid until the next one
+        self.valid_since = None
+        self.valid_value = None
+
+    def append(self, timestamp: int, book_side: bytes, value: float):
+        if timestamp != self.row_timestamp:
+            if self.row_timestamp is not None:
+                self.close_row(self.row_timestamp, self.row_updates)
+            self.row_timestamp = timestamp
+            self.row_updates = dict()
+        self.row_updates[book_side] = value
+
+    def extend(self, events: np.ndarray):
+        """Append events given as a structured array of the recorder's fields"""
+        for timestamp, book_side, value in zip(
+            *[events[name].tolist() for name in events.dtype.names]
+        ):
+            self.append(timestamp, book_side, value)
+
+    def close_row(self, timestamp: int, updates: Dict[bytes, float]):
+        raise NotImplementedError
+
+    def add_row(self, timestamp: int, value):
+        """Close the validity of the previous row, `value` None if not counted"""
+        if self.valid_value is not None:
+            duration = timestamp - self.valid_since
+            stretch = self.get_stretch(self.valid_since)
+            self.durations[stretch] = self.durations.get(stretch, 0) + duration
+            # like the NaN-skipping sums of pandas
+            if self.valid_value == self.valid_value:
+                self.weighted_sums[stretch] = (
+                    self.weighted_sums.get(stretch, 0.0) + self.valid_value * duration
+                )
+        self.valid_since = timestamp
+        self.valid_value = value
+
+    def update_trading_actions(self):
+        """Pick up the 'T' trading actions that were added since the last call"""
+        trading_actions = self.trading_actions
+        for timestamp, trading_state, book_condition in trading_actions[
+            self.number_of_trading_actions :
+        ]:
+            if trading_state == b"T":
+                self.action_timestamps.append(timestamp)
+                self.action_conditions.append(book_condition)
+        self.number_of_trading_actions = len(trading_actions)
+
+    def get_stretch(self, timestamp: int) -> Tuple[int, bool]:
+        if len(self.trading_actions) != self.number_of_trading_actions:
+            self.update_trading_actions()
+        position = bisect_left(self.action_timestamps, timestamp)
+        is_at_action = (
+            position < len(self.action_timestamps)
+            and self.action_timestamps[position] == timestamp
+        )
+        return position, is_at_action
+
+    def is_halted(self, stretch: Tuple[int, bool], halts: List[Tuple[int, int]]):
+        position, is_at_action = stretch
+        timestamps = self.action_timestamps
+        if is_at_action:
+            return any(start <= timestamps[position] <= until for start, until in halts)
+        if position == 0 or position == len(timestamps):
+            # halts always end at a trading action
+            return False
+        return any(
+            start <= timestamps[position - 1] and until >= timestamps[position]
+            for start, until in halts
+        )
+
+    def time_weighted_average(self) -> float:
+        """Average over all rows so far, NaN if no time was counted"""
+        self.update_trading_actions()
+        # the latest row is still open and only ends the one before it
+        if self.row_timestamp is not None:
+            self.close_row(self.row_timestamp, self.row_updates)
+            self.row_timestamp = None
+            self.row_updates = dict()
+
+        halts = [
+            (start, until)
+            for start, until, book_condition in zip(
+                self.action_timestamps,
+                self.action_timestamps[1:],
+                self.action_conditions,
+            )
+            if book_condition != b"N"
+        ]
+        total_time = 0
+        weighted_sum = 0.0
+        for stretch, duration in self.durations.items():
+            if not self.is_halted(stretch, halts):
+                total_time += duration
+                weighted_sum += self.weighted_sums.get(stretch, 0.0)
+        if total_time > 0:
+            return weighted_sum / total_time
+        return np.nan
+
+
+class TimeWeightedSpread(TimeWeightedAccumulator):
+    """Relative quoted spread in percent, weighted by time
+
+    Replaces a BestPriceRecorder. Best prices are carried forward from the
+    start of the day, market order prices are ignored and rows without an
+    update of the bid or ask price, as well as crossed books, do not count.
+    """
+
+    dtype = BestPriceRecorder.dtype
+
+    def __init__(self, start_microsecond, end_microsecond, trading_actions):
+        super().__init__(start_microsecond, end_microsecond, trading_actions)
+        self.best_bid = np.nan
+        self.best_ask = np.nan
+        self.book_sides = set()
+
+    def close_row(self, timestamp, updates):
+        updates = {
+            book_side: price
+            for book_side, price in updates.items()
+            if price != MARKET_ORDER_PRICE
+        }
+        if not updates:
+            return
+        self.book_sides.update(updates)
+        best_bid = updates.get(b"B", np.nan)
+        best_ask = updates.get(b"S", np.nan)
+        is_missing = best_bid != best_bid and best_ask != best_ask
+        # empty book sides (NaN) keep the previous best price
+        if best_bid == best_bid:
+            self.best_bid = best_bid
+        if best_ask == best_ask:
+            self.best_ask = best_ask
+
+        value = None
+        if (
+            not is_missing
+            and self.start_microsecond <= timestamp <= self.end_microsecond
+        ):
+            quoted_spread = self.best_ask - self.best_bid
+            if quoted_spread >= 0:
+                mid = (self.best_ask + self.best_bid) * 0.5
+                value = quoted_spread / mid * 100
+        self.add_row(timestamp, value)
+
+    def time_weighted_average(self) -> float:
+        average = super().time_weighted_average()
+        if not {b"B", b"S"} <= self.book_sides:
+            return np.nan
+        return average
+
+
+class TimeWeightedDepth(TimeWeightedAccumulator):
+    """Sum of the depth at the best bid and ask, weighted by time
+
+    Replaces a BestDepthRecorder. Only rows within the window count, and the
+    depths are carried forward from the start of the window (0 before the
+    first update of a book side).
+    """
+
+    dtype = BestDepthRecorder.dtype
+
+    def __init__(
+        self, start_microsecond, end_microsecond, trading_actions, price_decimals
+    ):
+        super().__init__(start_microsecond, end_microsecond, trading_actions)
+        self.price_scale = 10 ** price_decimals
+        self.depths = {b"B": 0.0, b"S": 0.0}
+
+    def close_row(self, timestamp, updates):
+        if not self.start_microsecond <= timestamp <= self.end_microsecond:
+            return
+        for book_side in [b"B", b"S"]:
+            depth = updates.get(book_side, np.nan)
+            # empty book sides (NaN) keep the previous depth
+            if depth == depth:
+                self.depths[book_side] = depth
+        self.add_row(
+            timestamp, (self.depths[b"B"] + self.depths[b"S"]) / self.price_scale
+        )
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Point-in-time queries of full-depth order books
+
+One replay of the day keeps the live orders of all orderbooks at a fixed
+interval. A query starts from the latest of these checkpoints before the
+requested time and replays only the messages of its own orderbook from there,
+looked up in the message index, instead of the whole day.
+"""
+
+# standard libraries
+from pathlib import Path
+from typing import Callable, Dict
+
+# third-party packages
+import numpy as np
+import pandas as pd
+
+from .decode_kernel import HEADER_LENGTH, MESSAGE_STRUCTS, compile_handler_table
+from . import message_index
+from .order_store import LIVE_ORDER_DTYPE
+from .process_one_day import SingleDayIMIData
+
+# seconds between two checkpoints of the live orders
+CHECKPOINT_INTERVAL = 60
+
+
+class BookQuery(object):
+    """Order books of a single day at arbitrary points in time
+
+    Checkpoints are taken in front of the first 'T' message of every
+    `interval` seconds and hold the live orders of all orderbooks that pass
+    the `orderbook_filter`, sorted by orderbook. Their memory grows with the
+    number of live orders times the number of checkpoints.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        interval: int = CHECKPOINT_INTERVAL,
+        orderbook_filter: Callable[[int, Dict], bool] = None,
+    ):
+        self.file_path = file_path
+        self.interval = interval
+        self.checkpoint_seconds = list()
+        self.checkpoints = list()
+        self.next_checkpoint_second = 0
+
+        # one replay of the whole day that takes the checkpoints
+        imi_data = SingleDayIMIData(
+            file_path, orderbook_filter=orderbook_filter, engine="python"
+        )
+        handlers = imi_data.message_handlers()
+        time_stamp_seconds = handlers[b"T"]
+
+        def time_stamp_seconds_with_checkpoints(seconds):
+            if seconds >= self.next_checkpoint_second:
+                self.take_checkpoint(imi_data, seconds)
+            time_stamp_seconds(seconds)
+
+        handlers[b"T"] = time_stamp_seconds_with_checkpoints
+        imi_data.handler_table = compile_handler_table(handlers)
+        imi_data.process_messages()
+        imi_data.close()
+        self.metadata = imi_data.metadata
+
+        # messages of each orderbook, in the order of the day
+        self.message_index = message_index.load_message_index(file_path)
+        orderbook_nos = self.message_index["orderbook_nos"]
+        sort_order = np.argsort(orderbook_nos, kind="stable")
+        unique_orderbook_nos, starts = np.unique(
+            orderbook_nos[sort_order], return_index=True
+        )
+        self.message_rows = dict(
+            zip(unique_orderbook_nos.tolist(), np.split(sort_order, starts[1:]))
+        )
+        self.data = message_index.read_binary_file(file_path)
+
+    def take_checkpoint(self, imi_data: SingleDayIMIData, seconds: int):
+        """Keep the live orders in front of the 'T' message of `seconds`"""
+        live_orders = imi_data.orders.to_numpy()
+        live_orders = live_orders[
+            np.argsort(live_orders["orderbook_no"], kind="stable")
+        ]
+        self.checkpoint_seconds.append(seconds)
+        self.checkpoints.append(live_orders)
+        self.next_checkpoint_second = (seconds // self.interval + 1) * self.interval
+
+    def close(self):
+        if hasattr(self.data, "close"):
+            self.data.close()
+        self.data = None
+
+    def get_orderbook_no(self, isin: str) -> int:
+        for orderbook_no, metadata in self.metadata.items():
+            if metadata["isin"].decode("utf-8").strip() == isin:
+                return orderbook_no
+        raise KeyError(f"ISIN {isin} was not found")
+
+    def orders_at(self, orderbook_no: int, timestamp: int) -> pd.DataFrame:
+        """Live orders of an orderbook at `timestamp` (microseconds after midnight)
+
+        All messages up to and including `timestamp` are applied. The orders
+        are indexed by their order number.
+        """
+        if orderbook_no not in self.metadata:
+            raise KeyError(f"Orderbook {orderbook_no} was not replayed")
+        second = timestamp // 1_000_000
+
+        checkpoint = np.searchsorted(self.checkpoint_seconds, second, side="right") - 1
+        if checkpoint < 0:
+            start_second = 0
+            live_orders = np.empty(0, dtype=LIVE_ORDER_DTYPE)
+        else:
+            start_second = self.checkpoint_seconds[checkpoint]
+            live_orders = self.checkpoints[checkpoint]
+            start, stop = np.searchsorted(
+                live_orders["orderbook_no"], [orderbook_no, orderbook_no + 1]
+            )
+            live_orders = live_orders[start:stop]
+        orders = {
+            order_no: [book_side, price, quantity]
+            for order_no, book_side, price, quantity in zip(
+                live_orders["order_no"].tolist(),
+                live_orders["book_side"].tolist(),
+                live_orders["price"].tolist(),
+                live_orders["quantity"].tolist(),
+            )
+        }
+
+        # the messages since the checkpoint, up to the second of the query
+        rows = self.message_rows.get(orderbook_no, np.empty(0, dtype=np.int64))
+        seconds = self.message_index["seconds"][rows]
+        start, stop = np.searchsorted(seconds, [start_second, second + 1])
+        self.replay_orders(orders, rows[start:stop], timestamp)
+
+        return pd.DataFrame.from_dict(
+            orders, orient="index", columns=["book_side", "price", "quantity"]
+        )
+
+    def replay_orders(self, orders: Dict[int, list], rows: np.ndarray, timestamp: int):
+        """Apply the messages at `rows` of the index to the live orders"""
+        offsets = self.message_index["offsets"][rows].tolist()
+        seconds = self.message_index["seconds"][rows].tolist()
+        message_types = self.message_index["message_types"][rows].tolist()
+        data = self.data
+        for offset, second, type_byte in zip(offsets, seconds, message_types):
+            message_type = bytes([type_byte])
+            fields = MESSAGE_STRUCTS[message_type].unpack_from(
+                data, offset + HEADER_LENGTH
+            )
+            if second * 1_000_000 + fields[0] // 1000 > timestamp:
+                break
+            if message_type == b"A":
+                _, order_no, book_side, quantity, _, price = fields
+                orders[order_no] = [book_side, price, quantity]
+            elif message_type == b"D":
+                del orders[fields[1]]
+            elif message_type == b"U":
+                _, old_order_no, new_order_no, quantity, price = fields
+                book_side = orders.pop(old_order_no)[0]
+                orders[new_order_no] = [book_side, price, quantity]
+            elif message_type in (b"E", b"C"):
+                order_no, executed_quantity = fields[1], fields[2]
+                orders[order_no][2] -= executed_quantity
+                if orders[order_no][2] == 0:
+                    del orders[order_no]
+
+    def book_at(self, orderbook_no: int, timestamp: int) -> Dict[bytes, pd.Series]:
+        """Full depth of an orderbook at `timestamp` (microseconds after midnight)
+
+        Returns the quantity per price level of every book side, best first.
+        """
+        orders = self.orders_at(orderbook_no, timestamp)
+        book = dict()
+        for book_side in [b"B", b"S", b" "]:
+            levels = (
+                orders[orders["book_side"] == book_side]
+                .groupby("price")["quantity"]
+                .sum()
+            )
+            book[book_side] = levels.sort_index(ascending=book_side != b"B")
+        return book
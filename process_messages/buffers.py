@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Growable typed buffers for the data that is recorded during the replay
+"""
+
+# standard libraries
+from array import array
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+# third-party packages
+import numpy as np
+import pandas as pd
+
+# marks missing values (NaN or None) in integer records
+MISSING = -(2 ** 63)
+
+
+class OrderStatsBuffer(object):
+    """Lifecycle of all orders of one orderbook, one int64 record per order
+
+    Records are appended to a single flat array. The row reference returned
+    by `add` is the position of the record in that array, so updates do not
+    need any lookup. `to_numpy` returns a zero-copy structured view.
+    """
+
+    columns = [
+        "order_no",
+        "entry_time",
+        "price",
+        "best_price",
+        "quantity_entered",
+        "quantity_filled",
+        "first_fill_time",
+        "remove_time",
+    ]
+    # columns that can be missing, they are returned as floats with NaNs
+    nullable_columns = ["best_price", "first_fill_time", "remove_time"]
+    dtype = np.dtype([(column, np.int64) for column in columns])
+
+    def __init__(self):
+        self.records = array("q")
+
+    def __len__(self):
+        return len(self.records) // len(self.columns)
+
+    def add(
+        self, order_no: int, entry_time: int, price: int, best_price, quantity: int
+    ) -> int:
+        """Record a new order and return its row reference"""
+        row = len(self.records)
+        if best_price != best_price:
+            # NaN if the book side was empty
+            best_price = MISSING
+        self.records.extend(
+            (order_no, entry_time, price, best_price, quantity, 0, MISSING, MISSING)
+        )
+        return row
+
+    def extend(self, records: np.ndarray):
+        """Append records given as an int64 array with one row per order"""
+        self.records.frombytes(np.ascontiguousarray(records, dtype=np.int64).tobytes())
+
+    def fill(self, row: int, timestamp: int, executed_quantity: int):
+        records = self.records
+        records[row + 5] += executed_quantity
+        if records[row + 6] == MISSING:
+            records[row + 6] = timestamp
+
+    def remove(self, row: int, timestamp: int):
+        self.records[row + 7] = timestamp
+
+    def to_numpy(self) -> np.ndarray:
+        """Zero-copy structured view (the buffer cannot grow while it exists)"""
+        return np.frombuffer(self.records, dtype=self.dtype)
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per order, indexed by the order number"""
+        records = self.to_numpy()
+        order_stats = pd.DataFrame(
+            {column: records[column] for column in self.columns[1:]},
+            index=pd.Index(records["order_no"]),
+        )
+        for column in self.nullable_columns:
+            is_missing = records[column] == MISSING
+            if is_missing.any():
+                order_stats[column] = np.where(
+                    is_missing, np.nan, records[column].astype(float)
+                )
+        return order_stats
+
+
+class EventRecorder(object):
+    """Events with a fixed schema, packed into one growable byte buffer
+
+    Subclasses define `fields` as (name, struct format character) pairs.
+    Appending an event packs it with a precompiled Struct, so no object is
+    kept per event, and `to_numpy` returns a zero-copy structured view of all
+    events. Prices that are NaN when a book side is empty are float64.
+    """
+
+    fields: List[Tuple[str, str]] = []
+    # one-byte columns that are returned as str instead of bytes
+    string_fields: List[str] = []
+
+    def __init_subclass__(cls):
+        formats = "".join(code for _, code in cls.fields)
+        cls.record = struct.Struct("<" + formats)
+        cls.dtype = np.dtype(
+            [(name, "S1" if code == "c" else "<" + code) for name, code in cls.fields]
+        )
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer) // self.record.size
+
+    def append(self, *values):
+        self.buffer += self.record.pack(*values)
+
+    def extend(self, events: np.ndarray):
+        """Append events given as a structured array with the same fields"""
+        self.buffer += events.astype(self.dtype, copy=False).tobytes()
+
+    def to_numpy(self) -> np.ndarray:
+        """Zero-copy structured view (the buffer cannot grow while it exists)"""
+        return np.frombuffer(self.buffer, dtype=self.dtype)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Zero-copy views of the single columns"""
+        events = self.to_numpy()
+        return {name: events[name] for name in self.dtype.names}
+
+    def to_frame(self) -> pd.DataFrame:
+        events = pd.DataFrame(self.columns())
+        for name in self.string_fields:
+            events[name] = events[name].str.decode("utf-8")
+        return events
+
+
+class BestPriceRecorder(EventRecorder):
+    fields = [("timestamp", "q"), ("book_side", "c"), ("new_best_price", "d")]
+
+
+class BestDepthRecorder(EventRecorder):
+    fields = [("timestamp", "q"), ("book_side", "c"), ("new_depth_at_best", "d")]
+
+
+class TransactionRecorder(EventRecorder):
+    fields = [
+        ("timestamp", "q"),
+        ("price", "q"),
+        ("size", "q"),
+        ("aggressor", "c"),
+        ("best_bid", "d"),
+        ("best_ask", "d"),
+        ("best_bid_quantity", "q"),
+        ("best_ask_quantity", "q"),
+    ]
+    string_fields = ["aggressor"]
+
+
+class SnapshotRecorder(object):
+    """Best bid and ask of all orderbooks at every second of the trading day
+
+    During the replay, orderbooks whose best levels changed are marked in
+    `dirty`, and at the next second only those are logged. `matrix` and
+    `frame` expand the logs into dense arrays over all recorded seconds by
+    filling the latest logged values forward.
+    """
+
+    columns = ["best_bid", "best_ask", "best_bid_quantity", "best_ask_quantity"]
+
+    def __init__(self):
+        self.seconds = array("q")
+        self.dirty = set()
+        # per orderbook: positions in `seconds` and the values logged there
+        self.positions: Dict[int, array] = dict()
+        self.values: Dict[int, array] = dict()
+
+    def __contains__(self, orderbook_no: int) -> bool:
+        return orderbook_no in self.positions
+
+    def add_second(self, seconds: int):
+        # a repeated 'T' message logs into the same second again, the latest
+        # values win
+        if not self.seconds or self.seconds[-1] != seconds:
+            self.seconds.append(seconds)
+
+    def record(
+        self,
+        orderbook_no: int,
+        best_bid,
+        best_ask,
+        best_bid_quantity: int,
+        best_ask_quantity: int,
+    ):
+        """Log the best levels of an orderbook at the latest second"""
+        if orderbook_no not in self.positions:
+            self.positions[orderbook_no] = array("q")
+            self.values[orderbook_no] = array("d")
+        self.positions[orderbook_no].append(len(self.seconds) - 1)
+        self.values[orderbook_no].extend(
+            (best_bid, best_ask, best_bid_quantity, best_ask_quantity)
+        )
+
+    def extend(self, orderbook_no: int, positions: np.ndarray, values: np.ndarray):
+        """Log several seconds of an orderbook at once, values as rows"""
+        if orderbook_no not in self.positions:
+            self.positions[orderbook_no] = array("q")
+            self.values[orderbook_no] = array("d")
+        self.positions[orderbook_no].extend(positions.tolist())
+        self.values[orderbook_no].extend(values.ravel().tolist())
+
+    def update(self, other: "SnapshotRecorder"):
+        """Add the orderbooks of another recorder of the same day"""
+        if self.seconds != other.seconds:
+            raise ValueError("Snapshots were recorded at different seconds")
+        self.positions.update(other.positions)
+        self.values.update(other.values)
+
+    def _fill_forward(self, orderbook_no: int, start: int, stop: int) -> np.ndarray:
+        """Values of one orderbook at the seconds start:stop
+
+        Seconds before the first log of the orderbook are NaN.
+        """
+        if orderbook_no not in self.positions:
+            return np.full((stop - start, len(self.columns)), np.nan)
+        positions = np.frombuffer(self.positions[orderbook_no], dtype=np.int64)
+        values = np.frombuffer(self.values[orderbook_no]).reshape(-1, len(self.columns))
+        latest = np.searchsorted(positions, np.arange(start, stop), side="right") - 1
+        dense = values[latest]
+        dense[latest < 0] = np.nan
+        return dense
+
+    def _second_range(self, start_second: int = None, end_second: int = None):
+        seconds = np.frombuffer(self.seconds, dtype=np.int64)
+        start = 0 if start_second is None else np.searchsorted(seconds, start_second)
+        stop = (
+            seconds.shape[0]
+            if end_second is None
+            else np.searchsorted(seconds, end_second, side="right")
+        )
+        return seconds, int(start), int(stop)
+
+    def matrix(
+        self,
+        orderbook_nos: Iterable[int] = None,
+        start_second: int = None,
+        end_second: int = None,
+    ) -> Dict[str, np.ndarray]:
+        """Dense (orderbooks x seconds) arrays per column, filled forward
+
+        Rows follow `orderbook_nos` (all orderbooks, sorted, by default). Both
+        bounds are inclusive, and seconds before the first log of an
+        orderbook are NaN.
+        """
+        if orderbook_nos is None:
+            orderbook_nos = sorted(self.positions)
+        _, start, stop = self._second_range(start_second, end_second)
+        orderbook_nos = list(orderbook_nos)
+        dense = np.empty((len(orderbook_nos), stop - start, len(self.columns)))
+        for row, orderbook_no in enumerate(orderbook_nos):
+            dense[row] = self._fill_forward(orderbook_no, start, stop)
+        return {column: dense[:, :, i] for i, column in enumerate(self.columns)}
+
+    def frame(
+        self, orderbook_no: int, start_second: int = None, end_second: int = None
+    ) -> pd.DataFrame:
+        """Snapshots of one orderbook, indexed by seconds
+
+        Only the seconds since the orderbook was first logged are included.
+        """
+        seconds, start, stop = self._second_range(start_second, end_second)
+        if orderbook_no in self.positions:
+            start = max(start, self.positions[orderbook_no][0])
+        else:
+            start = stop
+        stop = max(start, stop)
+        dense = self._fill_forward(orderbook_no, start, stop)
+        snapshots = pd.DataFrame(
+            dense, columns=self.columns, index=pd.Index(seconds[start:stop])
+        )
+        for column in ["best_bid_quantity", "best_ask_quantity"]:
+            snapshots[column] = snapshots[column].astype(np.int64)
+        return snapshots
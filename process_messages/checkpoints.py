@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Checkpoints of the replay state of a day, to resume it mid-day
+
+A checkpoint is a pickle of the complete SingleDayIMIData (live orders, book
+levels and all recorded events) without the memory map of the file, taken in
+front of a 'T' message. They are stored as a sidecar directory next to each
+file, one checkpoint per second at which the replay can be resumed.
+"""
+
+# standard libraries
+import os
+from pathlib import Path
+import pickle
+from typing import Dict
+
+CHECKPOINT_DIR_SUFFIX = ".checkpoints"
+CHECKPOINT_SUFFIX = ".ckpt"
+# increase when the replay state changes, older checkpoints are then rejected
+CHECKPOINT_VERSION = 1
+
+
+def get_checkpoint_dir(file_path: Path) -> Path:
+    return file_path.with_name(file_path.name + CHECKPOINT_DIR_SUFFIX)
+
+
+def list_checkpoints(checkpoint_dir: Path) -> Dict[int, Path]:
+    """Checkpoints in a directory by the second at which they resume, sorted"""
+    if not checkpoint_dir.is_dir():
+        return dict()
+    checkpoint_paths = {
+        int(path.stem): path for path in checkpoint_dir.glob("*" + CHECKPOINT_SUFFIX)
+    }
+    return {second: checkpoint_paths[second] for second in sorted(checkpoint_paths)}
+
+
+def save_checkpoint(imi_data, checkpoint_dir: Path, second: int, position: int) -> Path:
+    """Write the replay state in front of the message at `position`
+
+    The checkpoint is written to a temporary file first, so that a worker
+    that is killed while writing never leaves a truncated checkpoint behind.
+    """
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = checkpoint_dir / f"{second:05d}{CHECKPOINT_SUFFIX}"
+    temporary_path = checkpoint_path.with_suffix(".tmp")
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "file_name": imi_data.file_path.name,
+        "file_size": imi_data.file_path.stat().st_size,
+        "second": second,
+        "position": position,
+        "state": imi_data,
+    }
+    with open(temporary_path, "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, checkpoint_path)
+    return checkpoint_path
+
+
+def load_checkpoint(file_path: Path, second: int = None, checkpoint_dir: Path = None):
+    """Replay state of a day at the latest checkpoint at or before `second`
+
+    Without `second`, the latest checkpoint is loaded. The file is opened
+    again, so that `process_messages` continues the replay from there.
+    """
+    if checkpoint_dir is None:
+        checkpoint_dir = get_checkpoint_dir(file_path)
+    checkpoint_paths = [
+        path
+        for checkpoint_second, path in list_checkpoints(checkpoint_dir).items()
+        if second is None or checkpoint_second <= second
+    ]
+    if not checkpoint_paths:
+        raise FileNotFoundError(
+            f"No checkpoint of {file_path.name} in {checkpoint_dir}"
+        )
+    with open(checkpoint_paths[-1], "rb") as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    if checkpoint["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"{checkpoint_paths[-1]} has an outdated checkpoint version")
+    if (
+        checkpoint["file_name"] != file_path.name
+        or checkpoint["file_size"] != file_path.stat().st_size
+    ):
+        raise ValueError(f"{checkpoint_paths[-1]} is not a checkpoint of {file_path}")
+
+    imi_data = checkpoint["state"]
+    imi_data.file_path = file_path
+    imi_data.open_file()
+    imi_data.current_position = checkpoint["position"]
+    return imi_data
+
+
+def remove_checkpoints(checkpoint_dir: Path):
+    """Delete all checkpoints of a day, e.g. once it is processed completely"""
+    for checkpoint_path in list_checkpoints(checkpoint_dir).values():
+        checkpoint_path.unlink()
+    if checkpoint_dir.is_dir() and not any(checkpoint_dir.iterdir()):
+        checkpoint_dir.rmdir()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Vectorized two-pass decoding of IMI messages into NumPy structured arrays
+
+The first pass only walks the length-prefixed framing and records where each
+message starts and which type it has. The second pass gathers all messages of
+one type at once and reinterprets their bytes as a big-endian structured array.
+"""
+
+# standard libraries
+from array import array
+import re
+import struct
+from typing import Dict, List, Tuple
+
+# third-party packages
+import numpy as np
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # used as @njit(...) only
+        return lambda function: function
+
+
+from .decode_kernel import HEADER_LENGTH, MESSAGE_FORMATS
+
+# field names of the decoded message types, in the order of their layouts in
+# decode_kernel.MESSAGE_FORMATS
+MESSAGE_FIELDS = {
+    b"A": ["nanoseconds", "order_no", "book_side", "quantity", "orderbook_no", "price"],
+    b"D": ["nanoseconds", "order_no"],
+    b"U": ["nanoseconds", "old_order_no", "new_order_no", "quantity", "price"],
+    b"E": ["nanoseconds", "order_no", "executed_quantity", "match_number"],
+    b"C": [
+        "nanoseconds",
+        "order_no",
+        "executed_quantity",
+        "match_number",
+        "printable",
+        "execution_price",
+    ],
+    b"T": ["seconds"],
+    b"R": [
+        "nanoseconds",
+        "orderbook_no",
+        "price_type",
+        "isin",
+        "currency",
+        "group",
+        "minimum_quantity",
+        "quantity_tick_table_id",
+        "price_tick_table_id",
+        "price_decimals",
+        "delisting_date",
+        "delisting_time",
+    ],
+    b"L": ["nanoseconds", "price_tick_table_id", "price_tick_size", "price_start"],
+    b"H": ["nanoseconds", "orderbook_no", "trading_state", "book_condition"],
+    b"S": ["nanoseconds", "group", "event_code", "orderbook_no"],
+}
+# numpy types of the struct format characters, all fields are big-endian
+FORMAT_DTYPES = {"i": ">i4", "q": ">i8"}
+
+
+def format_to_dtype(message_format: str, names: List[str]) -> np.dtype:
+    """Structured dtype with the same layout as a big-endian struct format"""
+    assert message_format[0] == ">"
+    codes = re.findall(r"(\d*)([a-z])", message_format[1:])
+    assert len(codes) == len(names), (message_format, names)
+    dtype = np.dtype(
+        [
+            (name, f"S{count or 1}" if code == "s" else FORMAT_DTYPES[code])
+            for name, (count, code) in zip(names, codes)
+        ]
+    )
+    assert dtype.itemsize == struct.calcsize(message_format), message_format
+    return dtype
+
+
+MESSAGE_DTYPES = {
+    message_type: format_to_dtype(MESSAGE_FORMATS[message_type], names)
+    for message_type, names in MESSAGE_FIELDS.items()
+}
+
+
+@njit(cache=True)
+def _walk_framing(buffer: np.ndarray) -> np.ndarray:
+    # each message starts where the length of the previous one ends, so the
+    # walk is sequential, it is compiled if numba is installed
+    number_of_messages = 0
+    position = 0
+    while position < buffer.shape[0]:
+        number_of_messages += 1
+        position += buffer[position + 1] + 2
+    offsets = np.empty(number_of_messages, dtype=np.int64)
+    position = 0
+    for index in range(number_of_messages):
+        offsets[index] = position
+        position += buffer[position + 1] + 2
+    return offsets
+
+
+def index_messages(data) -> Tuple[np.ndarray, np.ndarray]:
+    """First pass: walk the framing and return message offsets and types
+
+    The offsets are found by a sequential walk, compiled with numba if it is
+    installed. The types are then gathered at all offsets at once.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if NUMBA_AVAILABLE:
+        offsets = _walk_framing(buffer)
+    else:
+        offsets = array("q")
+        append_offset = offsets.append
+        position = 0
+        number_of_bytes = len(data)
+        while position < number_of_bytes:
+            append_offset(position)
+            position += data[position + 1] + 2
+        offsets = np.frombuffer(offsets, dtype=np.int64)
+    message_types = buffer[offsets + 2].view("S1")
+    return offsets, message_types
+
+
+def gather_messages(buffer: np.ndarray, offsets: np.ndarray, dtype: np.dtype):
+    """Second pass: copy the payloads at `offsets` into one structured array"""
+    payload_starts = offsets + HEADER_LENGTH
+    raw = np.empty((offsets.shape[0], dtype.itemsize), dtype=np.uint8)
+    # one strided copy per byte column keeps the temporary index arrays small
+    for column in range(dtype.itemsize):
+        raw[:, column] = buffer[payload_starts + column]
+    return raw.view(dtype).reshape(-1)
+
+
+class DecodedMessages(object):
+    """Columnar per-type tables of all relevant messages of a single day
+
+    `tables[message_type]` is a big-endian structured array with one row per
+    message of that type. `timestamps[message_type]` holds the corresponding
+    microseconds after midnight (taken from the preceding 'T' message), and
+    `rows` maps every message of the day to its row within its own table, so
+    that the original message order can be reconstructed from `message_types`.
+    """
+
+    def __init__(self, data):
+        self.offsets, self.message_types = index_messages(data)
+        buffer = np.frombuffer(data, dtype=np.uint8)
+
+        self.tables: Dict[bytes, np.ndarray] = dict()
+        self.timestamps: Dict[bytes, np.ndarray] = dict()
+        self.rows = np.zeros(self.offsets.shape[0], dtype=np.int64)
+
+        for message_type, dtype in MESSAGE_DTYPES.items():
+            is_this_type = self.message_types == message_type
+            self.tables[message_type] = gather_messages(
+                buffer, self.offsets[is_this_type], dtype
+            )
+            self.rows[is_this_type] = np.arange(np.count_nonzero(is_this_type))
+
+        # microseconds of the latest 'T' message before each message,
+        # messages before the first 'T' message are counted from midnight
+        seconds_positions = np.flatnonzero(self.message_types == b"T")
+        seconds = self.tables[b"T"]["seconds"].astype(np.int64)
+        microseconds = np.concatenate([[0], seconds * 1_000_000])
+        for message_type, table in self.tables.items():
+            if message_type == b"T":
+                self.timestamps[message_type] = microseconds[1:]
+                continue
+            positions = np.flatnonzero(self.message_types == message_type)
+            latest_seconds = np.searchsorted(seconds_positions, positions)
+            self.timestamps[message_type] = microseconds[latest_seconds] + (
+                table["nanoseconds"].astype(np.int64) // 1000
+            )
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+    def native(self, message_type: bytes) -> Dict[str, np.ndarray]:
+        """Native-endian copies of the columns of one message type"""
+        table = self.tables[message_type]
+        return {
+            name: table[name].astype(table.dtype[name].newbyteorder("="))
+            for name in table.dtype.names
+        }
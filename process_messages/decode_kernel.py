@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Table-driven decoding of IMI messages
+
+The kernel walks the length-prefixed framing of a buffer and dispatches every
+message on its integer type byte through a table of 256 entries. Each entry
+pairs the precompiled Struct of the message type with a handler, which is
+called with the unpacked fields. Message types without a handler are
+skipped. A handler can raise StopDecoding to stop the kernel in front of its
+own message.
+"""
+
+# standard libraries
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+# message layouts (after the type byte), all fields are big-endian
+MESSAGE_FORMATS = {
+    # Add Order
+    b"A": ">iqsiii",
+    # Order Delete
+    b"D": ">iq",
+    # Order Replace
+    b"U": ">iqqii",
+    # Order Executed
+    b"E": ">iqiq",
+    # Order Executed With Price
+    b"C": ">iqiqsi",
+    # Time Stamp – Seconds
+    b"T": ">i",
+    # Orderbook Directory
+    b"R": ">iis12s3s8siiiiii",
+    # Price Tick Size
+    b"L": ">iiii",
+    # Quantity Tick Size
+    b"M": ">iiii",
+    # Orderbook Trading Action
+    b"H": ">iiss",
+    # System Event
+    b"S": ">i8ssi",
+    # Indicative Price / Quantity
+    b"I": ">iqiiiis",
+    # Trade (SwissAtMid / EBBO)
+    b"P": ">iiiiqs",
+    # Broken Trade
+    b"B": ">iqs",
+}
+MESSAGE_STRUCTS = {
+    message_type: struct.Struct(message_format)
+    for message_type, message_format in MESSAGE_FORMATS.items()
+}
+
+# the message payload starts after two length bytes and one type byte
+HEADER_LENGTH = 3
+
+HandlerTable = List[Optional[Tuple[Callable, Callable]]]
+
+
+class StopDecoding(Exception):
+    """Raised by a handler to stop decoding before its message"""
+
+
+def compile_handler_table(
+    handlers: Dict[bytes, Callable], unknown_handler: Callable[[bytes], None] = None
+) -> HandlerTable:
+    """Table of (unpack_from, handler) indexed by the integer type byte
+
+    If given, `unknown_handler` is called with the type of every message that
+    has no known layout, e.g. to raise an error.
+    """
+    table: HandlerTable = [None] * 256
+    if unknown_handler is not None:
+        for type_byte in range(256):
+            message_type = bytes([type_byte])
+            if message_type not in MESSAGE_STRUCTS:
+                table[type_byte] = (
+                    lambda view, start, message_type=message_type: (message_type,),
+                    unknown_handler,
+                )
+    for message_type, handler in handlers.items():
+        table[message_type[0]] = (MESSAGE_STRUCTS[message_type].unpack_from, handler)
+    return table
+
+
+def decode_buffer(data, position: int, stop: int, handler_table: HandlerTable) -> int:
+    """Decode and dispatch all messages starting before `stop`
+
+    Returns the position of the first message that was not decoded, which is
+    before `stop` if a handler raised StopDecoding.
+    """
+    with memoryview(data) as view:
+        try:
+            while position < stop:
+                entry = handler_table[view[position + 2]]
+                if entry is not None:
+                    unpack_from, handler = entry
+                    handler(*unpack_from(view, position + HEADER_LENGTH))
+                position += view[position + 1] + 2
+        except StopDecoding:
+            pass
+    return position
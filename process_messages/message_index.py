@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Persistent per-day message index, stored as a sidecar next to each file
+
+For every message the index holds its byte offset, its type, the orderbook it
+belongs to (resolved through the order number for D/U/E/C messages) and the
+seconds of the latest 'T' message. With it, a replay of a few orderbooks only
+needs to touch their own messages instead of scanning the whole day.
+"""
+
+# standard libraries
+import gzip
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterable
+
+# third-party packages
+import numpy as np
+
+from .decode_arrays import DecodedMessages
+
+INDEX_SUFFIX = ".idx.npz"
+
+# messages that are needed by the replay of any orderbook
+GLOBAL_MESSAGE_TYPES = [b"T", b"L", b"M", b"S"]
+
+
+def get_index_path(file_path: Path) -> Path:
+    return file_path.with_name(file_path.name + INDEX_SUFFIX)
+
+
+def read_binary_file(file_path: Path):
+    """Memory-map a .bin file, or decompress a .bin.gz file into memory"""
+    if file_path.suffix == ".gz":
+        with gzip.open(file_path, "rb") as compressed_file:
+            return compressed_file.read()
+    with open(file_path, "rb") as binary_file:
+        return mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def build_message_index(file_path: Path) -> Dict[str, np.ndarray]:
+    """Index all messages of a day and save the index next to the file"""
+    data = read_binary_file(file_path)
+    decoded = DecodedMessages(data)
+    tables = decoded.tables
+
+    orderbook_nos = np.full(len(decoded), -1, dtype=np.int32)
+    for message_type in [b"A", b"R", b"H"]:
+        is_this_type = decoded.message_types == message_type
+        orderbook_nos[is_this_type] = tables[message_type]["orderbook_no"]
+
+    # order numbers of replaced orders inherit the orderbook of the old order
+    order_to_orderbook = dict(
+        zip(tables[b"A"]["order_no"].tolist(), tables[b"A"]["orderbook_no"].tolist())
+    )
+    replace_orderbook_nos = list()
+    for old_order_no, new_order_no in zip(
+        tables[b"U"]["old_order_no"].tolist(), tables[b"U"]["new_order_no"].tolist()
+    ):
+        orderbook_no = order_to_orderbook.get(old_order_no, -1)
+        order_to_orderbook[new_order_no] = orderbook_no
+        replace_orderbook_nos.append(orderbook_no)
+    orderbook_nos[decoded.message_types == b"U"] = replace_orderbook_nos
+
+    # resolve all other messages through a sorted lookup of the order numbers
+    known_order_nos = np.fromiter(order_to_orderbook.keys(), dtype=np.int64)
+    known_orderbook_nos = np.fromiter(order_to_orderbook.values(), dtype=np.int32)
+    sort_order = np.argsort(known_order_nos)
+    known_order_nos = known_order_nos[sort_order]
+    known_orderbook_nos = known_orderbook_nos[sort_order]
+    for message_type in [b"D", b"E", b"C"]:
+        if known_order_nos.shape[0] == 0:
+            break
+        order_nos = tables[message_type]["order_no"].astype(np.int64)
+        positions = np.searchsorted(known_order_nos, order_nos)
+        positions = np.minimum(positions, known_order_nos.shape[0] - 1)
+        found = known_order_nos[positions] == order_nos
+        orderbook_nos[decoded.message_types == message_type] = np.where(
+            found, known_orderbook_nos[positions], -1
+        )
+
+    # seconds of the latest 'T' message before (or at) each message
+    is_seconds = decoded.message_types == b"T"
+    seconds = np.concatenate([[0], tables[b"T"]["seconds"].astype(np.int32)])
+    seconds = seconds[np.cumsum(is_seconds)].astype(np.int32)
+
+    message_index = {
+        "offsets": decoded.offsets,
+        "message_types": decoded.message_types.view(np.uint8),
+        "orderbook_nos": orderbook_nos,
+        "seconds": seconds,
+        "directory_orderbook_nos": tables[b"R"]["orderbook_no"].astype(np.int32),
+        "directory_isins": tables[b"R"]["isin"],
+        "number_of_bytes": np.int64(len(data)),
+        "file_size": np.int64(file_path.stat().st_size),
+        "file_mtime_ns": np.int64(file_path.stat().st_mtime_ns),
+    }
+    # other workers, e.g. of other shards of the day, may load or build the
+    # index at the same time, so it is written under a temporary name first
+    index_path = get_index_path(file_path)
+    temporary_path = index_path.with_name(f".{index_path.name}.{os.getpid()}")
+    with open(temporary_path, "wb") as index_file:
+        np.savez_compressed(index_file, **message_index)
+    os.replace(temporary_path, index_path)
+    return message_index
+
+
+def load_message_index(file_path: Path) -> Dict[str, np.ndarray]:
+    """Load the index of a day, (re)building it if missing or out of date"""
+    index_path = get_index_path(file_path)
+    if index_path.exists():
+        with np.load(index_path) as index_file:
+            message_index = {key: index_file[key] for key in index_file.files}
+        file_stat = file_path.stat()
+        if (
+            message_index["file_size"] == file_stat.st_size
+            and message_index["file_mtime_ns"] == file_stat.st_mtime_ns
+        ):
+            return message_index
+    return build_message_index(file_path)
+
+
+def get_orderbook_nos(message_index: Dict[str, np.ndarray], isins: Iterable[str]):
+    """Look up the orderbook numbers of some ISINs in the index"""
+    isins = [isin.encode("utf-8") for isin in isins]
+    is_selected = np.isin(message_index["directory_isins"], isins)
+    return message_index["directory_orderbook_nos"][is_selected].tolist()
+
+
+def select_messages(
+    message_index: Dict[str, np.ndarray],
+    orderbook_nos: Iterable[int],
+    end_second: int = None,
+) -> np.ndarray:
+    """Offsets of all messages needed to replay some orderbooks
+
+    A replay always needs all earlier messages of an orderbook to rebuild its
+    state, so only the end of the replay can be limited.
+    """
+    message_types = message_index["message_types"]
+    global_types = [ord(message_type) for message_type in GLOBAL_MESSAGE_TYPES]
+    is_selected = np.isin(message_types, global_types) | np.isin(
+        message_index["orderbook_nos"], list(orderbook_nos)
+    )
+    if end_second is not None:
+        is_selected &= message_index["seconds"] <= end_second
+    return message_index["offsets"][is_selected]
+
+
+def gather_messages(data, offsets: np.ndarray) -> bytes:
+    """Copy the selected messages, including their framing, into one buffer"""
+    lengths = np.frombuffer(data, dtype=np.uint8)[offsets + 1].astype(np.int64) + 2
+    return b"".join(
+        [
+            data[offset : offset + length]
+            for offset, length in zip(offsets.tolist(), lengths.tolist())
+        ]
+    )
+
+
+def seconds_offset(message_index: Dict[str, np.ndarray], second: int) -> int:
+    """Byte offset of the first message at or after `second`"""
+    position = np.searchsorted(message_index["seconds"], second)
+    if position == message_index["offsets"].shape[0]:
+        return int(message_index["number_of_bytes"])
+    return int(message_index["offsets"][position])
@@ -0,0 +1,1006 @@
+#!/usr/bin/env python3
+"""Optional compiled replay of the order books over decoded message arrays
+
+The replay of Add/Delete/Replace/Execute messages is the throughput ceiling
+of SingleDayIMIData. With Numba installed, `replay` runs the same state
+machine as the message handlers in a compiled kernel over the columns of
+DecodedMessages and fills the same recorders. Without Numba, the kernel still
+runs as plain Python (which is only useful to check it), so SingleDayIMIData
+falls back to its handlers instead. `compare_engines` checks that both
+engines produce bit-identical output.
+"""
+
+# standard libraries
+from pathlib import Path
+from typing import List
+
+# third-party packages
+import numpy as np
+
+try:
+    from numba import njit, types
+    from numba.typed import Dict as TypedDict
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # used as @njit(...) only
+        return lambda function: function
+
+
+from .buffers import MISSING, OrderStatsBuffer
+from .decode_arrays import DecodedMessages
+from .message_index import read_binary_file
+
+# book sides as indices, every orderbook has three of them
+SIDES = [b"B", b"S", b" "]
+SIDE_BYTES = np.array(SIDES, dtype="S1")
+BID, ASK, NO_SIDE = 0, 1, 2
+
+# columns of the int64 order records, the first nine are the order stats
+BOOK, ORDER_NO, ENTRY_TIME, PRICE, BEST_PRICE = 0, 1, 2, 3, 4
+QUANTITY_ENTERED, QUANTITY_FILLED, FIRST_FILL_TIME, REMOVE_TIME = 5, 6, 7, 8
+SIDE, QUANTITY_OUTSTANDING = 9, 10
+ORDER_COLUMNS = 11
+
+# message types in the kernel
+TYPE_CODES = {b"A": 1, b"D": 2, b"U": 3, b"E": 4, b"C": 5, b"T": 6, b"R": 7}
+
+# rows of the output buffers that are flushed into the recorders
+CHUNK_ROWS = 1 << 16
+# first number of price levels per book side, grown on demand
+LEVEL_CAPACITY = 64
+
+# indices of the counters that are kept across kernel calls
+N_ORDERS, N_DIRTY, N_SECONDS, MAX_LEVELS, LAST_SECOND = 0, 1, 2, 3, 4
+
+
+@njit(cache=True)
+def _level_position(keys, count, key):
+    """Binary search in the sorted keys of one book side"""
+    low = 0
+    high = count
+    while low < high:
+        middle = (low + high) >> 1
+        if keys[middle] < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+@njit(cache=True)
+def _level_key(side_code, price):
+    # bids are sorted by descending price, like OrderBookSide(neg)
+    if side_code == BID:
+        return -price
+    return price
+
+
+@njit(cache=True)
+def _change_level(
+    level_keys, level_quantities, level_counts, counters, side, key, delta
+):
+    """Add `delta` to a price level, creating it if needed"""
+    count = level_counts[side]
+    position = _level_position(level_keys[side], count, key)
+    if position < count and level_keys[side, position] == key:
+        level_quantities[side, position] += delta
+        return
+    for i in range(count, position, -1):
+        level_keys[side, i] = level_keys[side, i - 1]
+        level_quantities[side, i] = level_quantities[side, i - 1]
+    level_keys[side, position] = key
+    level_quantities[side, position] = delta
+    level_counts[side] = count + 1
+    if count + 1 > counters[MAX_LEVELS]:
+        counters[MAX_LEVELS] = count + 1
+
+
+@njit(cache=True)
+def _get_level(level_keys, level_quantities, level_counts, side, key):
+    """Quantity at a price level, 0 if it does not exist"""
+    count = level_counts[side]
+    position = _level_position(level_keys[side], count, key)
+    if position < count and level_keys[side, position] == key:
+        return level_quantities[side, position]
+    return 0
+
+
+@njit(cache=True)
+def _pop_level(level_keys, level_quantities, level_counts, side, key):
+    count = level_counts[side]
+    position = _level_position(level_keys[side], count, key)
+    for i in range(position, count - 1):
+        level_keys[side, i] = level_keys[side, i + 1]
+        level_quantities[side, i] = level_quantities[side, i + 1]
+    level_counts[side] = count - 1
+
+
+@njit(cache=True)
+def _best_price(level_keys, level_counts, side, side_code):
+    """Best price of a side as float, NaN if it is empty"""
+    if level_counts[side] == 0:
+        return np.nan
+    return float(_level_key(side_code, level_keys[side, 0]))
+
+
+@njit(cache=True)
+def _best_quantity(level_quantities, level_counts, side):
+    if level_counts[side] == 0:
+        return 0
+    return level_quantities[side, 0]
+
+
+@njit(cache=True)
+def _mark_dirty(dirty, dirty_books, counters, book):
+    if not dirty[book]:
+        dirty[book] = True
+        dirty_books[counters[N_DIRTY]] = book
+        counters[N_DIRTY] += 1
+
+
+@njit(cache=True)
+def _remove_quantity(
+    level_keys,
+    level_quantities,
+    level_counts,
+    counters,
+    dirty,
+    dirty_books,
+    price_events,
+    price_values,
+    depth_events,
+    depth_values,
+    n_price,
+    n_depth,
+    timestamp,
+    book,
+    side_code,
+    price,
+    quantity,
+):
+    """Same as SingleDayIMIData.remove_quantity, returns the new event counts"""
+    side = book * 3 + side_code
+    key = _level_key(side_code, price)
+    _change_level(
+        level_keys, level_quantities, level_counts, counters, side, key, -quantity
+    )
+    if level_counts[side] > 0 and level_keys[side, 0] == key:
+        _mark_dirty(dirty, dirty_books, counters, book)
+        if level_quantities[side, 0] == 0:
+            _pop_level(level_keys, level_quantities, level_counts, side, key)
+            price_events[n_price, 0] = book
+            price_events[n_price, 1] = timestamp
+            price_events[n_price, 2] = side_code
+            price_values[n_price] = _best_price(
+                level_keys, level_counts, side, side_code
+            )
+            n_price += 1
+        depth_events[n_depth, 0] = book
+        depth_events[n_depth, 1] = timestamp
+        depth_events[n_depth, 2] = side_code
+        best_quantity = _best_quantity(level_quantities, level_counts, side)
+        if level_counts[side] == 0:
+            depth_values[n_depth] = np.nan
+        else:
+            depth_values[n_depth] = float(
+                best_quantity * _level_key(side_code, level_keys[side, 0])
+            )
+        n_depth += 1
+    elif _get_level(level_keys, level_quantities, level_counts, side, key) == 0:
+        _pop_level(level_keys, level_quantities, level_counts, side, key)
+    return n_price, n_depth
+
+
+@njit(cache=True)
+def replay_kernel(
+    message_codes,
+    rows,
+    position,
+    stop,
+    a_timestamps,
+    a_order_nos,
+    a_sides,
+    a_quantities,
+    a_books,
+    a_prices,
+    d_timestamps,
+    d_order_nos,
+    u_timestamps,
+    u_old_order_nos,
+    u_new_order_nos,
+    u_quantities,
+    u_prices,
+    e_timestamps,
+    e_order_nos,
+    e_quantities,
+    c_timestamps,
+    c_order_nos,
+    c_quantities,
+    c_prices,
+    t_seconds,
+    r_books,
+    registered,
+    dirty,
+    dirty_books,
+    counters,
+    orders,
+    order_records,
+    level_keys,
+    level_quantities,
+    level_counts,
+    message_counts,
+    price_events,
+    price_values,
+    depth_events,
+    depth_values,
+    transaction_events,
+    transaction_values,
+    open_close_events,
+    snapshot_events,
+    snapshot_values,
+    seconds,
+):
+    """Replay messages from `position` on until `stop` or a full buffer
+
+    Returns the position of the next message and the number of rows written
+    to each output buffer. Buffers are checked before every message, so the
+    caller can flush or grow them and call the kernel again.
+    """
+    n_books = registered.shape[0]
+    n_price = 0
+    n_depth = 0
+    n_transactions = 0
+    n_open_close = 0
+    n_snapshots = 0
+    n_seconds = 0
+    while position < stop:
+        if (
+            n_price + 2 > price_events.shape[0]
+            or n_depth + 2 > depth_events.shape[0]
+            or n_transactions + 1 > transaction_events.shape[0]
+            or n_open_close + 1 > open_close_events.shape[0]
+            or n_snapshots + n_books > snapshot_events.shape[0]
+            or n_seconds + 1 > seconds.shape[0]
+            or counters[N_ORDERS] + 1 > order_records.shape[0]
+            or counters[MAX_LEVELS] + 2 > level_keys.shape[1]
+        ):
+            break
+        code = message_codes[position]
+        row = rows[position]
+        position += 1
+
+        # Add Order Message
+        if code == 1:
+            book = a_books[row]
+            # skip orderbooks that were filtered out
+            if book < 0 or not registered[book]:
+                continue
+            timestamp = a_timestamps[row]
+            side_code = a_sides[row]
+            price = a_prices[row]
+            quantity = a_quantities[row]
+            message_counts[book, 0] += 1
+            side = book * 3 + side_code
+            key = _level_key(side_code, price)
+            _change_level(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                side,
+                key,
+                quantity,
+            )
+            best_key = level_keys[side, 0]
+            best_quantity = level_quantities[side, 0]
+            best_price = _level_key(side_code, best_key)
+            order = counters[N_ORDERS]
+            counters[N_ORDERS] += 1
+            order_records[order, BOOK] = book
+            order_records[order, ORDER_NO] = a_order_nos[row]
+            order_records[order, ENTRY_TIME] = timestamp
+            order_records[order, PRICE] = price
+            order_records[order, BEST_PRICE] = best_price
+            order_records[order, QUANTITY_ENTERED] = quantity
+            order_records[order, QUANTITY_FILLED] = 0
+            order_records[order, FIRST_FILL_TIME] = MISSING
+            order_records[order, REMOVE_TIME] = MISSING
+            order_records[order, SIDE] = side_code
+            order_records[order, QUANTITY_OUTSTANDING] = quantity
+            orders[a_order_nos[row]] = order
+            # record if price was at best
+            if best_key == key:
+                _mark_dirty(dirty, dirty_books, counters, book)
+                depth_events[n_depth, 0] = book
+                depth_events[n_depth, 1] = timestamp
+                depth_events[n_depth, 2] = side_code
+                depth_values[n_depth] = float(best_quantity * best_price)
+                n_depth += 1
+                # if it's price setting
+                if quantity == best_quantity:
+                    price_events[n_price, 0] = book
+                    price_events[n_price, 1] = timestamp
+                    price_events[n_price, 2] = side_code
+                    price_values[n_price] = float(price)
+                    n_price += 1
+
+        # Time Stamp – Seconds message
+        elif code == 6:
+            this_second = t_seconds[row]
+            if this_second >= 8 * 3600 and this_second < 18 * 3600:
+                if counters[N_SECONDS] > 0 and this_second == counters[LAST_SECOND]:
+                    # a repeated second logs into the same second again
+                    second_index = counters[N_SECONDS] - 1
+                else:
+                    seconds[n_seconds] = this_second
+                    n_seconds += 1
+                    second_index = counters[N_SECONDS]
+                    counters[N_SECONDS] += 1
+                    counters[LAST_SECOND] = this_second
+                for i in range(counters[N_DIRTY]):
+                    book = dirty_books[i]
+                    dirty[book] = False
+                    bid_side = book * 3 + BID
+                    ask_side = book * 3 + ASK
+                    snapshot_events[n_snapshots, 0] = second_index
+                    snapshot_events[n_snapshots, 1] = book
+                    snapshot_values[n_snapshots, 0] = _best_price(
+                        level_keys, level_counts, bid_side, BID
+                    )
+                    snapshot_values[n_snapshots, 1] = _best_price(
+                        level_keys, level_counts, ask_side, ASK
+                    )
+                    snapshot_values[n_snapshots, 2] = float(
+                        _best_quantity(level_quantities, level_counts, bid_side)
+                    )
+                    snapshot_values[n_snapshots, 3] = float(
+                        _best_quantity(level_quantities, level_counts, ask_side)
+                    )
+                    n_snapshots += 1
+                counters[N_DIRTY] = 0
+
+        # Order Delete Message
+        elif code == 2:
+            order_no = d_order_nos[row]
+            # skip orders of orderbooks that were filtered out
+            if order_no not in orders:
+                continue
+            order = orders[order_no]
+            del orders[order_no]
+            timestamp = d_timestamps[row]
+            book = order_records[order, BOOK]
+            message_counts[book, 1] += 1
+            order_records[order, REMOVE_TIME] = timestamp
+            n_price, n_depth = _remove_quantity(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                dirty,
+                dirty_books,
+                price_events,
+                price_values,
+                depth_events,
+                depth_values,
+                n_price,
+                n_depth,
+                timestamp,
+                book,
+                order_records[order, SIDE],
+                order_records[order, PRICE],
+                order_records[order, QUANTITY_OUTSTANDING],
+            )
+
+        # Order Replace Message
+        elif code == 3:
+            old_order_no = u_old_order_nos[row]
+            # skip orders of orderbooks that were filtered out
+            if old_order_no not in orders:
+                continue
+            old_order = orders[old_order_no]
+            del orders[old_order_no]
+            timestamp = u_timestamps[row]
+            book = order_records[old_order, BOOK]
+            side_code = order_records[old_order, SIDE]
+            message_counts[book, 2] += 1
+            # the new order can improve the best price without being at it
+            _mark_dirty(dirty, dirty_books, counters, book)
+            order_records[old_order, REMOVE_TIME] = timestamp
+            n_price, n_depth = _remove_quantity(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                dirty,
+                dirty_books,
+                price_events,
+                price_values,
+                depth_events,
+                depth_values,
+                n_price,
+                n_depth,
+                timestamp,
+                book,
+                side_code,
+                order_records[old_order, PRICE],
+                order_records[old_order, QUANTITY_OUTSTANDING],
+            )
+            # new order
+            side = book * 3 + side_code
+            price = u_prices[row]
+            quantity = u_quantities[row]
+            is_empty = level_counts[side] == 0
+            best_quantity = _best_quantity(level_quantities, level_counts, side)
+            best_price = 0
+            if not is_empty:
+                best_price = _level_key(side_code, level_keys[side, 0])
+            order = counters[N_ORDERS]
+            counters[N_ORDERS] += 1
+            order_records[order, BOOK] = book
+            order_records[order, ORDER_NO] = u_new_order_nos[row]
+            order_records[order, ENTRY_TIME] = timestamp
+            order_records[order, PRICE] = price
+            order_records[order, BEST_PRICE] = MISSING if is_empty else best_price
+            order_records[order, QUANTITY_ENTERED] = quantity
+            order_records[order, QUANTITY_FILLED] = 0
+            order_records[order, FIRST_FILL_TIME] = MISSING
+            order_records[order, REMOVE_TIME] = MISSING
+            order_records[order, SIDE] = side_code
+            order_records[order, QUANTITY_OUTSTANDING] = quantity
+            orders[u_new_order_nos[row]] = order
+            _change_level(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                side,
+                _level_key(side_code, price),
+                quantity,
+            )
+            # record if price was at best (before the new order was added)
+            if not is_empty and price == best_price:
+                depth_events[n_depth, 0] = book
+                depth_events[n_depth, 1] = timestamp
+                depth_events[n_depth, 2] = side_code
+                depth_values[n_depth] = float(best_quantity * best_price)
+                n_depth += 1
+                # if it's the only one at the best price
+                if quantity == best_quantity:
+                    price_events[n_price, 0] = book
+                    price_events[n_price, 1] = timestamp
+                    price_events[n_price, 2] = side_code
+                    price_values[n_price] = float(price)
+                    n_price += 1
+
+        # Order Executed Message
+        elif code == 4:
+            order_no = e_order_nos[row]
+            # skip orders of orderbooks that were filtered out
+            if order_no not in orders:
+                continue
+            order = orders[order_no]
+            timestamp = e_timestamps[row]
+            executed_quantity = e_quantities[row]
+            book = order_records[order, BOOK]
+            side_code = order_records[order, SIDE]
+            price = order_records[order, PRICE]
+            # filled orders are removed
+            order_records[order, QUANTITY_OUTSTANDING] -= executed_quantity
+            if order_records[order, QUANTITY_OUTSTANDING] == 0:
+                del orders[order_no]
+            order_records[order, QUANTITY_FILLED] += executed_quantity
+            if order_records[order, FIRST_FILL_TIME] == MISSING:
+                order_records[order, FIRST_FILL_TIME] = timestamp
+            # info to calculate effective spreads
+            bid_side = book * 3 + BID
+            ask_side = book * 3 + ASK
+            transaction_events[n_transactions, 0] = book
+            transaction_events[n_transactions, 1] = timestamp
+            transaction_events[n_transactions, 2] = price
+            transaction_events[n_transactions, 3] = executed_quantity
+            transaction_events[n_transactions, 4] = BID if side_code == ASK else ASK
+            transaction_events[n_transactions, 5] = _best_quantity(
+                level_quantities, level_counts, bid_side
+            )
+            transaction_events[n_transactions, 6] = _best_quantity(
+                level_quantities, level_counts, ask_side
+            )
+            transaction_values[n_transactions, 0] = _best_price(
+                level_keys, level_counts, bid_side, BID
+            )
+            transaction_values[n_transactions, 1] = _best_price(
+                level_keys, level_counts, ask_side, ASK
+            )
+            n_transactions += 1
+            n_price, n_depth = _remove_quantity(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                dirty,
+                dirty_books,
+                price_events,
+                price_values,
+                depth_events,
+                depth_values,
+                n_price,
+                n_depth,
+                timestamp,
+                book,
+                side_code,
+                price,
+                executed_quantity,
+            )
+
+        # Order Executed With Price message
+        elif code == 5:
+            order_no = c_order_nos[row]
+            # skip orders of orderbooks that were filtered out
+            if order_no not in orders:
+                continue
+            order = orders[order_no]
+            timestamp = c_timestamps[row]
+            executed_quantity = c_quantities[row]
+            book = order_records[order, BOOK]
+            side_code = order_records[order, SIDE]
+            price = order_records[order, PRICE]
+            order_records[order, QUANTITY_OUTSTANDING] -= executed_quantity
+            if order_records[order, QUANTITY_OUTSTANDING] == 0:
+                del orders[order_no]
+            open_close_events[n_open_close, 0] = book
+            open_close_events[n_open_close, 1] = timestamp
+            open_close_events[n_open_close, 2] = c_prices[row]
+            n_open_close += 1
+            _mark_dirty(dirty, dirty_books, counters, book)
+            order_records[order, QUANTITY_FILLED] += executed_quantity
+            if order_records[order, FIRST_FILL_TIME] == MISSING:
+                order_records[order, FIRST_FILL_TIME] = timestamp
+            side = book * 3 + side_code
+            key = _level_key(side_code, price)
+            _change_level(
+                level_keys,
+                level_quantities,
+                level_counts,
+                counters,
+                side,
+                key,
+                -executed_quantity,
+            )
+            if _get_level(level_keys, level_quantities, level_counts, side, key) == 0:
+                _pop_level(level_keys, level_quantities, level_counts, side, key)
+
+        # Orderbook Directory message
+        elif code == 7:
+            book = r_books[row]
+            if book >= 0:
+                registered[book] = True
+                _mark_dirty(dirty, dirty_books, counters, book)
+
+    return (
+        position,
+        n_price,
+        n_depth,
+        n_transactions,
+        n_open_close,
+        n_snapshots,
+        n_seconds,
+    )
+
+
+@njit(cache=True)
+def _live_orders(orders):
+    """Order numbers and record rows of the orders left in the typed dict"""
+    order_nos = np.empty(len(orders), dtype=np.int64)
+    rows = np.empty(len(orders), dtype=np.int64)
+    i = 0
+    for order_no, row in orders.items():
+        order_nos[i] = order_no
+        rows[i] = row
+        i += 1
+    return order_nos, rows
+
+
+def _new_order_dict():
+    if NUMBA_AVAILABLE:
+        return TypedDict.empty(key_type=types.int64, value_type=types.int64)
+    return dict()
+
+
+def _grow(array: np.ndarray, axis: int = 0) -> np.ndarray:
+    """Double an array along one axis, keeping its contents"""
+    return np.concatenate([array, np.zeros_like(array)], axis=axis)
+
+
+def _split_by_book(books: np.ndarray):
+    """Stable grouping of rows by book index: (book, row indices) pairs"""
+    order = np.argsort(books, kind="stable")
+    unique_books, starts = np.unique(books[order], return_index=True)
+    return zip(unique_books.tolist(), np.split(order, starts[1:]))
+
+
+def _to_int64(values: np.ndarray) -> np.ndarray:
+    return values.astype(np.int64)
+
+
+def replay(imi_data) -> None:
+    """Process all messages of a SingleDayIMIData with the compiled kernel"""
+    if imi_data.is_compressed:
+        data = read_binary_file(imi_data.file_path)
+    else:
+        data = imi_data.data
+    decoded = DecodedMessages(data)
+    tables = decoded.tables
+    timestamps = decoded.timestamps
+
+    # orderbook directory, tick sizes and system events are rare and handled
+    # by the regular message handlers up front, in their order
+    is_setup = np.isin(decoded.message_types, [b"T", b"R", b"L", b"S"])
+    setup_handlers = imi_data.message_handlers()
+    seconds_microseconds = 0
+    for message_type, row in zip(
+        decoded.message_types[is_setup].tolist(), decoded.rows[is_setup].tolist()
+    ):
+        fields = tables[message_type][row].item()
+        if message_type == b"T":
+            seconds_microseconds = fields[0] * 1_000_000
+            continue
+        imi_data.microseconds = seconds_microseconds
+        setup_handlers[message_type](*fields)
+    imi_data.microseconds = seconds_microseconds
+    imi_data.snapshots.dirty.clear()
+
+    # trading actions are replayed in between the kernel calls, in stream
+    # order, and only for orderbooks whose directory message came before
+    trading_action_positions = np.flatnonzero(decoded.message_types == b"H")
+    directory_positions = dict()
+    for position, orderbook_no in zip(
+        np.flatnonzero(decoded.message_types == b"R").tolist(),
+        tables[b"R"]["orderbook_no"].tolist(),
+    ):
+        directory_positions.setdefault(orderbook_no, position)
+
+    # orderbooks are numbered in the order of their directory messages
+    orderbook_nos = np.array(list(imi_data.orderbooks), dtype=np.int64)
+    n_books = orderbook_nos.shape[0]
+    sorter = np.argsort(orderbook_nos)
+
+    def book_indices(values):
+        values = values.astype(np.int64)
+        if n_books == 0:
+            return np.full(values.shape[0], -1, dtype=np.int64)
+        positions = np.searchsorted(orderbook_nos, values, sorter=sorter)
+        positions = np.minimum(positions, n_books - 1)
+        found = orderbook_nos[sorter[positions]] == values
+        return np.where(found, sorter[positions], -1)
+
+    side_codes = np.full(256, NO_SIDE, dtype=np.int64)
+    side_codes[ord(b"B")] = BID
+    side_codes[ord(b"S")] = ASK
+
+    type_codes = np.zeros(256, dtype=np.uint8)
+    for message_type, code in TYPE_CODES.items():
+        type_codes[message_type[0]] = code
+    message_codes = type_codes[decoded.message_types.view(np.uint8)]
+
+    a, d, u = tables[b"A"], tables[b"D"], tables[b"U"]
+    e, c = tables[b"E"], tables[b"C"]
+    columns = (
+        timestamps[b"A"],
+        _to_int64(a["order_no"]),
+        side_codes[a["book_side"].view(np.uint8)],
+        _to_int64(a["quantity"]),
+        book_indices(a["orderbook_no"]),
+        _to_int64(a["price"]),
+        timestamps[b"D"],
+        _to_int64(d["order_no"]),
+        timestamps[b"U"],
+        _to_int64(u["old_order_no"]),
+        _to_int64(u["new_order_no"]),
+        _to_int64(u["quantity"]),
+        _to_int64(u["price"]),
+        timestamps[b"E"],
+        _to_int64(e["order_no"]),
+        _to_int64(e["executed_quantity"]),
+        timestamps[b"C"],
+        _to_int64(c["order_no"]),
+        _to_int64(c["executed_quantity"]),
+        _to_int64(c["execution_price"]),
+        _to_int64(tables[b"T"]["seconds"]),
+        book_indices(tables[b"R"]["orderbook_no"]),
+    )
+
+    # state
+    registered = np.zeros(n_books, dtype=np.bool_)
+    dirty = np.zeros(n_books, dtype=np.bool_)
+    dirty_books = np.zeros(n_books, dtype=np.int64)
+    counters = np.zeros(5, dtype=np.int64)
+    orders = _new_order_dict()
+    order_records = np.zeros((CHUNK_ROWS, ORDER_COLUMNS), dtype=np.int64)
+    level_keys = np.zeros((3 * n_books, LEVEL_CAPACITY), dtype=np.int64)
+    level_quantities = np.zeros((3 * n_books, LEVEL_CAPACITY), dtype=np.int64)
+    level_counts = np.zeros(3 * n_books, dtype=np.int64)
+    message_counts = np.zeros((n_books, 3), dtype=np.int64)
+
+    # output buffers
+    price_events = np.zeros((CHUNK_ROWS, 3), dtype=np.int64)
+    price_values = np.zeros(CHUNK_ROWS)
+    depth_events = np.zeros((CHUNK_ROWS, 3), dtype=np.int64)
+    depth_values = np.zeros(CHUNK_ROWS)
+    transaction_events = np.zeros((CHUNK_ROWS, 7), dtype=np.int64)
+    transaction_values = np.zeros((CHUNK_ROWS, 2))
+    open_close_events = np.zeros((CHUNK_ROWS, 3), dtype=np.int64)
+    snapshot_rows = max(CHUNK_ROWS, 2 * n_books)
+    snapshot_events = np.zeros((snapshot_rows, 2), dtype=np.int64)
+    snapshot_values = np.zeros((snapshot_rows, 4))
+    seconds = np.zeros(CHUNK_ROWS, dtype=np.int64)
+
+    def replay_until(position, stop):
+        nonlocal order_records, level_keys, level_quantities
+        while position < stop:
+            (
+                position,
+                n_price,
+                n_depth,
+                n_transactions,
+                n_open_close,
+                n_snapshots,
+                n_seconds,
+            ) = replay_kernel(
+                message_codes,
+                decoded.rows,
+                position,
+                stop,
+                *columns,
+                registered,
+                dirty,
+                dirty_books,
+                counters,
+                orders,
+                order_records,
+                level_keys,
+                level_quantities,
+                level_counts,
+                message_counts,
+                price_events,
+                price_values,
+                depth_events,
+                depth_values,
+                transaction_events,
+                transaction_values,
+                open_close_events,
+                snapshot_events,
+                snapshot_values,
+                seconds,
+            )
+            _flush_events(
+                imi_data,
+                orderbook_nos,
+                price_events[:n_price],
+                price_values[:n_price],
+                depth_events[:n_depth],
+                depth_values[:n_depth],
+                transaction_events[:n_transactions],
+                transaction_values[:n_transactions],
+                open_close_events[:n_open_close],
+                snapshot_events[:n_snapshots],
+                snapshot_values[:n_snapshots],
+                seconds[:n_seconds],
+            )
+            # grow the state that is kept across calls
+            if counters[N_ORDERS] + 1 > order_records.shape[0]:
+                order_records = _grow(order_records)
+            if counters[MAX_LEVELS] + 2 > level_keys.shape[1]:
+                level_keys = _grow(level_keys, axis=1)
+                level_quantities = _grow(level_quantities, axis=1)
+        return position
+
+    position = 0
+    trading_action = setup_handlers[b"H"]
+    for stop, fields, timestamp in zip(
+        trading_action_positions.tolist(),
+        tables[b"H"].tolist(),
+        timestamps[b"H"].tolist(),
+    ):
+        position = replay_until(position, stop)
+        nanoseconds, orderbook_no = fields[:2]
+        if directory_positions.get(orderbook_no, len(decoded)) < stop:
+            imi_data.microseconds = timestamp - nanoseconds // 1000
+            trading_action(*fields)
+    replay_until(position, message_codes.shape[0])
+    imi_data.microseconds = seconds_microseconds
+
+    _finish(
+        imi_data,
+        orderbook_nos,
+        orders,
+        order_records[: counters[N_ORDERS]],
+        level_keys,
+        level_quantities,
+        level_counts,
+        message_counts,
+        dirty_books[: counters[N_DIRTY]],
+    )
+    imi_data.current_position = len(data)
+
+
+def _flush_events(
+    imi_data,
+    orderbook_nos,
+    price_events,
+    price_values,
+    depth_events,
+    depth_values,
+    transaction_events,
+    transaction_values,
+    open_close_events,
+    snapshot_events,
+    snapshot_values,
+    seconds,
+):
+    """Append the rows of the output buffers to the recorders of each book"""
+    for recorders, events, values, field in [
+        (imi_data.best_bid_ask, price_events, price_values, "new_best_price"),
+        (imi_data.best_depths, depth_events, depth_values, "new_depth_at_best"),
+    ]:
+        for book, rows in _split_by_book(events[:, 0]):
+            recorder = recorders[orderbook_nos[book]]
+            records = np.empty(rows.shape[0], dtype=recorder.dtype)
+            records["timestamp"] = events[rows, 1]
+            records["book_side"] = SIDE_BYTES[events[rows, 2]]
+            records[field] = values[rows]
+            recorder.extend(records)
+
+    for book, rows in _split_by_book(transaction_events[:, 0]):
+        recorder = imi_data.transactions[orderbook_nos[book]]
+        records = np.empty(rows.shape[0], dtype=recorder.dtype)
+        records["timestamp"] = transaction_events[rows, 1]
+        records["price"] = transaction_events[rows, 2]
+        records["size"] = transaction_events[rows, 3]
+        records["aggressor"] = SIDE_BYTES[transaction_events[rows, 4]]
+        records["best_bid"] = transaction_values[rows, 0]
+        records["best_ask"] = transaction_values[rows, 1]
+        records["best_bid_quantity"] = transaction_events[rows, 5]
+        records["best_ask_quantity"] = transaction_events[rows, 6]
+        recorder.extend(records)
+
+    for book, rows in _split_by_book(open_close_events[:, 0]):
+        imi_data.open_close[orderbook_nos[book]].extend(
+            zip(
+                open_close_events[rows, 1].tolist(),
+                open_close_events[rows, 2].tolist(),
+            )
+        )
+
+    snapshots = imi_data.snapshots
+    snapshots.seconds.extend(seconds.tolist())
+    for book, rows in _split_by_book(snapshot_events[:, 1]):
+        snapshots.extend(
+            int(orderbook_nos[book]), snapshot_events[rows, 0], snapshot_values[rows]
+        )
+
+
+def _finish(
+    imi_data,
+    orderbook_nos,
+    orders,
+    order_records,
+    level_keys,
+    level_quantities,
+    level_counts,
+    message_counts,
+    dirty_books,
+):
+    """Hand over order stats, live orders and book states to the handlers' containers"""
+    # row reference of each order in the OrderStatsBuffer of its book
+    stats_rows = np.zeros(order_records.shape[0], dtype=np.int64)
+    record_length = len(OrderStatsBuffer.columns)
+    for book, rows in _split_by_book(order_records[:, BOOK]):
+        buffer = imi_data.order_stats[orderbook_nos[book]]
+        stats_rows[rows] = len(buffer.records) + record_length * np.arange(
+            rows.shape[0]
+        )
+        buffer.extend(order_records[rows, ORDER_NO : REMOVE_TIME + 1])
+
+    live_order_nos, live_rows = _live_orders(orders)
+    live_records = order_records[live_rows]
+    for order_no, book, side_code, price, quantity, stats_row in zip(
+        live_order_nos.tolist(),
+        orderbook_nos[live_records[:, BOOK]].tolist(),
+        live_records[:, SIDE].tolist(),
+        live_records[:, PRICE].tolist(),
+        live_records[:, QUANTITY_OUTSTANDING].tolist(),
+        stats_rows[live_rows].tolist(),
+    ):
+        imi_data.orders.add(
+            order_no, book, SIDES[side_code], price, quantity, stats_row
+        )
+
+    for book, orderbook_no in enumerate(orderbook_nos.tolist()):
+        this_orderbook = imi_data.orderbooks[orderbook_no]
+        for side_code, side_bytes in enumerate(SIDES):
+            side = book * 3 + side_code
+            count = level_counts[side]
+            keys = level_keys[side, :count].tolist()
+            quantities = level_quantities[side, :count].tolist()
+            for key, quantity in zip(keys, quantities):
+                price = -key if side_code == BID else key
+                this_orderbook[side_bytes][price] = quantity
+
+        counts = imi_data.message_counts[orderbook_no]
+        for column, name in enumerate(["add_order", "delete_order", "replace_order"]):
+            if message_counts[book, column]:
+                counts[name] += int(message_counts[book, column])
+
+    imi_data.snapshots.dirty.update(orderbook_nos[dirty_books].tolist())
+
+
+def compare_engines(file_path: Path, **kwargs) -> List[str]:
+    """Replay a day with both engines and list the outputs that differ"""
+    # imported here, process_one_day imports this module
+    from .process_one_day import SingleDayIMIData
+
+    results = dict()
+    for engine in ["python", "numba"]:
+        imi_data = SingleDayIMIData(file_path, engine="python", **kwargs)
+        if engine == "numba":
+            # runs interpreted if Numba is not installed
+            replay(imi_data)
+        else:
+            imi_data.process_messages()
+        imi_data.close()
+        results[engine] = imi_data
+    return compare_replays(results["python"], results["numba"])
+
+
+def compare_replays(first, second) -> List[str]:
+    """Outputs of two replays of the same day that differ, e.g. of two engines"""
+    differences = list()
+    for attribute in [
+        "metadata",
+        "price_tick_sizes",
+        "trading_actions",
+        "system_events",
+        "message_counts",
+        "open_close",
+        "microseconds",
+    ]:
+        if getattr(first, attribute) != getattr(second, attribute):
+            differences.append(attribute)
+    for attribute in ["best_bid_ask", "best_depths", "transactions"]:
+        recorders = getattr(first, attribute)
+        other = getattr(second, attribute)
+        if recorders.keys() != other.keys() or any(
+            recorders[key].buffer != other[key].buffer for key in recorders
+        ):
+            differences.append(attribute)
+    if first.order_stats.keys() != second.order_stats.keys() or any(
+        first.order_stats[key].records != second.order_stats[key].records
+        for key in first.order_stats
+    ):
+        differences.append("order_stats")
+    if dict(first.orders.items()) != dict(second.orders.items()):
+        differences.append("orders")
+    if first.orderbooks.keys() != second.orderbooks.keys() or any(
+        list(first.orderbooks[key][side].items())
+        != list(second.orderbooks[key][side].items())
+        for key in first.orderbooks
+        for side in SIDES
+    ):
+        differences.append("orderbooks")
+    snapshots, other = first.snapshots, second.snapshots
+    if (
+        snapshots.seconds != other.seconds
+        or snapshots.positions != other.positions
+        or snapshots.values.keys() != other.values.keys()
+        or any(
+            snapshots.values[key].tobytes() != other.values[key].tobytes()
+            for key in snapshots.values
+        )
+        or snapshots.dirty != other.dirty
+    ):
+        differences.append("snapshots")
+    return differences
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""Observers that subscribe to typed events of the replay
+
+With observers, SingleDayIMIData only maintains the live orders and the
+order books, and hands every event to the observers that override the
+corresponding method of ReplayObserver. None of the built-in recording
+(best prices and depths, transactions, order stats, snapshots, open/close,
+message counts) takes place, so a run only pays for the events that its
+observers use. For such days, calculate_orderbook_stats collects the
+`statistics` of the observers instead of reading the built-in recorders.
+"""
+
+# standard libraries
+from array import array
+from typing import Callable, Dict, List
+
+# third-party packages
+import numpy as np
+
+from .buffers import TransactionRecorder
+
+# events of ReplayObserver, in the order of the message types
+EVENTS = [
+    "orderbook_added",
+    "trading_action",
+    "second",
+    "order_added",
+    "order_removed",
+    "order_executed",
+    "order_executed_with_price",
+    "best_level_changed",
+]
+
+
+class ReplayObserver(object):
+    """Base class of observers, override the events that are needed
+
+    Execution events are sent before the order book is updated, all other
+    order events after it. Timestamps are microseconds after midnight.
+    """
+
+    def attach(self, imi_data):
+        """Called before the replay, e.g. to look into the order books"""
+        self.imi_data = imi_data
+
+    def statistics(self, orderbook_no: int) -> Dict[str, float]:
+        """Statistics of an orderbook after the replay, by column"""
+        return dict()
+
+    def orderbook_added(self, orderbook_no: int, metadata: Dict):
+        pass
+
+    def trading_action(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        trading_state: bytes,
+        book_condition: bytes,
+    ):
+        pass
+
+    def second(self, seconds: int):
+        pass
+
+    def order_added(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        order_no: int,
+        book_side: bytes,
+        price: int,
+        quantity: int,
+    ):
+        pass
+
+    def order_removed(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        order_no: int,
+        book_side: bytes,
+        price: int,
+        quantity: int,
+    ):
+        pass
+
+    def order_executed(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        order_no: int,
+        book_side: bytes,
+        price: int,
+        executed_quantity: int,
+    ):
+        pass
+
+    def order_executed_with_price(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        order_no: int,
+        book_side: bytes,
+        execution_price: int,
+        executed_quantity: int,
+    ):
+        pass
+
+    def best_level_changed(
+        self,
+        timestamp: int,
+        orderbook_no: int,
+        book_side: bytes,
+        best_price,
+        best_quantity: int,
+    ):
+        pass
+
+
+class TransactionObserver(ReplayObserver):
+    """Transactions of all orderbooks, as in SingleDayIMIData.transactions"""
+
+    def __init__(self):
+        self.transactions = dict()
+
+    def orderbook_added(self, orderbook_no, metadata):
+        self.transactions[orderbook_no] = TransactionRecorder()
+
+    def order_executed(
+        self, timestamp, orderbook_no, order_no, book_side, price, executed_quantity
+    ):
+        this_orderbook = self.imi_data.orderbooks[orderbook_no]
+        best_bid_price, best_bid_quantity = this_orderbook[b"B"].peekitem(0)
+        best_ask_price, best_ask_quantity = this_orderbook[b"S"].peekitem(0)
+        self.transactions[orderbook_no].append(
+            timestamp,
+            price,
+            executed_quantity,
+            b"B" if book_side == b"S" else b"S",
+            best_bid_price,
+            best_ask_price,
+            best_bid_quantity,
+            best_ask_quantity,
+        )
+
+
+def mean_without_nan(values) -> float:
+    """Mean of the values that are not NaN, e.g. without a mid price"""
+    values = [value for value in values if value == value]
+    if not values:
+        return np.nan
+    return sum(values) / len(values)
+
+
+def mean_and_median(values: array):
+    """Mean and median without NaNs, as in pandas' describe"""
+    values = np.frombuffer(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if values.shape[0] == 0:
+        return np.nan, np.nan
+    return values.mean(), np.median(values)
+
+
+class EffectiveSpreadObserver(ReplayObserver):
+    """Effective spreads of the transactions within a window
+
+    Yields the transaction statistics of calculate_effective_statistics
+    without recording the transactions. Executions of the same microsecond,
+    price and aggressor form one trade, whose spreads are averaged over the
+    executions and whose value is summed up.
+    """
+
+    def __init__(self, start_microsecond: int, end_microsecond: int):
+        self.start_microsecond = start_microsecond
+        self.end_microsecond = end_microsecond
+        self.price_scales = dict()
+        # executions of the current microsecond, by orderbook and trade
+        self.timestamps = dict()
+        self.executions = dict()
+        # columns of the trades, by orderbook
+        self.trades = dict()
+
+    def orderbook_added(self, orderbook_no, metadata):
+        self.price_scales[orderbook_no] = 10 ** metadata["price_decimals"]
+        self.timestamps[orderbook_no] = None
+        self.executions[orderbook_no] = dict()
+        self.trades[orderbook_no] = {
+            column: array("d")
+            for column in [
+                "price",
+                "effective_spread",
+                "eff_rel_spread_bps",
+                "trade_value",
+            ]
+        }
+
+    def order_executed(
+        self, timestamp, orderbook_no, order_no, book_side, price, executed_quantity
+    ):
+        if not self.start_microsecond <= timestamp <= self.end_microsecond:
+            return
+        if timestamp != self.timestamps[orderbook_no]:
+            self.add_trades(orderbook_no)
+            self.timestamps[orderbook_no] = timestamp
+        this_orderbook = self.imi_data.orderbooks[orderbook_no]
+        best_bid_price = this_orderbook[b"B"].peekitem(0)[0]
+        best_ask_price = this_orderbook[b"S"].peekitem(0)[0]
+        price_scale = self.price_scales[orderbook_no]
+        mid = (best_ask_price + best_bid_price) * 0.5 / price_scale
+        price = price / price_scale
+        # the aggressor is on the other side of the executed order
+        aggressor = b"B" if book_side == b"S" else b"S"
+        effective_spread = (1 if aggressor == b"B" else -1) * (price - mid)
+        trade = self.executions[orderbook_no].setdefault((price, aggressor), [])
+        trade.append(
+            (effective_spread, effective_spread / mid * 100, price * executed_quantity)
+        )
+
+    def add_trades(self, orderbook_no):
+        """Aggregate the executions of the current microsecond into trades"""
+        columns = self.trades[orderbook_no]
+        for (price, _), executions in self.executions[orderbook_no].items():
+            effective_spreads, eff_rel_spreads_bps, trade_values = zip(*executions)
+            columns["price"].append(price)
+            columns["effective_spread"].append(mean_without_nan(effective_spreads))
+            columns["eff_rel_spread_bps"].append(mean_without_nan(eff_rel_spreads_bps))
+            columns["trade_value"].append(sum(trade_values))
+        self.executions[orderbook_no] = dict()
+
+    def statistics(self, orderbook_no):
+        self.add_trades(orderbook_no)
+        columns = self.trades[orderbook_no]
+        if not columns["price"]:
+            return dict()
+        trade_values = np.frombuffer(columns["trade_value"], dtype=np.float64)
+        eff_rel_spreads_bps = np.frombuffer(
+            columns["eff_rel_spread_bps"], dtype=np.float64
+        )
+        stats = dict()
+        stats["turnover"] = trade_values.sum()
+        stats["eff_rel_spread_bps_weighted"] = (
+            np.nansum(eff_rel_spreads_bps * trade_values) / stats["turnover"]
+        )
+        stats["price_mean"] = mean_and_median(columns["price"])[0]
+        stats["num_transactions"] = float(len(columns["price"]))
+        for name, column in [
+            ("eff_spread", "effective_spread"),
+            ("eff_rel_spread_bps", "eff_rel_spread_bps"),
+            ("trade_value", "trade_value"),
+        ]:
+            mean, median = mean_and_median(columns[column])
+            stats[f"{name}_mean"] = mean
+            stats[f"{name}_median"] = median
+        return stats
+
+
+class ObservedReplay(object):
+    """Message handlers that maintain the order books and notify observers
+
+    For every event, only the observers that override it are called. The
+    best levels are only compared if an observer needs their changes.
+    """
+
+    def __init__(self, imi_data, observers: List[ReplayObserver]):
+        self.imi_data = imi_data
+        self.orders = imi_data.orders
+        self.orderbooks = imi_data.orderbooks
+        self.microseconds = imi_data.microseconds
+        for observer in observers:
+            observer.attach(imi_data)
+        for event in EVENTS:
+            default = getattr(ReplayObserver, event)
+            setattr(
+                self,
+                event,
+                [
+                    getattr(observer, event)
+                    for observer in observers
+                    if getattr(type(observer), event) is not default
+                ],
+            )
+
+    def message_handlers(self) -> Dict[bytes, Callable]:
+        imi_data = self.imi_data
+        return {
+            b"A": self.add_order,
+            b"T": self.time_stamp_seconds,
+            b"D": self.order_delete,
+            b"U": self.order_replace,
+            b"E": self.order_executed_message,
+            b"C": self.order_executed_with_price_message,
+            b"R": self.orderbook_directory,
+            b"L": imi_data.price_tick_size,
+            b"H": self.orderbook_trading_action,
+            b"S": imi_data.system_event,
+        }
+
+    def notify_best_level(self, timestamp, orderbook_no, book_side, this_side, before):
+        best_price, best_quantity = this_side.peekitem(0)
+        # NaN prices of empty sides differ from each other
+        if best_quantity != before[1] or (
+            best_price != before[0] and best_price == best_price
+        ):
+            for callback in self.best_level_changed:
+                callback(timestamp, orderbook_no, book_side, best_price, best_quantity)
+
+    @staticmethod
+    def remove_quantity(this_side, price, quantity):
+        this_side[price] -= quantity
+        if this_side[price] == 0:
+            this_side.pop(price)
+
+    def time_stamp_seconds(self, seconds):
+        self.microseconds = seconds * 1_000_000
+        self.imi_data.microseconds = self.microseconds
+        for callback in self.second:
+            callback(seconds)
+
+    def add_order(
+        self, nanoseconds, order_no, book_side, quantity, orderbook_no, price
+    ):
+        # skip orderbooks that were filtered out
+        if orderbook_no not in self.orderbooks:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        this_side = self.orderbooks[orderbook_no][book_side]
+        if self.best_level_changed:
+            before = this_side.peekitem(0)
+        this_side[price] += quantity
+        self.orders.add(order_no, orderbook_no, book_side, price, quantity, 0)
+        for callback in self.order_added:
+            callback(timestamp, orderbook_no, order_no, book_side, price, quantity)
+        if self.best_level_changed:
+            self.notify_best_level(
+                timestamp, orderbook_no, book_side, this_side, before
+            )
+
+    def order_delete(self, nanoseconds, order_no):
+        this_order = self.orders.pop(order_no)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, quantity_outstanding, _ = this_order
+        this_side = self.orderbooks[orderbook_no][book_side]
+        if self.best_level_changed:
+            before = this_side.peekitem(0)
+        self.remove_quantity(this_side, price, quantity_outstanding)
+        for callback in self.order_removed:
+            callback(
+                timestamp,
+                orderbook_no,
+                order_no,
+                book_side,
+                price,
+                quantity_outstanding,
+            )
+        if self.best_level_changed:
+            self.notify_best_level(
+                timestamp, orderbook_no, book_side, this_side, before
+            )
+
+    def order_replace(self, nanoseconds, old_order_no, new_order_no, quantity, price):
+        old_order = self.orders.pop(old_order_no)
+        # skip orders of orderbooks that were filtered out
+        if old_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, old_price, old_quantity_outstanding, _ = old_order
+        this_side = self.orderbooks[orderbook_no][book_side]
+        if self.best_level_changed:
+            before = this_side.peekitem(0)
+        self.remove_quantity(this_side, old_price, old_quantity_outstanding)
+        this_side[price] += quantity
+        self.orders.add(new_order_no, orderbook_no, book_side, price, quantity, 0)
+        for callback in self.order_removed:
+            callback(
+                timestamp,
+                orderbook_no,
+                old_order_no,
+                book_side,
+                old_price,
+                old_quantity_outstanding,
+            )
+        for callback in self.order_added:
+            callback(timestamp, orderbook_no, new_order_no, book_side, price, quantity)
+        if self.best_level_changed:
+            self.notify_best_level(
+                timestamp, orderbook_no, book_side, this_side, before
+            )
+
+    def order_executed_message(
+        self, nanoseconds, order_no, executed_quantity, match_number
+    ):
+        # filled orders are removed from the store
+        this_order = self.orders.execute(order_no, executed_quantity)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, _, _ = this_order
+        for callback in self.order_executed:
+            callback(
+                timestamp, orderbook_no, order_no, book_side, price, executed_quantity
+            )
+        this_side = self.orderbooks[orderbook_no][book_side]
+        if self.best_level_changed:
+            before = this_side.peekitem(0)
+        self.remove_quantity(this_side, price, executed_quantity)
+        if self.best_level_changed:
+            self.notify_best_level(
+                timestamp, orderbook_no, book_side, this_side, before
+            )
+
+    def order_executed_with_price_message(
+        self,
+        nanoseconds,
+        order_no,
+        executed_quantity,
+        match_number,
+        printable,
+        execution_price,
+    ):
+        # filled orders are removed from the store
+        this_order = self.orders.execute(order_no, executed_quantity)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, _, _ = this_order
+        for callback in self.order_executed_with_price:
+            callback(
+                timestamp,
+                orderbook_no,
+                order_no,
+                book_side,
+                execution_price,
+                executed_quantity,
+            )
+        this_side = self.orderbooks[orderbook_no][book_side]
+        if self.best_level_changed:
+            before = this_side.peekitem(0)
+        self.remove_quantity(this_side, price, executed_quantity)
+        if self.best_level_changed:
+            self.notify_best_level(
+                timestamp, orderbook_no, book_side, this_side, before
+            )
+
+    def orderbook_directory(self, nanoseconds, orderbook_no, *fields):
+        # only the metadata and the order book, none of the recorders
+        if self.imi_data.add_orderbook(orderbook_no, *fields):
+            for callback in self.orderbook_added:
+                callback(orderbook_no, self.imi_data.metadata[orderbook_no])
+
+    def orderbook_trading_action(
+        self, nanoseconds, orderbook_no, trading_state, book_condition
+    ):
+        # skip orderbooks that were filtered out
+        if orderbook_no not in self.orderbooks:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        self.imi_data.trading_actions[orderbook_no].append(
+            (timestamp, trading_state, book_condition)
+        )
+        for callback in self.trading_action:
+            callback(timestamp, orderbook_no, trading_state, book_condition)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Compact store for the live orders of a trading day
+"""
+
+# standard libraries
+from array import array
+from typing import Iterator, Optional, Tuple
+
+# third-party packages
+import numpy as np
+
+# one-byte book sides as returned by struct, indexed by their byte value
+BOOK_SIDES = [bytes([value]) for value in range(256)]
+
+OrderInfo = Tuple[int, bytes, int, int, int]
+
+LIVE_ORDER_DTYPE = np.dtype(
+    [
+        ("order_no", np.int64),
+        ("orderbook_no", np.int64),
+        ("book_side", "S1"),
+        ("price", np.int64),
+        ("quantity", np.int64),
+    ]
+)
+
+
+class OrderStore(object):
+    """Live orders kept in preallocated typed arrays instead of one dict each
+
+    Every order occupies a slot in the fixed-width columns orderbook_no,
+    book_side, price and quantity_outstanding, plus the row reference of the
+    order in its OrderStatsBuffer. Slots are found through a hash of the order
+    number and are reused via a free-list once an order is gone. All lookups
+    return (orderbook_no, book_side, price, quantity_outstanding, stats_row).
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.capacity = capacity
+        self.slots = dict()
+        self.free_slots = list()
+        self.next_slot = 0
+
+        self.orderbook_nos = array("q", bytes(8 * capacity))
+        self.book_sides = bytearray(capacity)
+        self.prices = array("q", bytes(8 * capacity))
+        self.quantities = array("q", bytes(8 * capacity))
+        self.stats_rows = array("q", bytes(8 * capacity))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, order_no: int) -> bool:
+        return order_no in self.slots
+
+    def grow(self):
+        """Double the capacity of all columns"""
+        self.orderbook_nos.frombytes(bytes(8 * self.capacity))
+        self.book_sides.extend(bytes(self.capacity))
+        self.prices.frombytes(bytes(8 * self.capacity))
+        self.quantities.frombytes(bytes(8 * self.capacity))
+        self.stats_rows.frombytes(bytes(8 * self.capacity))
+        self.capacity *= 2
+
+    def add(
+        self,
+        order_no: int,
+        orderbook_no: int,
+        book_side: bytes,
+        price: int,
+        quantity: int,
+        stats_row: int,
+    ):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.next_slot
+            self.next_slot += 1
+            if slot == self.capacity:
+                self.grow()
+        self.slots[order_no] = slot
+        self.orderbook_nos[slot] = orderbook_no
+        self.book_sides[slot] = book_side[0]
+        self.prices[slot] = price
+        self.quantities[slot] = quantity
+        self.stats_rows[slot] = stats_row
+
+    def get(self, order_no: int) -> Optional[OrderInfo]:
+        slot = self.slots.get(order_no)
+        if slot is None:
+            return None
+        return (
+            self.orderbook_nos[slot],
+            BOOK_SIDES[self.book_sides[slot]],
+            self.prices[slot],
+            self.quantities[slot],
+            self.stats_rows[slot],
+        )
+
+    def pop(self, order_no: int) -> Optional[OrderInfo]:
+        """Remove an order and return its info, or None if it is unknown"""
+        slot = self.slots.pop(order_no, None)
+        if slot is None:
+            return None
+        self.free_slots.append(slot)
+        return (
+            self.orderbook_nos[slot],
+            BOOK_SIDES[self.book_sides[slot]],
+            self.prices[slot],
+            self.quantities[slot],
+            self.stats_rows[slot],
+        )
+
+    def execute(self, order_no: int, executed_quantity: int) -> Optional[OrderInfo]:
+        """Reduce the outstanding quantity, removing the order once it is filled
+
+        Returns the order info with the quantity left after the execution.
+        """
+        slot = self.slots.get(order_no)
+        if slot is None:
+            return None
+        quantity_outstanding = self.quantities[slot] - executed_quantity
+        self.quantities[slot] = quantity_outstanding
+        if quantity_outstanding == 0:
+            del self.slots[order_no]
+            self.free_slots.append(slot)
+        return (
+            self.orderbook_nos[slot],
+            BOOK_SIDES[self.book_sides[slot]],
+            self.prices[slot],
+            quantity_outstanding,
+            self.stats_rows[slot],
+        )
+
+    def items(self) -> Iterator[Tuple[int, OrderInfo]]:
+        for order_no in self.slots:
+            yield order_no, self.get(order_no)
+
+    def to_numpy(self) -> np.ndarray:
+        """All live orders as a structured array, in no particular order"""
+        order_nos = np.fromiter(self.slots.keys(), dtype=np.int64, count=len(self))
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self))
+        live_orders = np.empty(len(self), dtype=LIVE_ORDER_DTYPE)
+        live_orders["order_no"] = order_nos
+        live_orders["orderbook_no"] = np.frombuffer(self.orderbook_nos, np.int64)[slots]
+        live_orders["book_side"] = np.frombuffer(self.book_sides, "S1")[slots]
+        live_orders["price"] = np.frombuffer(self.prices, np.int64)[slots]
+        live_orders["quantity"] = np.frombuffer(self.quantities, np.int64)[slots]
+        return live_orders
+
+    def update(self, other: "OrderStore"):
+        """Add all orders of another store, e.g. to merge shards"""
+        for order_no, order_info in other.items():
+            self.add(order_no, *order_info)
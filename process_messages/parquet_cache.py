@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Versioned Parquet cache of the parsed outputs of each day
+
+Replaying a day is by far the slowest part of a run, while the statistics
+only need its recorded events. The outputs of a SingleDayIMIData are written
+once as one Parquet table per output, partitioned as
+
+    <cache_dir>/parser_version=<PARSER_VERSION>/date=<date>/<key>/
+
+where the key is a checksum of the binary file, followed by a digest of the
+orderbook filter if there is one (filters need a stable repr, such as
+OrderbookFilter). A change of the parser, the file or the selection of
+orderbooks therefore never reads stale results. CachedDay provides the same
+attributes as SingleDayIMIData, so calculate_orderbook_stats runs straight
+from the cache. Needs pyarrow.
+"""
+
+# standard libraries
+from collections import Counter
+import hashlib
+import os
+from pathlib import Path
+import shutil
+from typing import Callable, Dict, Iterator, List, Optional
+
+# third-party packages
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from .buffers import (
+    BestDepthRecorder,
+    BestPriceRecorder,
+    OrderStatsBuffer,
+    SnapshotRecorder,
+    TransactionRecorder,
+)
+from .process_one_day import PARSER_VERSION
+
+CHECKSUM_CHUNK_SIZE = 16 * 1024 * 1024
+
+METADATA_COLUMNS = [
+    "price_type",
+    "isin",
+    "currency",
+    "group",
+    "minimum_quantity",
+    "quantity_tick_table_id",
+    "price_tick_table_id",
+    "price_decimals",
+    "delisting_date",
+    "delisting_time",
+]
+# recorded events per orderbook, by attribute
+EVENT_RECORDERS = {
+    "best_bid_ask": BestPriceRecorder,
+    "best_depths": BestDepthRecorder,
+    "transactions": TransactionRecorder,
+}
+
+
+def get_checksum(file_path: Path) -> str:
+    """BLAKE2b digest of the binary file, as it is stored"""
+    checksum = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as binary_file:
+        for chunk in iter(lambda: binary_file.read(CHECKSUM_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_cache_path(
+    cache_dir: Path, date: str, checksum: str, orderbook_filter: Callable = None
+) -> Path:
+    key = checksum
+    if orderbook_filter is not None:
+        selection = repr(orderbook_filter).encode("utf-8")
+        key += "-" + hashlib.blake2b(selection, digest_size=4).hexdigest()
+    return cache_dir / f"parser_version={PARSER_VERSION}" / f"date={date}" / key
+
+
+def get_date(file_path: Path) -> str:
+    # as in SingleDayIMIData
+    return file_path.name[11:21].replace("_", "-")
+
+
+def find_cached_days(cache_dir: Path) -> List[Path]:
+    """Cache paths of all days of the current parser version, by date"""
+    version_dir = cache_dir / f"parser_version={PARSER_VERSION}"
+    return sorted(path.parent for path in version_dir.glob("date=*/*/metadata.parquet"))
+
+
+def _write_table(path: Path, columns: Dict[str, np.ndarray]):
+    pq.write_table(pa.table(columns), path)
+
+
+def _read_table(path: Path) -> Dict[str, np.ndarray]:
+    table = pq.read_table(path)
+    return {
+        name: column.to_numpy(zero_copy_only=False)
+        for name, column in zip(table.column_names, table.columns)
+    }
+
+
+def _concatenate(arrays: List[np.ndarray], dtype) -> np.ndarray:
+    if not arrays:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(arrays)
+
+
+def _split_by_orderbook(orderbook_nos: np.ndarray) -> Iterator:
+    """(orderbook_no, slice) of the rows of each orderbook, rows are sorted"""
+    unique_orderbook_nos, starts, counts = np.unique(
+        orderbook_nos, return_index=True, return_counts=True
+    )
+    for orderbook_no, start, count in zip(
+        unique_orderbook_nos.tolist(), starts.tolist(), counts.tolist()
+    ):
+        yield orderbook_no, slice(start, start + count)
+
+
+def _event_columns(recorders: Dict[int, object], dtype: np.dtype) -> Dict:
+    orderbook_nos = sorted(recorders)
+    events = _concatenate([recorders[key].to_numpy() for key in orderbook_nos], dtype)
+    columns = {
+        "orderbook_no": _concatenate(
+            [np.full(len(recorders[key]), key) for key in orderbook_nos], np.int64
+        )
+    }
+    columns.update({name: events[name] for name in dtype.names})
+    return columns
+
+
+def write_day_cache(imi_data, cache_dir: Path, checksum: str = None) -> Path:
+    """Write all outputs of a processed day and return their directory
+
+    The tables are written to a temporary directory that is renamed at the
+    end, so that an interrupted write never leaves a partial cache entry.
+    """
+    if not PYARROW_AVAILABLE:
+        raise ImportError("The Parquet cache needs pyarrow to be installed")
+    if any(
+        not isinstance(recorder, recorder_class)
+        for attribute, recorder_class in EVENT_RECORDERS.items()
+        for recorder in getattr(imi_data, attribute).values()
+    ):
+        raise ValueError("Only days with recorded events can be cached")
+    if checksum is None:
+        checksum = get_checksum(imi_data.file_path)
+    cache_path = get_cache_path(
+        cache_dir, imi_data.date, checksum, imi_data.orderbook_filter
+    )
+    temporary_path = cache_path.with_name(cache_path.name + ".tmp")
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    temporary_path.mkdir(parents=True)
+
+    orderbook_nos = sorted(imi_data.metadata)
+    metadata_columns = {"orderbook_no": np.array(orderbook_nos, dtype=np.int64)}
+    for column in METADATA_COLUMNS:
+        metadata_columns[column] = [
+            imi_data.metadata[orderbook_no][column] for orderbook_no in orderbook_nos
+        ]
+    _write_table(temporary_path / "metadata.parquet", metadata_columns)
+
+    tick_sizes = [
+        (table_id, tick_size, price_start)
+        for table_id, table in imi_data.price_tick_sizes.items()
+        for tick_size, price_start in table.items()
+    ]
+    _write_table(
+        temporary_path / "price_tick_sizes.parquet",
+        {
+            name: np.array([row[i] for row in tick_sizes], dtype=np.int64)
+            for i, name in enumerate(
+                ["price_tick_table_id", "price_tick_size", "price_start"]
+            )
+        },
+    )
+
+    trading_actions = [
+        (orderbook_no, *action)
+        for orderbook_no in sorted(imi_data.trading_actions)
+        for action in imi_data.trading_actions[orderbook_no]
+    ]
+    _write_table(
+        temporary_path / "trading_actions.parquet",
+        {
+            "orderbook_no": np.array([row[0] for row in trading_actions], np.int64),
+            "timestamp": np.array([row[1] for row in trading_actions], np.int64),
+            "trading_state": np.array([row[2] for row in trading_actions], "S1"),
+            "book_condition": np.array([row[3] for row in trading_actions], "S1"),
+        },
+    )
+
+    message_counts = [
+        (orderbook_no, message_type, count)
+        for orderbook_no in sorted(imi_data.message_counts)
+        for message_type, count in imi_data.message_counts[orderbook_no].items()
+    ]
+    _write_table(
+        temporary_path / "message_counts.parquet",
+        {
+            "orderbook_no": np.array([row[0] for row in message_counts], np.int64),
+            "message_type": [row[1] for row in message_counts],
+            "count": np.array([row[2] for row in message_counts], np.int64),
+        },
+    )
+
+    for attribute, recorder_class in EVENT_RECORDERS.items():
+        _write_table(
+            temporary_path / f"{attribute}.parquet",
+            _event_columns(getattr(imi_data, attribute), recorder_class.dtype),
+        )
+    _write_table(
+        temporary_path / "order_stats.parquet",
+        _event_columns(imi_data.order_stats, OrderStatsBuffer.dtype),
+    )
+
+    snapshots = imi_data.snapshots
+    _write_table(
+        temporary_path / "snapshot_seconds.parquet",
+        {"seconds": np.frombuffer(snapshots.seconds, dtype=np.int64)},
+    )
+    snapshot_orderbook_nos = sorted(snapshots.positions)
+    values = _concatenate(
+        [
+            np.frombuffer(snapshots.values[key]).reshape(-1, len(snapshots.columns))
+            for key in snapshot_orderbook_nos
+        ],
+        np.float64,
+    ).reshape(-1, len(snapshots.columns))
+    snapshot_columns = {
+        "orderbook_no": _concatenate(
+            [
+                np.full(len(snapshots.positions[key]), key)
+                for key in snapshot_orderbook_nos
+            ],
+            np.int64,
+        ),
+        "position": _concatenate(
+            [
+                np.frombuffer(snapshots.positions[key], dtype=np.int64)
+                for key in snapshot_orderbook_nos
+            ],
+            np.int64,
+        ),
+    }
+    for i, column in enumerate(snapshots.columns):
+        snapshot_columns[column] = values[:, i]
+    _write_table(temporary_path / "snapshots.parquet", snapshot_columns)
+
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(temporary_path, cache_path)
+    return cache_path
+
+
+class CachedDay(object):
+    """Outputs of a processed day, loaded from the Parquet cache
+
+    Has the attributes of SingleDayIMIData that the statistics use, with the
+    same recorder types.
+    """
+
+    def __init__(self, cache_path: Path):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("The Parquet cache needs pyarrow to be installed")
+        self.cache_path = cache_path
+        self.date = cache_path.parent.name[len("date=") :]
+
+        metadata = _read_table(cache_path / "metadata.parquet")
+        orderbook_nos = metadata["orderbook_no"].tolist()
+        metadata_columns = {
+            column: metadata[column].tolist() for column in METADATA_COLUMNS
+        }
+        self.metadata = {
+            orderbook_no: {
+                column: values[row] for column, values in metadata_columns.items()
+            }
+            for row, orderbook_no in enumerate(orderbook_nos)
+        }
+
+        self.price_tick_sizes = dict()
+        tick_sizes = _read_table(cache_path / "price_tick_sizes.parquet")
+        for table_id, tick_size, price_start in zip(
+            tick_sizes["price_tick_table_id"].tolist(),
+            tick_sizes["price_tick_size"].tolist(),
+            tick_sizes["price_start"].tolist(),
+        ):
+            self.price_tick_sizes.setdefault(table_id, dict())[tick_size] = price_start
+
+        self.trading_actions = {orderbook_no: list() for orderbook_no in orderbook_nos}
+        trading_actions = _read_table(cache_path / "trading_actions.parquet")
+        for orderbook_no, timestamp, trading_state, book_condition in zip(
+            trading_actions["orderbook_no"].tolist(),
+            trading_actions["timestamp"].tolist(),
+            trading_actions["trading_state"].tolist(),
+            trading_actions["book_condition"].tolist(),
+        ):
+            self.trading_actions[orderbook_no].append(
+                (timestamp, trading_state, book_condition)
+            )
+
+        self.message_counts = {
+            orderbook_no: Counter() for orderbook_no in orderbook_nos
+        }
+        message_counts = _read_table(cache_path / "message_counts.parquet")
+        for orderbook_no, message_type, count in zip(
+            message_counts["orderbook_no"].tolist(),
+            message_counts["message_type"].tolist(),
+            message_counts["count"].tolist(),
+        ):
+            self.message_counts[orderbook_no][message_type] = count
+
+        for attribute, recorder_class in EVENT_RECORDERS.items():
+            recorders = {
+                orderbook_no: recorder_class() for orderbook_no in orderbook_nos
+            }
+            events = _read_table(cache_path / f"{attribute}.parquet")
+            records = np.empty(events["orderbook_no"].shape[0], recorder_class.dtype)
+            for name in recorder_class.dtype.names:
+                records[name] = events[name]
+            for orderbook_no, rows in _split_by_orderbook(events["orderbook_no"]):
+                recorders[orderbook_no].extend(records[rows])
+            setattr(self, attribute, recorders)
+
+        self.order_stats = {
+            orderbook_no: OrderStatsBuffer() for orderbook_no in orderbook_nos
+        }
+        order_stats = _read_table(cache_path / "order_stats.parquet")
+        records = np.column_stack(
+            [order_stats[column] for column in OrderStatsBuffer.columns]
+        )
+        for orderbook_no, rows in _split_by_orderbook(order_stats["orderbook_no"]):
+            self.order_stats[orderbook_no].extend(records[rows])
+
+        self.snapshots = SnapshotRecorder()
+        seconds = _read_table(cache_path / "snapshot_seconds.parquet")["seconds"]
+        self.snapshots.seconds.frombytes(seconds.astype(np.int64).tobytes())
+        snapshots = _read_table(cache_path / "snapshots.parquet")
+        values = np.column_stack(
+            [snapshots[column] for column in SnapshotRecorder.columns]
+        )
+        for orderbook_no, rows in _split_by_orderbook(snapshots["orderbook_no"]):
+            self.snapshots.extend(
+                orderbook_no, snapshots["position"][rows], values[rows]
+            )
+
+
+def load_day_cache(
+    file_path: Path,
+    cache_dir: Path,
+    orderbook_filter: Callable = None,
+    checksum: str = None,
+) -> Optional[CachedDay]:
+    """Cached outputs of a binary file, None if they are not cached yet"""
+    if checksum is None:
+        checksum = get_checksum(file_path)
+    cache_path = get_cache_path(
+        cache_dir, get_date(file_path), checksum, orderbook_filter
+    )
+    if not (cache_path / "metadata.parquet").exists():
+        return None
+    return CachedDay(cache_path)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Order book side on a dense ladder of price ticks
+
+Prices on SIX sit on the grid described by the Price Tick Size ('L')
+messages, so the levels around the current best price can be kept in a plain
+list indexed by their distance in ticks. Updates are then a list access, and
+the best level is a cached slot instead of a lookup in a sorted tree.
+"""
+
+# standard libraries
+from operator import neg
+from typing import Dict, Iterator, Tuple
+
+# third-party packages
+import numpy as np
+from sortedcontainers import SortedDict
+
+# number of tick slots kept in the ladder of every book side
+LADDER_WINDOW = 2048
+# levels outside the ladder that trigger recentering it on the best price
+MAX_OVERFLOW_LEVELS = 32
+
+
+def get_tick_size(tick_sizes: Dict[int, int], price: int) -> int:
+    """Tick size at `price` from a table of {price_tick_size: price_start}"""
+    tick_size, start = 1, None
+    for this_tick_size, price_start in tick_sizes.items():
+        if price_start <= price and (start is None or price_start > start):
+            tick_size, start = this_tick_size, price_start
+    return tick_size
+
+
+class LadderBookSide(object):
+    """Drop-in replacement for OrderBookSide based on a list of tick slots
+
+    Slot 0 holds the best price of the window (the highest bid or the lowest
+    ask) and every further slot is one tick worse. Empty slots are None, so a
+    level with zero quantity exists until it is popped, as in a SortedDict.
+    Prices that are off the window or off the grid are kept in a small
+    SortedDict; once it grows, the ladder is recentered on the best price.
+    Only `peekitem(0)` is supported, which is all the replay needs.
+    """
+
+    def __init__(
+        self,
+        is_bid: bool = False,
+        tick_sizes: Dict[int, int] = None,
+        window: int = LADDER_WINDOW,
+    ):
+        self.direction = -1 if is_bid else 1
+        # shared with SingleDayIMIData.price_tick_sizes, may be filled later
+        self.tick_sizes = dict() if tick_sizes is None else tick_sizes
+        self.window = window
+        self.max_overflow_levels = MAX_OVERFLOW_LEVELS
+
+        self.tick_size = 1
+        self.origin = 0
+        # allocated on the first level, many book sides are never used
+        self.levels = []
+        self.size = 0
+        self.best = 0
+        self.count = 0
+        self.overflow = SortedDict(neg) if is_bid else SortedDict()
+
+    def _slot(self, price: int) -> int:
+        """Slot of a price, or -1 if it is not on the ladder"""
+        offset = (price - self.origin) * self.direction
+        slot = offset // self.tick_size
+        if slot * self.tick_size != offset or slot < 0 or slot >= self.size:
+            return -1
+        return slot
+
+    def _price(self, slot: int) -> int:
+        return self.origin + self.direction * slot * self.tick_size
+
+    def __len__(self):
+        return self.count + len(self.overflow)
+
+    def __contains__(self, price: int) -> bool:
+        slot = self._slot(price)
+        if slot < 0:
+            return price in self.overflow
+        return self.levels[slot] is not None
+
+    # the slot lookup is inlined below, these are called for every message
+
+    def __getitem__(self, price: int) -> int:
+        offset = (price - self.origin) * self.direction
+        tick_size = self.tick_size
+        slot = offset // tick_size
+        if slot * tick_size != offset or slot < 0 or slot >= self.size:
+            return self.overflow.get(price, 0)
+        quantity = self.levels[slot]
+        return 0 if quantity is None else quantity
+
+    def __setitem__(self, price: int, quantity: int):
+        offset = (price - self.origin) * self.direction
+        tick_size = self.tick_size
+        slot = offset // tick_size
+        if slot * tick_size != offset or slot < 0 or slot >= self.size:
+            if self.count:
+                self.overflow[price] = quantity
+                if len(self.overflow) > self.max_overflow_levels:
+                    self.recenter(self.peekitem(0)[0])
+                return
+            # the ladder is empty, so it can simply move to the new price
+            self.recenter(price)
+            slot = self._slot(price)
+        levels = self.levels
+        if levels[slot] is None:
+            self.count += 1
+            if slot < self.best:
+                self.best = slot
+        levels[slot] = quantity
+
+    def pop(self, price: int) -> int:
+        slot = self._slot(price)
+        if slot < 0 or self.levels[slot] is None:
+            return self.overflow.pop(price)
+        levels = self.levels
+        quantity = levels[slot]
+        levels[slot] = None
+        self.count -= 1
+        if slot == self.best:
+            if self.count:
+                # scan towards worse prices for the next level
+                slot += 1
+                while levels[slot] is None:
+                    slot += 1
+                self.best = slot
+            else:
+                self.best = self.size
+        return quantity
+
+    def peekitem(self, index: int = 0) -> Tuple[int, int]:
+        """Best price and its quantity, (nan, 0) if the side is empty"""
+        if index != 0:
+            raise ValueError("LadderBookSide only supports peekitem(0)")
+        if self.count:
+            price = self._price(self.best)
+            if self.overflow:
+                overflow_price, overflow_quantity = self.overflow.peekitem(0)
+                if (overflow_price - price) * self.direction < 0:
+                    return overflow_price, overflow_quantity
+            return price, self.levels[self.best]
+        if self.overflow:
+            return self.overflow.peekitem(0)
+        return (np.nan, 0)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """All levels, best price first"""
+        ladder = []
+        if self.count:
+            ladder = [
+                (self._price(slot), quantity)
+                for slot, quantity in enumerate(self.levels)
+                if quantity is not None
+            ]
+        overflow = list(self.overflow.items())
+        return iter(
+            sorted(ladder + overflow, key=lambda level: level[0] * self.direction)
+        )
+
+    def keys(self) -> Iterator[int]:
+        return (price for price, _ in self.items())
+
+    def recenter(self, center: int):
+        """Rebuild the ladder around `center` with the tick size at that price"""
+        levels = list(self.items())
+        self.tick_size = get_tick_size(self.tick_sizes, center)
+        self.origin = center - self.direction * self.tick_size * (self.window // 2)
+        self.levels = [None] * self.window
+        self.size = self.window
+        self.best = self.window
+        self.count = 0
+        self.overflow.clear()
+        for price, quantity in levels:
+            slot = self._slot(price)
+            if slot < 0:
+                self.overflow[price] = quantity
+                continue
+            self.levels[slot] = quantity
+            self.count += 1
+            self.best = min(self.best, slot)
+        # if many levels are far away, do not recenter on every update
+        while len(self.overflow) > self.max_overflow_levels:
+            self.max_overflow_levels *= 2
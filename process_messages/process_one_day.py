@@ -3,15 +3,61 @@
 """
 
 # standard libraries
-from collections import defaultdict, namedtuple, Counter
-from operator import neg, itemgetter
+from collections import defaultdict, Counter
+import gzip
+from operator import neg
+import mmap
 from pathlib import Path
-import struct
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
 
 # third-party packages
 import numpy as np
 from sortedcontainers import SortedDict
 
+from .decode_arrays import DecodedMessages
+from .decode_kernel import StopDecoding, compile_handler_table, decode_buffer
+from .accumulators import TimeWeightedDepth, TimeWeightedSpread
+from . import checkpoints
+from . import numba_engine
+from . import message_index
+from .observers import ObservedReplay, ReplayObserver
+from .profiling import DayProfile
+from .buffers import (
+    BestDepthRecorder,
+    BestPriceRecorder,
+    OrderStatsBuffer,
+    SnapshotRecorder,
+    TransactionRecorder,
+)
+from .order_store import OrderStore
+from .price_ladder import LadderBookSide
+
+# longest possible message: two length bytes plus up to 255 bytes of content
+MAX_MESSAGE_LENGTH = 257
+# size of the decompressed chunks when reading .bin.gz files
+GZIP_CHUNK_SIZE = 4 * 1024 * 1024
+# implementations of the order book sides, see SingleDayIMIData
+BOOK_SIDE_TYPES = ["sorted", "ladder"]
+# replay engines, "auto" uses "numba" if it is installed
+ENGINES = ["auto", "python", "numba"]
+
+# increase when the outputs of the replay change, e.g. to invalidate caches
+PARSER_VERSION = 1
+
+# attributes that hold one entry per orderbook
+PER_ORDERBOOK_ATTRIBUTES = [
+    "metadata",
+    "orderbooks",
+    "trading_actions",
+    "best_bid_ask",
+    "best_depths",
+    "transactions",
+    "order_stats",
+    "message_counts",
+    "open_close",
+]
+
 
 class OrderBookSide(SortedDict):
     def __missing__(self, key):
@@ -24,26 +70,160 @@ class OrderBookSide(SortedDict):
             return (np.nan, 0)
 
 
-class SingleDayIMIData(object):
-    """Class that loads and processes IMI messages for a single date"""
+class OrderbookFilter(object):
+    """Selects orderbooks based on their Orderbook Directory ('R') message
+
+    Every criterion that is not None has to match. With `num_shards` > 1,
+    only orderbooks with orderbook_no % num_shards == shard are selected.
+    Instances are picklable, unlike lambdas, so they can be handed to worker
+    processes.
+    """
+
+    def __init__(
+        self,
+        groups: Iterable[str] = None,
+        currencies: Iterable[str] = None,
+        isins: Iterable[str] = None,
+        num_shards: int = 1,
+        shard: int = 0,
+    ):
+        self.groups = None if groups is None else set(groups)
+        self.currencies = None if currencies is None else set(currencies)
+        self.isins = None if isins is None else set(isins)
+        self.num_shards = num_shards
+        self.shard = shard
+
+    def __repr__(self):
+        # stable across processes, e.g. to key caches by the selection
+        criteria = [
+            None if criterion is None else sorted(criterion)
+            for criterion in [self.groups, self.currencies, self.isins]
+        ]
+        return (
+            f"OrderbookFilter(groups={criteria[0]}, currencies={criteria[1]}, "
+            f"isins={criteria[2]}, num_shards={self.num_shards}, shard={self.shard})"
+        )
+
+    def for_shard(self, num_shards: int, shard: int) -> "OrderbookFilter":
+        """The same selection, restricted to one of `num_shards` shards"""
+        return OrderbookFilter(
+            self.groups, self.currencies, self.isins, num_shards, shard
+        )
 
-    def __init__(self, file_path: Path):
+    def __call__(self, orderbook_no: int, metadata: Dict) -> bool:
+        if self.groups is not None:
+            if metadata["group"].decode("utf-8").strip() not in self.groups:
+                return False
+        if self.currencies is not None:
+            if metadata["currency"].decode("utf-8").strip() not in self.currencies:
+                return False
+        if self.isins is not None:
+            if metadata["isin"].decode("utf-8").strip() not in self.isins:
+                return False
+        return orderbook_no % self.num_shards == self.shard
+
+
+class SingleDayIMIData(object):
+    """Class that loads and processes IMI messages for a single date
+
+    If an `orderbook_filter` is given, it is called with the orderbook number
+    and the metadata of every Orderbook Directory message. All messages of
+    orderbooks for which it returns False, and of their orders, are skipped.
+    `book_side_type` selects the order book sides: "sorted" (OrderBookSide)
+    or "ladder" (LadderBookSide, on the grid of the price tick size table).
+    `engine` selects how `process_messages` replays the day: "python" runs
+    the message handlers, "numba" the compiled kernel of numba_engine over
+    the decoded day, and "auto" the latter if Numba is installed and the
+    file is not compressed. The compiled kernel decodes the whole day at once,
+    so its memory grows with the size of the day.
+    With a `checkpoint_interval` in seconds, e.g. 3600 for every trading hour,
+    the replay state is saved to `checkpoint_dir` (a sidecar directory next
+    to the file by default) at the first 'T' message of every interval, see
+    `from_checkpoint`. Checkpoints are only taken by the "python" engine.
+    With a `time_weighted_window` of (start, end) microseconds, best prices
+    and depths are not recorded but integrated into TimeWeightedSpread and
+    TimeWeightedDepth accumulators over that window.
+    With `observers` (see observers.ReplayObserver), only the live orders and
+    the order books are maintained and the observers receive the events
+    they subscribed to, instead of the built-in recording. Observers need
+    the "python" engine.
+    With a `profile` (see profiling.DayProfile), the messages and the time
+    of the handlers are recorded per message type, which also needs the
+    "python" engine.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        use_mmap: bool = True,
+        chunk_size: int = GZIP_CHUNK_SIZE,
+        orderbook_filter: Callable[[int, Dict], bool] = None,
+        book_side_type: str = "sorted",
+        engine: str = "auto",
+        checkpoint_interval: int = None,
+        checkpoint_dir: Path = None,
+        time_weighted_window: Tuple[int, int] = None,
+        observers: Iterable[ReplayObserver] = None,
+        profile: DayProfile = None,
+    ):
         self.date = file_path.name[11:21].replace("_", "-")
 
         self.file_path = file_path
-        # Reading the binary file into memory
-        with open(self.file_path, "rb") as binary_file:
-            self.data = binary_file.read()
-        self.number_of_bytes = len(self.data)
+        self.is_compressed = file_path.suffix == ".gz"
+        self.chunk_size = chunk_size
+        self.orderbook_filter = orderbook_filter
+        if book_side_type not in BOOK_SIDE_TYPES:
+            raise ValueError(f"Unknown book side type: {book_side_type}")
+        self.book_side_type = book_side_type
+        self.time_weighted_window = time_weighted_window
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.observers = None if observers is None else list(observers)
+        if self.observers is not None and checkpoint_interval is not None:
+            raise ValueError("Checkpoints are not supported with observers")
+        # checkpoints, observers and profiles depend on the message handlers
+        needs_handlers = (
+            checkpoint_interval is not None
+            or self.observers is not None
+            or profile is not None
+        )
+        if engine == "auto":
+            # the compiled kernel replays the decoded day at once, which would
+            # hold a whole decompressed .bin.gz file in memory instead of
+            # streaming it
+            use_numba = (
+                numba_engine.NUMBA_AVAILABLE
+                and not needs_handlers
+                and not self.is_compressed
+            )
+            engine = "numba" if use_numba else "python"
+        elif engine == "numba" and not numba_engine.NUMBA_AVAILABLE:
+            raise ImportError("The numba engine needs Numba to be installed")
+        elif engine == "numba" and needs_handlers:
+            raise ValueError(
+                "Checkpoints, observers and profiles need the python engine"
+            )
+        self.engine = engine
+        self.profile = profile
+        self.use_mmap = use_mmap
+        self.open_file()
         self.current_position = 0
 
-        self.unpack = struct.unpack
-        self.get_order_info = itemgetter(
-            "orderbook_no", "book_side", "price", "quantity_outstanding"
-        )
+        self.checkpoint_interval = checkpoint_interval
+        if checkpoint_dir is None:
+            checkpoint_dir = checkpoints.get_checkpoint_dir(file_path)
+        self.checkpoint_dir = checkpoint_dir
+        # a checkpoint is taken at the first 'T' message at or after this second
+        self.next_checkpoint_second = 0
+        self.checkpoint_second = None
+
+        # built on first use, it holds bound methods and cannot be pickled
+        self.handler_table = None
+        # microseconds of the latest 'T' message
+        self.microseconds = 0
 
         self.metadata = dict()
-        self.orders = dict()
+        self.orders = OrderStore()
         self.orderbooks = dict()
         self.price_tick_sizes = defaultdict(dict)
         self.trading_actions = dict()
@@ -54,464 +234,500 @@ class SingleDayIMIData(object):
         self.transactions = dict()
         self.order_stats = dict()
         self.message_counts = dict()
-        self.snapshots = dict()
+        self.snapshots = SnapshotRecorder()
         self.open_close = dict()
 
-        self.Transaction = namedtuple(
-            "Transaction",
-            [
-                "timestamp",
-                "price",
-                "size",
-                "aggressor",
-                "best_bid",
-                "best_ask",
-                "best_bid_quantity",
-                "best_ask_quantity",
-            ],
-        )
-        self.Snapshot = namedtuple(
-            "Snapshot",
-            ["best_bid", "best_ask", "best_bid_quantity", "best_ask_quantity"],
-        )
-        self.NewBestPrice = namedtuple(
-            "NewBestPrice", ["timestamp", "book_side", "new_best_price"]
-        )
-        self.NewBestDepth = namedtuple(
-            "NewBestDepth", ["timestamp", "book_side", "new_depth_at_best"]
-        )
+    def open_file(self):
+        """Map (or read) the binary file, .bin.gz files are streamed instead"""
+        if self.is_compressed:
+            # .bin.gz files are decompressed chunk by chunk in process_messages
+            self.data = None
+            self.number_of_bytes = None
+            return
+        with open(self.file_path, "rb") as binary_file:
+            if self.use_mmap:
+                # map the file instead of reading it, so that workers share
+                # the pages through the OS page cache and nothing is copied
+                self.data = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Reading the binary file into memory
+                self.data = binary_file.read()
+        self.number_of_bytes = len(self.data)
+
+    @classmethod
+    def from_checkpoint(
+        cls, file_path: Path, second: int = None, checkpoint_dir: Path = None
+    ) -> "SingleDayIMIData":
+        """Resume a day from its latest checkpoint at or before `second`
+
+        `process_messages` then continues the replay from the checkpoint,
+        with the settings of the run that took it.
+        """
+        return checkpoints.load_checkpoint(file_path, second, checkpoint_dir)
+
+    def decode_messages(self) -> DecodedMessages:
+        """Decode all messages in bulk into per-type columnar tables
+
+        Unlike `process_messages`, this does not replay the order books. The
+        result holds one big-endian structured array per message type.
+        """
+        if self.is_compressed:
+            # bulk decoding needs the whole day in memory
+            with gzip.open(self.file_path, "rb") as compressed_file:
+                self.decoded_messages = DecodedMessages(compressed_file.read())
+        else:
+            self.decoded_messages = DecodedMessages(self.data)
+        return self.decoded_messages
+
+    def __getstate__(self):
+        # the memory map cannot be pickled, e.g. to return shards from workers
+        state = self.__dict__.copy()
+        state["data"] = None
+        state["handler_table"] = None
+        return state
+
+    @classmethod
+    def merge(cls, shards: List["SingleDayIMIData"]) -> "SingleDayIMIData":
+        """Combine shards of the same day that processed disjoint orderbooks"""
+        merged = shards[0]
+        for shard in shards[1:]:
+            for attribute in PER_ORDERBOOK_ATTRIBUTES:
+                getattr(merged, attribute).update(getattr(shard, attribute))
+            merged.orders.update(shard.orders)
+            merged.snapshots.update(shard.snapshots)
+        # keep the orderbooks in a deterministic order
+        for attribute in PER_ORDERBOOK_ATTRIBUTES:
+            values = getattr(merged, attribute)
+            setattr(merged, attribute, {key: values[key] for key in sorted(values)})
+        return merged
+
+    def close(self):
+        """Release the memory map (or buffer) of the binary file"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = None
 
     def process_messages(self):
-        """Convert and process all messages inside a loop"""
-
-        # as long as we haven't reached the end of the file:
-        while self.current_position < self.number_of_bytes:
-
-            message_length = self.data[self.current_position + 1]
-            message_type = self.data[
-                self.current_position + 2 : self.current_position + 3
-            ]
-            message_start = self.current_position + 3
-            message_end = self.current_position + message_length + 2
-            # access the message
-            message = self.data[message_start:message_end]
-
-            # Add Order Message
-            if message_type == b"A":
-                message = self.unpack(">iqsiii", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                order_no = message[1]
-                book_side = message[2]
-                quantity = message[3]
-                orderbook_no = message[4]
-                price = message[5]
-                self.message_counts[orderbook_no]["add_order"] += 1
-                this_order = dict()
-                self.orders[order_no] = this_order
-                this_order["orderbook_no"] = orderbook_no
-                this_order["book_side"] = book_side
-                this_order["quantity_outstanding"] = quantity
-                this_order["price"] = price
-                # update the orderbook
-                this_orderbook = self.orderbooks[orderbook_no][book_side]
-                this_orderbook[price] += quantity
-                # keep track of statistics
-                best_price, best_quantity = this_orderbook.peekitem(0)
-                this_order_statistics = {
-                    "entry_time": timestamp,
-                    "price": price,
-                    "best_price": best_price,
-                    "quantity_entered": quantity,
-                    "quantity_filled": 0,
-                    "first_fill_time": None,
-                    "remove_time": None,
-                }
-                self.order_stats[orderbook_no][order_no] = this_order_statistics
-                # record if price was at best
-                if price == best_price:
-                    self.best_depths[orderbook_no].append(
-                        self.NewBestDepth(
-                            timestamp=timestamp,
-                            book_side=book_side,
-                            new_depth_at_best=best_quantity*best_price,
-                        )
-                    )
-                    # if it's price setting
-                    if quantity == best_quantity:
-                        self.best_bid_ask[orderbook_no].append(
-                            self.NewBestPrice(
-                                timestamp=timestamp,
-                                book_side=book_side,
-                                new_best_price=price,
-                            )
-                        )
-
-            # Time Stamp – Seconds message
-            elif message_type == b"T":
-                message = self.unpack(">i", message)
-                seconds = message[0]
-                self.microseconds = int(seconds * 1e6)
-                if seconds >= 8 * 3600 and seconds < 18 * 3600:
-                    for orderbook_no, this_orderbook in self.orderbooks.items():
-                        best_bid_price, best_bid_quantity = this_orderbook[
-                            b"B"
-                        ].peekitem(0)
-                        best_ask_price, best_ask_quantity = this_orderbook[
-                            b"S"
-                        ].peekitem(0)
-                        self.snapshots[orderbook_no][seconds] = self.Snapshot(
-                            best_bid=best_bid_price,
-                            best_ask=best_ask_price,
-                            best_bid_quantity=best_bid_quantity,
-                            best_ask_quantity=best_ask_quantity,
-                        )
-
-            # Order Delete Message
-            elif message_type == b"D":
-                message = self.unpack(">iq", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                order_no = message[1]
-                this_order = self.orders[order_no]
-                self.orders.pop(order_no)
-                orderbook_no, book_side, price, quantity_outstanding = self.get_order_info(
-                    this_order
-                )
-                self.message_counts[orderbook_no]["delete_order"] += 1
-                self.order_stats[orderbook_no][order_no]["remove_time"] = timestamp
-                # update the order book
-                this_orderbook = self.orderbooks[orderbook_no][book_side]
-                this_orderbook[price] -= quantity_outstanding
-                best_price, best_quantity = this_orderbook.peekitem(0)
-                if price == best_price:
-                    if best_quantity == 0:
-                        # if there is no quantity left at that price, we remove
-                        # this price level and note that there's a new best price
-                        this_orderbook.pop(price)
-                        best_price, best_quantity = this_orderbook.peekitem(0)
-                        self.best_bid_ask[orderbook_no].append(
-                            self.NewBestPrice(
-                                timestamp=timestamp,
-                                book_side=book_side,
-                                new_best_price=best_price,
-                            )
-                        )
-                    # in any case, if the price was at best, we note the new best quantity
-                    self.best_depths[orderbook_no].append(
-                        self.NewBestDepth(
-                            timestamp=timestamp,
-                            book_side=book_side,
-                            new_depth_at_best=best_quantity*best_price,
-                        )
-                    )
-                # if price was not at best, but there's no quantity outstanding
-                # we remove this price level
-                elif this_orderbook[price] == 0:
-                    this_orderbook.pop(price)
-
-            # Order Replace Message
-            elif message_type == b"U":
-                message = self.unpack(">iqqii", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                # old order
-                old_order_no = message[1]
-                old_order = self.orders[old_order_no]
-                orderbook_no, book_side, old_order_price, old_quantity_outstanding = self.get_order_info(
-                    old_order
+        """Convert and process all messages of the file"""
+        if self.profile is not None:
+            start = time.perf_counter()
+            self.replay_messages()
+            self.profile.replay_seconds += time.perf_counter() - start
+        else:
+            self.replay_messages()
+
+    def replay_messages(self):
+        if self.engine == "numba":
+            numba_engine.replay(self)
+        elif self.is_compressed:
+            self.process_compressed_messages()
+        else:
+            self.current_position = self.process_buffer(
+                self.data, self.current_position, self.number_of_bytes, offset=0
+            )
+
+    def process_selected_messages(
+        self, orderbook_nos: List[int] = None, isins: List[str] = None, end_second=None
+    ):
+        """Replay only the messages of some orderbooks up to `end_second`
+
+        The messages are looked up in the index sidecar of the file (which is
+        built on first use), so that all other messages are never touched.
+        Orderbooks can be selected by number or by ISIN.
+        """
+        index = message_index.load_message_index(self.file_path)
+        orderbook_nos = list(orderbook_nos or [])
+        if isins is not None:
+            orderbook_nos += message_index.get_orderbook_nos(index, isins)
+        offsets = message_index.select_messages(index, orderbook_nos, end_second)
+        if self.is_compressed:
+            data = message_index.read_binary_file(self.file_path)
+        else:
+            data = self.data
+        selected_data = message_index.gather_messages(data, offsets)
+        self.process_buffer(selected_data, 0, len(selected_data))
+
+    def process_compressed_messages(self):
+        """Stream a .bin.gz file through a buffer of bounded size
+
+        Messages that do not fit completely into the current chunk are carried
+        over and processed together with the next chunk.
+        """
+        remainder = b""
+        with gzip.open(self.file_path, "rb") as compressed_file:
+            # e.g. when resuming from a checkpoint
+            compressed_file.seek(self.current_position)
+            while True:
+                if self.profile is not None:
+                    start = time.perf_counter()
+                    chunk = compressed_file.read(self.chunk_size)
+                    self.profile.decompress_seconds += time.perf_counter() - start
+                else:
+                    chunk = compressed_file.read(self.chunk_size)
+                data = remainder + chunk
+                if chunk:
+                    # only messages starting here are guaranteed to be complete
+                    stop = len(data) - MAX_MESSAGE_LENGTH
+                else:
+                    stop = len(data)
+                position = self.process_buffer(
+                    data, 0, stop, offset=self.current_position
                 )
-                self.message_counts[orderbook_no]["replace_order"] += 1
-                self.orders.pop(old_order_no)
-                self.order_stats[orderbook_no][old_order_no]["remove_time"] = timestamp
-                # new order
-                new_order_no = message[2]
-                quantity = message[3]
-                price = message[4]
-                # create new order entry
-                new_order = dict()
-                self.orders[new_order_no] = new_order
-                new_order["book_side"] = book_side
-                new_order["quantity_outstanding"] = quantity
-                new_order["orderbook_no"] = orderbook_no
-                new_order["price"] = price
-
-                # adjust orderbook
-                this_orderbook = self.orderbooks[orderbook_no][book_side]
-                # old order
-                this_orderbook[old_order_price] -= old_quantity_outstanding
-                best_price, best_quantity = this_orderbook.peekitem(0)
-                if old_order_price == best_price:
-                    if best_quantity == 0:
-                        # if there is no quantity left at that price, we remove
-                        # this price level and note that there's a new best price
-                        this_orderbook.pop(old_order_price)
-                        best_price, best_quantity = this_orderbook.peekitem(0)
-                        self.best_bid_ask[orderbook_no].append(
-                            self.NewBestPrice(
-                                timestamp=timestamp,
-                                book_side=book_side,
-                                new_best_price=best_price,
-                            )
-                        )
-                    # in any case, if the price was at best, we note the new best quantity
-                    self.best_depths[orderbook_no].append(
-                        self.NewBestDepth(
-                            timestamp=timestamp,
-                            book_side=book_side,
-                            new_depth_at_best=best_quantity*best_price,
-                        )
-                    )
-                # if price was not at best, but there's no quantity outstanding
-                # we remove this price level
-                elif this_orderbook[old_order_price] == 0:
-                    this_orderbook.pop(old_order_price)
-                # new order
-                best_price, best_quantity = this_orderbook.peekitem(0)
-                this_order_statistics = {
-                    "entry_time": timestamp,
-                    "price": price,
-                    "best_price": best_price,
-                    "quantity_entered": quantity,
-                    "quantity_filled": 0,
-                    "first_fill_time": None,
-                    "remove_time": None,
-                }
-                self.order_stats[orderbook_no][new_order_no] = this_order_statistics
-                this_orderbook[price] += quantity
-                # record if price was at best
-                if price == best_price:
-                    self.best_depths[orderbook_no].append(
-                        self.NewBestDepth(
-                            timestamp=timestamp,
-                            book_side=book_side,
-                            new_depth_at_best=best_quantity*best_price,
-                        )
-                    )
-                    # if it's the only one at the best price
-                    if quantity == best_quantity:
-                        self.best_bid_ask[orderbook_no].append(
-                            self.NewBestPrice(
-                                timestamp=timestamp,
-                                book_side=book_side,
-                                new_best_price=price,
-                            )
-                        )
-
-            # Order Executed Message
-            elif message_type == b"E":
-                message = self.unpack(">iqiq", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                order_no = message[1]
-                executed_quantity = message[2]
-                # match_number = message[3]
-                # update the order entry
-                this_order = self.orders[order_no]
-                this_order["quantity_outstanding"] -= executed_quantity
-                orderbook_no, book_side, price, quantity_outstanding = self.get_order_info(
-                    this_order
+                self.current_position += position
+                remainder = data[position:]
+                if not chunk:
+                    break
+        self.number_of_bytes = self.current_position
+
+    def process_buffer(self, data, position: int, stop: int, offset: int = None) -> int:
+        """Convert and process all messages starting before `stop`
+
+        `offset` is the position of `data` within the file. Checkpoints are
+        only saved if it is given, the positions in a buffer of selected
+        messages do not match the file. Returns the position of the first
+        message that was not processed.
+        """
+        if self.handler_table is None:
+            handlers = self.message_handlers()
+            if self.profile is not None:
+                handlers = self.profile.wrap_handlers(handlers)
+            self.handler_table = compile_handler_table(handlers)
+        position = decode_buffer(data, position, stop, self.handler_table)
+        while position < stop:
+            # the kernel stopped in front of the 'T' message of a checkpoint
+            if offset is not None:
+                checkpoints.save_checkpoint(
+                    self,
+                    self.checkpoint_dir,
+                    self.checkpoint_second,
+                    offset + position,
                 )
-                if quantity_outstanding == 0:
-                    self.orders.pop(order_no)
-                # update order stats
-                this_order_statistics = self.order_stats[orderbook_no][order_no]
-                this_order_statistics["quantity_filled"] += executed_quantity
-                if this_order_statistics.get("first_fill_time") is None:
-                    this_order_statistics["first_fill_time"] = timestamp
-                # order book
+            position = decode_buffer(data, position, stop, self.handler_table)
+        return position
+
+    def message_handlers(self) -> Dict[bytes, Callable]:
+        """Handlers of the relevant message types, called with the unpacked fields"""
+        if self.observers is not None:
+            return ObservedReplay(self, self.observers).message_handlers()
+        handlers = {
+            b"A": self.add_order,
+            b"T": self.time_stamp_seconds,
+            b"D": self.order_delete,
+            b"U": self.order_replace,
+            b"E": self.order_executed,
+            b"C": self.order_executed_with_price,
+            b"R": self.orderbook_directory,
+            b"L": self.price_tick_size,
+            b"H": self.orderbook_trading_action,
+            b"S": self.system_event,
+        }
+        if self.checkpoint_interval is not None:
+            handlers[b"T"] = self.time_stamp_seconds_with_checkpoints
+        return handlers
+
+    # Add Order Message
+    def add_order(
+        self, nanoseconds, order_no, book_side, quantity, orderbook_no, price
+    ):
+        # skip orderbooks that were filtered out
+        if orderbook_no not in self.orderbooks:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        self.message_counts[orderbook_no]["add_order"] += 1
+        # update the orderbook
+        this_orderbook = self.orderbooks[orderbook_no][book_side]
+        this_orderbook[price] += quantity
+        # keep track of statistics
+        best_price, best_quantity = this_orderbook.peekitem(0)
+        stats_row = self.order_stats[orderbook_no].add(
+            order_no, timestamp, price, best_price, quantity
+        )
+        self.orders.add(order_no, orderbook_no, book_side, price, quantity, stats_row)
+        # record if price was at best
+        if price == best_price:
+            self.snapshots.dirty.add(orderbook_no)
+            self.best_depths[orderbook_no].append(
+                timestamp, book_side, best_quantity * best_price
+            )
+            # if it's price setting
+            if quantity == best_quantity:
+                self.best_bid_ask[orderbook_no].append(timestamp, book_side, price)
+
+    # Time Stamp – Seconds message
+    def time_stamp_seconds(self, seconds):
+        self.microseconds = seconds * 1_000_000
+        if seconds >= 8 * 3600 and seconds < 18 * 3600:
+            # only orderbooks whose best levels changed are logged
+            snapshots = self.snapshots
+            snapshots.add_second(seconds)
+            for orderbook_no in snapshots.dirty:
                 this_orderbook = self.orderbooks[orderbook_no]
-                # info to calculate effective spreads
                 best_bid_price, best_bid_quantity = this_orderbook[b"B"].peekitem(0)
                 best_ask_price, best_ask_quantity = this_orderbook[b"S"].peekitem(0)
-                self.transactions[orderbook_no].append(
-                    self.Transaction(
-                        timestamp=timestamp,
-                        price=price,
-                        size=executed_quantity,
-                        aggressor="B" if book_side == b"S" else "S",
-                        best_bid=best_bid_price,
-                        best_ask=best_ask_price,
-                        best_ask_quantity=best_ask_quantity,
-                        best_bid_quantity=best_bid_quantity,
-                    )
+                snapshots.record(
+                    orderbook_no,
+                    best_bid_price,
+                    best_ask_price,
+                    best_bid_quantity,
+                    best_ask_quantity,
                 )
-                # update the order book
-                this_orderbook = this_orderbook[book_side]
-                this_orderbook[price] -= executed_quantity
+            snapshots.dirty.clear()
+
+    def time_stamp_seconds_with_checkpoints(self, seconds):
+        if seconds >= self.next_checkpoint_second:
+            interval = self.checkpoint_interval
+            self.next_checkpoint_second = (seconds // interval + 1) * interval
+            self.checkpoint_second = seconds
+            # stop in front of this message, process_buffer saves the state
+            raise StopDecoding
+        self.time_stamp_seconds(seconds)
+
+    def remove_quantity(
+        self, timestamp, orderbook_no, book_side, price, quantity
+    ) -> OrderBookSide:
+        """Take quantity off a price level and record changes of the best level"""
+        this_orderbook = self.orderbooks[orderbook_no][book_side]
+        this_orderbook[price] -= quantity
+        best_price, best_quantity = this_orderbook.peekitem(0)
+        if price == best_price:
+            self.snapshots.dirty.add(orderbook_no)
+            if best_quantity == 0:
+                # if there is no quantity left at that price, we remove
+                # this price level and note that there's a new best price
+                this_orderbook.pop(price)
                 best_price, best_quantity = this_orderbook.peekitem(0)
-                if price == best_price:
-                    if best_quantity == 0:
-                        # if there is no quantity left at that price, we remove
-                        # this price level and note that there's a new best price
-                        this_orderbook.pop(price)
-                        best_price, best_quantity = this_orderbook.peekitem(0)
-                        self.best_bid_ask[orderbook_no].append(
-                            self.NewBestPrice(
-                                timestamp=timestamp,
-                                book_side=book_side,
-                                new_best_price=best_price,
-                            )
-                        )
-                    # in any case, if the price was at best, we note the new best quantity
-                    self.best_depths[orderbook_no].append(
-                        self.NewBestDepth(
-                            timestamp=timestamp,
-                            book_side=book_side,
-                            new_depth_at_best=best_quantity*best_price,
-                        )
-                    )
-                # if price was not at best, but there's no quantity outstanding
-                # we remove this price level
-                elif this_orderbook[price] == 0:
-                    this_orderbook.pop(price)
-
-            # Order Executed With Price message
-            elif message_type == b"C":
-                message = self.unpack(">iqiqsi", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                order_no = message[1]
-                executed_quantity = message[2]
-                # match_number = message[3]
-                # printable = message[4]
-                execution_price = message[5]
-                # update the order entry
-                this_order = self.orders[order_no]
-                orderbook_no, book_side, price, _ = self.get_order_info(this_order)
-                self.open_close[orderbook_no].append((timestamp, execution_price))
-                this_order["quantity_outstanding"] -= executed_quantity
-                # update the order
-                if this_order["quantity_outstanding"] == 0:
-                    self.orders.pop(order_no)
-                # update order stats
-                this_order_statistics = self.order_stats[orderbook_no][order_no]
-                this_order_statistics["quantity_filled"] += executed_quantity
-                if this_order_statistics.get("first_fill_time") is None:
-                    this_order_statistics["first_fill_time"] = timestamp
-                # update the order book
-                this_orderbook = self.orderbooks[orderbook_no][book_side]
-                this_orderbook[price] -= executed_quantity
-                if this_orderbook[price] == 0:
-                    this_orderbook.pop(price)
-
-            # Orderbook Directory message
-            elif message_type == b"R":
-                message = self.unpack(">iis12s3s8siiiiii", message)
-                orderbook_no = message[1]
-
-                # initialize each side of the orderbook
-                this_orderbook = dict()
-                self.orderbooks[orderbook_no] = this_orderbook
-                this_orderbook[b"B"] = OrderBookSide(neg)
-                this_orderbook[b"S"] = OrderBookSide()
-                this_orderbook[b" "] = OrderBookSide()
-
-                # initialize message counts
-                self.message_counts[orderbook_no] = Counter()
-
-                price_tick_table_id = message[8]
-
-                # initialize metadata
-                this_metadata = dict()
-                self.metadata[orderbook_no] = this_metadata
-                this_metadata["price_type"] = message[2]
-                this_metadata["isin"] = message[3]
-                this_metadata["currency"] = message[4]
-                this_metadata["group"] = message[5]
-                this_metadata["minimum_quantity"] = message[6]
-                this_metadata["quantity_tick_table_id"] = message[7]
-                this_metadata["price_tick_table_id"] = price_tick_table_id
-                this_metadata["price_decimals"] = message[9]
-                this_metadata["delisting_date"] = message[10]
-                this_metadata["delisting_time"] = message[11]
-
-                self.best_bid_ask[orderbook_no] = list()
-                self.best_depths[orderbook_no] = list()
-                self.transactions[orderbook_no] = list()
-                self.order_stats[orderbook_no] = dict()
-                self.snapshots[orderbook_no] = dict()
-                self.open_close[orderbook_no] = list()
-                self.trading_actions[orderbook_no] = list()
-
-            # Price Tick Size message
-            elif message_type == b"L":
-                message = self.unpack(">iiii", message)
-                # timestamp = self.microseconds + message[0] * 1e-3
-                price_tick_table_id = message[1]
-                this_tick_size_table = self.price_tick_sizes[price_tick_table_id]
-                price_tick_size = message[2]
-                price_start = message[3]
-                this_tick_size_table[price_tick_size] = price_start
-
-            # Quantity Tick Size message
-            elif message_type == b"M":
-                # message = self.unpack(">iiii", message)
-                # timestamp = self.microseconds + message[0] * 1e-3
-                # quantity_tick_table_id = message[1]
-                # quantity_tick_size = message[2]
-                # quantity_start = message[3]
-                pass
-
-            # Orderbook Trading Action message
-            elif message_type == b"H":
-                message = self.unpack(">iiss", message)
-                timestamp = self.microseconds + int(message[0] * 1e-3)
-                orderbook_no = message[1]
-                trading_state = message[2]
-                book_condition = message[3]
-                self.message_counts[orderbook_no]["orderbook_trading_action"] += 1
-                self.trading_actions[orderbook_no].append(
-                    (timestamp, trading_state, book_condition)
-                )
+                self.best_bid_ask[orderbook_no].append(timestamp, book_side, best_price)
+            # in any case, if the price was at best, we note the new best quantity
+            self.best_depths[orderbook_no].append(
+                timestamp, book_side, best_quantity * best_price
+            )
+        # if price was not at best, but there's no quantity outstanding
+        # we remove this price level
+        elif this_orderbook[price] == 0:
+            this_orderbook.pop(price)
+        return this_orderbook
+
+    # Order Delete Message
+    def order_delete(self, nanoseconds, order_no):
+        this_order = self.orders.pop(order_no)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, quantity_outstanding, stats_row = this_order
+        self.message_counts[orderbook_no]["delete_order"] += 1
+        self.order_stats[orderbook_no].remove(stats_row, timestamp)
+        # update the order book
+        self.remove_quantity(
+            timestamp, orderbook_no, book_side, price, quantity_outstanding
+        )
 
-            # System Event message
-            elif message_type == b"S":
-                message = self.unpack(">i8ssi", message)
-                timestamp = self.microseconds + message[0] * 1e-3
-                group = message[1]
-                event_code = message[2]
-                orderbook_no = message[3]
-                self.system_events.append(
-                    (timestamp, group, event_code, orderbook_no)
-                )
+    # Order Replace Message
+    def order_replace(self, nanoseconds, old_order_no, new_order_no, quantity, price):
+        old_order = self.orders.pop(old_order_no)
+        # skip orders of orderbooks that were filtered out
+        if old_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        (
+            orderbook_no,
+            book_side,
+            old_order_price,
+            old_quantity_outstanding,
+            old_stats_row,
+        ) = old_order
+        self.message_counts[orderbook_no]["replace_order"] += 1
+        # the new order can improve the best price without being at it
+        self.snapshots.dirty.add(orderbook_no)
+        this_order_statistics = self.order_stats[orderbook_no]
+        this_order_statistics.remove(old_stats_row, timestamp)
+
+        # adjust orderbook for the old order
+        this_orderbook = self.remove_quantity(
+            timestamp,
+            orderbook_no,
+            book_side,
+            old_order_price,
+            old_quantity_outstanding,
+        )
+        # new order
+        best_price, best_quantity = this_orderbook.peekitem(0)
+        stats_row = this_order_statistics.add(
+            new_order_no, timestamp, price, best_price, quantity
+        )
+        # create new order entry
+        self.orders.add(
+            new_order_no, orderbook_no, book_side, price, quantity, stats_row
+        )
+        this_orderbook[price] += quantity
+        # record if price was at best
+        if price == best_price:
+            self.best_depths[orderbook_no].append(
+                timestamp, book_side, best_quantity * best_price
+            )
+            # if it's the only one at the best price
+            if quantity == best_quantity:
+                self.best_bid_ask[orderbook_no].append(timestamp, book_side, price)
+
+    # Order Executed Message
+    def order_executed(self, nanoseconds, order_no, executed_quantity, match_number):
+        # update the order entry
+        # (filled orders are removed from the store)
+        this_order = self.orders.execute(order_no, executed_quantity)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, quantity_outstanding, stats_row = this_order
+        # update order stats
+        self.order_stats[orderbook_no].fill(stats_row, timestamp, executed_quantity)
+        # order book
+        this_orderbook = self.orderbooks[orderbook_no]
+        # info to calculate effective spreads
+        best_bid_price, best_bid_quantity = this_orderbook[b"B"].peekitem(0)
+        best_ask_price, best_ask_quantity = this_orderbook[b"S"].peekitem(0)
+        self.transactions[orderbook_no].append(
+            timestamp,
+            price,
+            executed_quantity,
+            b"B" if book_side == b"S" else b"S",
+            best_bid_price,
+            best_ask_price,
+            best_bid_quantity,
+            best_ask_quantity,
+        )
+        # update the order book
+        self.remove_quantity(
+            timestamp, orderbook_no, book_side, price, executed_quantity
+        )
 
-            else:
-                pass  # because message type is not relevant
-
-            # update current position for next iteration
-            self.current_position = message_end
-
-            # # Indicative Price / Quantity Message
-            # elif message_type == b"I":
-            #     # message = self.unpack(">iqiiiis", message)
-            #     pass # not relevant
-
-            # # Trade message (SwissAtMid / EBBO)
-            # elif message_type == b"P":
-            #     message = self.unpack(">iiiiqs", message)
-            #     timestamp = self.microseconds + message[0] * 1e-3
-            #     orderbook_no = message[1]
-            #     executed_quantity = message[2]
-            #     execution_price = message[3]
-            #     match_number = message[4]
-            #     book_type = message[5]
-
-            # # Broken Trade message
-            # elif message_type == b"B":
-            #     message = self.unpack(">iqs", message)
-            #     timestamp = self.microseconds + message[0] * 1e-3
-            #     match_number = message[1]
-            #     reason = message[2]
-
-            # # Orderbook Trading Action message
-            # elif message_type == b"H":
-            #     message = self.unpack(">iiss", message)
-            #     timestamp = self.microseconds + message[0] * 1e-3
-            #     orderbook_no = message[1]
-            #     trading_state = message[2]
-            #     book_condition = message[3]
-
-            # elif message_type == b"G":  # not relevant
-            #     pass
-
-            # else:
-            #     raise ValueError(f"Message type {message_type} could not be found")
-
-            # # update current position for next iteration
-            # self.current_position = message_end
+    # Order Executed With Price message
+    def order_executed_with_price(
+        self,
+        nanoseconds,
+        order_no,
+        executed_quantity,
+        match_number,
+        printable,
+        execution_price,
+    ):
+        # update the order entry
+        # (filled orders are removed from the store)
+        this_order = self.orders.execute(order_no, executed_quantity)
+        # skip orders of orderbooks that were filtered out
+        if this_order is None:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        orderbook_no, book_side, price, _, stats_row = this_order
+        self.open_close[orderbook_no].append((timestamp, execution_price))
+        self.snapshots.dirty.add(orderbook_no)
+        # update order stats
+        self.order_stats[orderbook_no].fill(stats_row, timestamp, executed_quantity)
+        # update the order book
+        this_orderbook = self.orderbooks[orderbook_no][book_side]
+        this_orderbook[price] -= executed_quantity
+        if this_orderbook[price] == 0:
+            this_orderbook.pop(price)
+
+    # Orderbook Directory message
+    def orderbook_directory(self, nanoseconds, orderbook_no, *fields):
+        if self.add_orderbook(orderbook_no, *fields):
+            self.add_recorders(orderbook_no)
+
+    def add_orderbook(
+        self,
+        orderbook_no,
+        price_type,
+        isin,
+        currency,
+        group,
+        minimum_quantity,
+        quantity_tick_table_id,
+        price_tick_table_id,
+        price_decimals,
+        delisting_date,
+        delisting_time,
+    ) -> bool:
+        """Metadata and order book of a new orderbook, False if filtered out"""
+        # initialize metadata
+        this_metadata = dict()
+        this_metadata["price_type"] = price_type
+        this_metadata["isin"] = isin
+        this_metadata["currency"] = currency
+        this_metadata["group"] = group
+        this_metadata["minimum_quantity"] = minimum_quantity
+        this_metadata["quantity_tick_table_id"] = quantity_tick_table_id
+        this_metadata["price_tick_table_id"] = price_tick_table_id
+        this_metadata["price_decimals"] = price_decimals
+        this_metadata["delisting_date"] = delisting_date
+        this_metadata["delisting_time"] = delisting_time
+
+        # ignore all messages of orderbooks that are filtered out
+        if self.orderbook_filter is not None and not self.orderbook_filter(
+            orderbook_no, this_metadata
+        ):
+            return False
+        self.metadata[orderbook_no] = this_metadata
+
+        # initialize each side of the orderbook
+        this_orderbook = dict()
+        self.orderbooks[orderbook_no] = this_orderbook
+        if self.book_side_type == "ladder":
+            tick_sizes = self.price_tick_sizes[price_tick_table_id]
+            this_orderbook[b"B"] = LadderBookSide(True, tick_sizes)
+            this_orderbook[b"S"] = LadderBookSide(False, tick_sizes)
+            this_orderbook[b" "] = LadderBookSide(False, tick_sizes)
+        else:
+            this_orderbook[b"B"] = OrderBookSide(neg)
+            this_orderbook[b"S"] = OrderBookSide()
+            this_orderbook[b" "] = OrderBookSide()
+        self.trading_actions[orderbook_no] = list()
+        return True
+
+    def add_recorders(self, orderbook_no):
+        """Message counts and recorders of a new orderbook"""
+        # initialize message counts
+        self.message_counts[orderbook_no] = Counter()
+
+        if self.time_weighted_window is None:
+            self.best_bid_ask[orderbook_no] = BestPriceRecorder()
+            self.best_depths[orderbook_no] = BestDepthRecorder()
+        else:
+            start_microsecond, end_microsecond = self.time_weighted_window
+            this_trading_actions = self.trading_actions[orderbook_no]
+            price_decimals = self.metadata[orderbook_no]["price_decimals"]
+            self.best_bid_ask[orderbook_no] = TimeWeightedSpread(
+                start_microsecond, end_microsecond, this_trading_actions
+            )
+            self.best_depths[orderbook_no] = TimeWeightedDepth(
+                start_microsecond, end_microsecond, this_trading_actions, price_decimals
+            )
+        self.transactions[orderbook_no] = TransactionRecorder()
+        self.order_stats[orderbook_no] = OrderStatsBuffer()
+        self.snapshots.dirty.add(orderbook_no)
+        self.open_close[orderbook_no] = list()
+
+    # Price Tick Size message
+    def price_tick_size(
+        self, nanoseconds, price_tick_table_id, price_tick_size, price_start
+    ):
+        this_tick_size_table = self.price_tick_sizes[price_tick_table_id]
+        this_tick_size_table[price_tick_size] = price_start
+
+    # Orderbook Trading Action message
+    def orderbook_trading_action(
+        self, nanoseconds, orderbook_no, trading_state, book_condition
+    ):
+        # skip orderbooks that were filtered out
+        if orderbook_no not in self.orderbooks:
+            return
+        timestamp = self.microseconds + nanoseconds // 1000
+        self.message_counts[orderbook_no]["orderbook_trading_action"] += 1
+        self.trading_actions[orderbook_no].append(
+            (timestamp, trading_state, book_condition)
+        )
+
+    # System Event message
+    def system_event(self, nanoseconds, group, event_code, orderbook_no):
+        timestamp = self.microseconds + nanoseconds // 1000
+        self.system_events.append((timestamp, group, event_code, orderbook_no))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Opt-in profile of the replay and the statistics of a day
+
+A DayProfile that is passed to SingleDayIMIData wraps every message handler,
+counting the messages and timing the handler of each type. The time of the
+'T' handler includes the per-second snapshot sweep. The replay is timed as a
+whole, so the time outside of the handlers is the decoding (and for .bin.gz
+files, the decompression, which is also timed on its own). Passed to
+calculate_orderbook_stats, it times each stage of the statistics. Without a
+profile, none of this is set up.
+"""
+
+# standard libraries
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import resource
+import sys
+import time
+from typing import Callable, Dict, Iterable
+
+
+def reset_peak_memory() -> bool:
+    """Measure the peak memory anew, e.g. for the next task of a worker
+
+    Only Linux can reset the peak resident set size, elsewhere the peak of
+    the whole process is kept and False is returned.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory() -> int:
+    """Peak resident set size of this process in bytes, see reset_peak_memory"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class DayProfile(object):
+    """Counts and cumulative seconds per message type and per stats stage"""
+
+    def __init__(self, date: str = None):
+        self.date = date
+        self.messages = defaultdict(lambda: [0, 0.0])
+        self.stages = defaultdict(lambda: [0, 0.0])
+        self.replay_seconds = 0.0
+        self.decompress_seconds = 0.0
+
+    def __getstate__(self):
+        # e.g. in checkpoints, the defaultdicts hold lambdas
+        state = self.__dict__.copy()
+        state["messages"] = dict(self.messages)
+        state["stages"] = dict(self.stages)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.messages = defaultdict(lambda: [0, 0.0], self.messages)
+        self.stages = defaultdict(lambda: [0, 0.0], self.stages)
+
+    def wrap_handlers(self, handlers: Dict[bytes, Callable]) -> Dict[bytes, Callable]:
+        """The same handlers, counting and timing their calls by message type"""
+        return {
+            message_type: self.wrap_handler(message_type.decode(), handler)
+            for message_type, handler in handlers.items()
+        }
+
+    def wrap_handler(self, message_type: str, handler: Callable) -> Callable:
+        totals = self.messages[message_type]
+        perf_counter = time.perf_counter
+
+        def profiled_handler(*fields):
+            start = perf_counter()
+            try:
+                handler(*fields)
+            finally:
+                totals[1] += perf_counter() - start
+            # not reached if the message is decoded again, e.g. after a checkpoint
+            totals[0] += 1
+
+        return profiled_handler
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage of the statistics, e.g. of one orderbook"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals = self.stages[name]
+            totals[0] += 1
+            totals[1] += time.perf_counter() - start
+
+    def to_dict(self) -> Dict:
+        number_of_messages = sum(count for count, _ in self.messages.values())
+        handler_seconds = sum(seconds for _, seconds in self.messages.values())
+        return {
+            "date": self.date,
+            "replay_seconds": self.replay_seconds,
+            "decompress_seconds": self.decompress_seconds,
+            "decode_seconds": max(
+                self.replay_seconds - handler_seconds - self.decompress_seconds, 0.0
+            ),
+            "messages": number_of_messages,
+            "messages_per_second": (
+                number_of_messages / self.replay_seconds
+                if self.replay_seconds
+                else None
+            ),
+            "peak_memory": peak_memory(),
+            "message_types": {
+                message_type: {"count": count, "seconds": seconds}
+                for message_type, (count, seconds) in sorted(self.messages.items())
+            },
+            "stages": {
+                name: {"count": count, "seconds": seconds}
+                for name, (count, seconds) in self.stages.items()
+            },
+        }
+
+    def save(self, file_path: Path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, "w") as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=1)
+
+
+def aggregate_profiles(profiles: Iterable[Dict]) -> Dict:
+    """Sum of the profiles of several days, as returned by DayProfile.to_dict"""
+    aggregate = {
+        "days": 0,
+        "replay_seconds": 0.0,
+        "decompress_seconds": 0.0,
+        "decode_seconds": 0.0,
+        "messages": 0,
+        "peak_memory": 0,
+        "message_types": defaultdict(lambda: {"count": 0, "seconds": 0.0}),
+        "stages": defaultdict(lambda: {"count": 0, "seconds": 0.0}),
+    }
+    for profile in profiles:
+        aggregate["days"] += 1
+        for key in ["replay_seconds", "decompress_seconds", "decode_seconds"]:
+            aggregate[key] += profile[key]
+        aggregate["messages"] += profile["messages"]
+        aggregate["peak_memory"] = max(aggregate["peak_memory"], profile["peak_memory"])
+        for key in ["message_types", "stages"]:
+            for name, totals in profile[key].items():
+                aggregate[key][name]["count"] += totals["count"]
+                aggregate[key][name]["seconds"] += totals["seconds"]
+    aggregate["messages_per_second"] = (
+        aggregate["messages"] / aggregate["replay_seconds"]
+        if aggregate["replay_seconds"]
+        else None
+    )
+    for key in ["message_types", "stages"]:
+        aggregate[key] = dict(
+            sorted(aggregate[key].items(), key=lambda item: -item[1]["seconds"])
+        )
+    return aggregate
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Manifest of the days whose statistics were written by process_all.py
+
+The workers write the results of every day straight to disk, partitioned as
+
+    <results_path>/days/<date>/part-<shard>.parquet
+
+(CSV without pyarrow), and the manifest records the checksum of the binary
+file, the code version they were calculated with and their format. Runs can
+then skip all days that are unchanged, and the combined panel is written from
+the files of all days, one day at a time. Days that are missing from the
+manifest or were not finished, e.g. after a crashed run, are left out of the
+panel with a warning.
+"""
+
+# standard libraries
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Iterable, Iterator, List, Optional
+import warnings
+
+# third-party packages
+import pandas as pd
+
+from calculate_statistics.calculate_all import STATISTICS_VERSION
+from process_messages.parquet_cache import PYARROW_AVAILABLE, get_checksum, get_date
+from process_messages.process_one_day import PARSER_VERSION
+
+if PYARROW_AVAILABLE:
+    import pyarrow.parquet as pq
+
+# results are outdated whenever the replay or the statistics change
+CODE_VERSION = f"{PARSER_VERSION}.{STATISTICS_VERSION}"
+MANIFEST_NAME = "manifest.json"
+RESULTS_FORMAT = "parquet" if PYARROW_AVAILABLE else "csv"
+RESULTS_SUFFIX = f".{RESULTS_FORMAT}"
+
+
+def write_day_results(
+    single_day_stats: pd.DataFrame, days_path: Path, date: str, shard: int = 0
+) -> Optional[str]:
+    """Write the results of a day, or of one of its shards, in a worker
+
+    Returns the directory of the day relative to `days_path`, None if there
+    were no results.
+    """
+    if single_day_stats.empty:
+        return None
+    day_path = days_path / date
+    day_path.mkdir(parents=True, exist_ok=True)
+    part_path = day_path / f"part-{shard}{RESULTS_SUFFIX}"
+    temporary_path = part_path.with_name("." + part_path.name)
+    if PYARROW_AVAILABLE:
+        single_day_stats.to_parquet(temporary_path)
+    else:
+        single_day_stats.to_csv(temporary_path)
+    os.replace(temporary_path, part_path)
+    return date
+
+
+def _results_parts(results_path: Path) -> List[Path]:
+    if results_path.is_dir():
+        return sorted(
+            (path for path in results_path.iterdir() if path.name.startswith("part-")),
+            key=lambda path: int(path.stem.split("-")[1]),
+        )
+    return [results_path]
+
+
+def _results_format(results_path: Path) -> Optional[str]:
+    """Format of the files of a day, from their suffix"""
+    parts = _results_parts(results_path)
+    return parts[0].suffix[1:] if parts and parts[0].exists() else None
+
+
+def _check_readable(part_path: Path):
+    if part_path.suffix == ".parquet" and not PYARROW_AVAILABLE:
+        raise ImportError(
+            f"{part_path} was written as Parquet, reading it needs pyarrow"
+        )
+
+
+def _read_part(part_path: Path) -> pd.DataFrame:
+    _check_readable(part_path)
+    if part_path.suffix == ".parquet":
+        return pd.read_parquet(part_path)
+    return pd.read_csv(part_path, index_col=0)
+
+
+def _read_columns(part_path: Path) -> List[str]:
+    _check_readable(part_path)
+    if part_path.suffix == ".parquet":
+        schema = pq.read_schema(part_path)
+        index_columns = json.loads(schema.metadata[b"pandas"])["index_columns"]
+        return [name for name in schema.names if name not in index_columns]
+    return list(pd.read_csv(part_path, index_col=0, nrows=0).columns)
+
+
+def _to_panel(daily_stats: pd.DataFrame) -> pd.DataFrame:
+    daily_stats = daily_stats.reset_index()
+    daily_stats.set_index("isin", inplace=True)
+    daily_stats.rename(columns={"index": "orderbook_no"}, inplace=True)
+    return daily_stats
+
+
+class ResultsManifest(object):
+    """Processed days by date, stored as JSON next to their results
+
+    The manifest is rewritten after every day, so a run that crashes keeps
+    all days that were finished before.
+    """
+
+    def __init__(self, results_path: Path):
+        self.results_path = results_path
+        self.days_path = results_path / "days"
+        self.path = results_path / MANIFEST_NAME
+        if self.path.exists():
+            with open(self.path) as manifest_file:
+                self.days = json.load(manifest_file)
+        else:
+            self.days = dict()
+
+    def get_checksum(self, file_path: Path) -> str:
+        """Checksum of a binary file, reused if its size and mtime did not change"""
+        entry = self.days.get(get_date(file_path))
+        file_stat = file_path.stat()
+        if (
+            entry is not None
+            and entry["file_name"] == file_path.name
+            and entry["file_size"] == file_stat.st_size
+            and entry["file_mtime_ns"] == file_stat.st_mtime_ns
+        ):
+            return entry["checksum"]
+        return get_checksum(file_path)
+
+    def is_recorded(self, file_path: Path) -> bool:
+        """Whether the results of a day were written, possibly outdated"""
+        entry = self.days.get(get_date(file_path))
+        return entry is not None and entry.get("finished", True)
+
+    def is_done(self, file_path: Path) -> bool:
+        """Whether the results of a day are up to date and readable here"""
+        if not self.is_recorded(file_path):
+            return False
+        entry = self.days[get_date(file_path)]
+        if entry["code_version"] != CODE_VERSION:
+            return False
+        if entry["results_file"] is not None:
+            if not (self.days_path / entry["results_file"]).exists():
+                return False
+            if entry.get("results_format") == "parquet" and not PYARROW_AVAILABLE:
+                return False
+        return entry["checksum"] == self.get_checksum(file_path)
+
+    def clear(self, file_path: Path):
+        """Remove the results of a day, before it is processed again
+
+        The entry is kept but marked as unfinished, so that its checksum and
+        the runtime and peak memory of the day survive a crashed run.
+        """
+        date = get_date(file_path)
+        entry = self.days.get(date)
+        if entry is not None and entry.get("finished", True):
+            entry["finished"] = False
+            self.save()
+        shutil.rmtree(self.days_path / date, ignore_errors=True)
+
+    def add(
+        self,
+        file_path: Path,
+        results_file: Optional[str],
+        runtime: Optional[float] = None,
+        peak_memory: Optional[int] = None,
+        checksum: Optional[str] = None,
+    ):
+        """Record a day whose results were written by write_day_results
+
+        The runtime in seconds and the peak memory in bytes are used to
+        schedule the days of later runs. A `checksum` that a worker already
+        calculated is not calculated again.
+        """
+        date = get_date(file_path)
+        if checksum is None:
+            checksum = self.get_checksum(file_path)
+        file_stat = file_path.stat()
+        # the workers, e.g. on other hosts, may have written another format
+        results_format = (
+            None
+            if results_file is None
+            else _results_format(self.days_path / results_file)
+        )
+        self.days[date] = {
+            "file_name": file_path.name,
+            "file_size": file_stat.st_size,
+            "file_mtime_ns": file_stat.st_mtime_ns,
+            "checksum": checksum,
+            "code_version": CODE_VERSION,
+            "results_file": results_file,
+            "results_format": results_format,
+            "finished": True,
+            "runtime": runtime,
+            "peak_memory": peak_memory,
+            "finished_at": pd.Timestamp("now").isoformat(),
+        }
+        self.save()
+
+    def save(self):
+        self.results_path.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(".tmp")
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(self.days, manifest_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    def recorded_days(self, file_paths: Iterable[Path]) -> List[Path]:
+        """The finished days of the manifest, warns about all others"""
+        file_paths = list(file_paths)
+        recorded = [path for path in file_paths if self.is_recorded(path)]
+        if len(recorded) < len(file_paths):
+            missing_dates = sorted(
+                set(map(get_date, file_paths)).difference(map(get_date, recorded))
+            )
+            warnings.warn(
+                f"{len(missing_dates)} days are missing from the manifest or "
+                f"unfinished and are skipped: {', '.join(missing_dates)}"
+            )
+        return recorded
+
+    def results_parts(self, file_path: Path) -> List[Path]:
+        """Files with the results of a day, empty if it had no selected orderbooks"""
+        results_file = self.days[get_date(file_path)]["results_file"]
+        if results_file is None:
+            return list()
+        return _results_parts(self.days_path / results_file)
+
+    def load_results(self, file_path: Path) -> Optional[pd.DataFrame]:
+        """Results of a day, None if it had no selected orderbooks"""
+        parts = [_read_part(path) for path in self.results_parts(file_path)]
+        if not parts:
+            return None
+        return pd.concat(parts, sort=False)
+
+    def iter_results(self, file_paths: Iterable[Path]) -> Iterator[pd.DataFrame]:
+        """Results of some days, one day at a time
+
+        Days that are missing from the manifest or unfinished are skipped
+        with a warning.
+        """
+        for file_path in self.recorded_days(file_paths):
+            single_day_stats = self.load_results(file_path)
+            if single_day_stats is not None:
+                yield single_day_stats
+
+    def assemble(self, file_paths: Iterable[Path]) -> pd.DataFrame:
+        """Combine the results of some days into one panel
+
+        Each row corresponds to a stock/day combination. For many days, use
+        write_panel, which does not hold all days in memory.
+        """
+        daily_stats = list(self.iter_results(file_paths))
+        if not daily_stats:
+            return pd.DataFrame()
+        return _to_panel(pd.concat(daily_stats, sort=False))
+
+    def write_panel(self, file_paths: Iterable[Path], path: Path, **to_csv_kwargs):
+        """Write the panel of assemble to a CSV file, one day at a time
+
+        The columns are the union of the columns of all days, as with
+        pd.concat, and are collected from the headers of the files first.
+        """
+        file_paths = self.recorded_days(file_paths)
+        columns = dict()
+        for file_path in file_paths:
+            for part_path in self.results_parts(file_path):
+                columns.update(dict.fromkeys(_read_columns(part_path)))
+        if not columns:
+            pd.DataFrame().to_csv(path, **to_csv_kwargs)
+            return
+        header = True
+        with open(path, "w") as panel_file:
+            for single_day_stats in self.iter_results(file_paths):
+                single_day_stats = single_day_stats.reindex(columns=list(columns))
+                _to_panel(single_day_stats).to_csv(
+                    panel_file, header=header, **to_csv_kwargs
+                )
+                header = False
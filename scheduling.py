@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Order the trading days of a run by their expected runtime and memory
+
+Days differ a lot in size, e.g. on index rebalancing or volatile days. With
+the largest days started first, the small days fill up the workers at the
+end of a run, instead of one worker still replaying a large day while all
+others are idle (longest processing time first scheduling). The expected
+peak memory of each day lets executors admit days only while there is
+enough memory for them.
+"""
+
+# standard libraries
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# third-party packages
+import pandas as pd
+
+try:
+    import psutil
+
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+from process_messages.parquet_cache import get_date
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# memory of a worker that imported everything, and the additional peak memory
+# per byte of unzipped and zipped files, as measured on sample days
+WORKER_MEMORY = 100 * 1024 ** 2
+MEMORY_PER_BYTE = {".bin": 6.0, ".gz": 12.0}
+
+
+def get_default_workers() -> int:
+    """All cores but one, which is left for the parent process"""
+    return max(os.cpu_count() - 1, 1)
+
+
+def _estimate_from_history(
+    file_paths: List[Path], days: Dict, field: str
+) -> Dict[Path, Optional[float]]:
+    """Estimates of a field of the manifest entries, such as the runtime
+
+    Days without a recorded value are estimated from the value per byte of
+    the other days, which is taken separately for zipped and unzipped files.
+    None without any history.
+    """
+    history = defaultdict(lambda: [0.0, 0])
+    for entry in days.values():
+        if entry.get(field) is None:
+            continue
+        for suffix in (Path(entry["file_name"]).suffix, None):
+            history[suffix][0] += entry[field]
+            history[suffix][1] += entry["file_size"]
+    value_per_byte = {
+        suffix: value / file_size
+        for suffix, (value, file_size) in history.items()
+        if file_size > 0
+    }
+
+    estimates = dict()
+    for file_path in file_paths:
+        entry = days.get(get_date(file_path))
+        if entry is not None and entry.get(field) is not None:
+            estimates[file_path] = entry[field]
+            continue
+        per_byte = value_per_byte.get(file_path.suffix, value_per_byte.get(None))
+        estimates[file_path] = (
+            None if per_byte is None else file_path.stat().st_size * per_byte
+        )
+    return estimates
+
+
+def estimate_runtimes(file_paths: List[Path], days: Dict) -> Dict[Path, float]:
+    """Expected seconds per day, from earlier runs or from the file size
+
+    `days` are the entries of a ResultsManifest. Without any history, the
+    estimates are just the file sizes, which still give the same order.
+    """
+    estimates = _estimate_from_history(file_paths, days, "runtime")
+    return {
+        file_path: file_path.stat().st_size if estimate is None else estimate
+        for file_path, estimate in estimates.items()
+    }
+
+
+def estimate_memory(file_paths: List[Path], days: Dict) -> Dict[Path, float]:
+    """Expected peak memory per day in bytes, from earlier runs or the file size
+
+    Without any history, the rough MEMORY_PER_BYTE of our sample days is
+    used, on top of the memory of an idle worker.
+    """
+    estimates = _estimate_from_history(file_paths, days, "peak_memory")
+    return {
+        file_path: (
+            WORKER_MEMORY
+            + file_path.stat().st_size
+            * MEMORY_PER_BYTE.get(file_path.suffix, MEMORY_PER_BYTE[".bin"])
+            if estimate is None
+            else estimate
+        )
+        for file_path, estimate in estimates.items()
+    }
+
+
+def total_memory() -> int:
+    """Physical memory in bytes"""
+    return os.sysconf("SC_PHYS_PAGES") * PAGE_SIZE
+
+
+def available_memory() -> int:
+    """Memory in bytes that can be allocated without swapping"""
+    if PSUTIL_AVAILABLE:
+        return psutil.virtual_memory().available
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("the available memory is unknown, install psutil")
+
+
+def resident_memory(pid: int) -> int:
+    """Resident set size of a process in bytes, 0 if it has ended"""
+    if PSUTIL_AVAILABLE:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return 0
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def order_largest_first(
+    tasks: List[Tuple[Path, int, int]], estimates: Dict[Path, float]
+) -> List[Tuple[Path, int, int]]:
+    """Tasks sorted by the expected runtime of their day, longest first"""
+    return sorted(tasks, key=lambda task: (-estimates[task[0]], task[0], task[2]))
+
+
+class RuntimeProfile(object):
+    """Runtimes of the days of a run, compared to the best possible makespan"""
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.start = time.time()
+        self.records = list()
+        # profiles of the days, if they were profiled
+        self.day_profiles = list()
+
+    def add(self, file_path: Path, estimate: float, timing: Dict):
+        """Record a finished task, `timing` as returned by the worker"""
+        if timing.get("profile") is not None:
+            self.day_profiles.append(timing["profile"])
+        self.records.append(
+            {
+                "date": get_date(file_path),
+                "file_name": file_path.name,
+                "file_size": file_path.stat().st_size,
+                "estimate": estimate,
+                "worker": timing["worker"],
+                "started": timing["started"] - self.start,
+                "finished": timing["finished"] - self.start,
+                "runtime": timing["finished"] - timing["started"],
+                "peak_memory": timing.get("peak_memory"),
+            }
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.records,
+            columns=[
+                "date",
+                "file_name",
+                "file_size",
+                "estimate",
+                "worker",
+                "started",
+                "finished",
+                "runtime",
+                "peak_memory",
+            ],
+        )
+
+    def summary(self) -> Dict[str, float]:
+        """Makespan and its lower bound, max(longest task, total work / workers)"""
+        profile = self.to_frame()
+        if profile.empty:
+            return {"makespan": 0.0, "lower_bound": 0.0, "efficiency": 1.0}
+        makespan = profile["finished"].max()
+        lower_bound = max(
+            profile["runtime"].max(), profile["runtime"].sum() / self.num_workers
+        )
+        return {
+            "makespan": makespan,
+            "lower_bound": lower_bound,
+            "efficiency": lower_bound / makespan if makespan > 0 else 1.0,
+        }
+
+    def save(self, file_path: Path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.to_frame().to_csv(file_path, index=False, float_format="%.3f")
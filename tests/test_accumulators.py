@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Time-weighted accumulators give the averages of the pandas statistics"""
+
+# standard libraries
+import struct
+
+# third-party packages
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import (
+    FILE_NAME,
+    add_sideless_orders,
+    generate_day,
+    split_messages,
+)
+from calculate_statistics.best_bid_ask import calculate_best_bid_ask_statistics
+from calculate_statistics.best_depths import calculate_best_depth_statistics
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    prepare_metadata,
+    prepare_tick_sizes,
+    prepare_trading_actions,
+)
+from process_messages.process_one_day import SingleDayIMIData
+
+# the first orderbook of the synthetic days is halted from 13:00 to 13:05
+HALT_START = 13 * 3600 * 1_000_000
+HALT_END = (13 * 3600 + 300) * 1_000_000
+WINDOWS = ["default", "around_halt", "within_halt", "event_edges", "before_trading"]
+
+
+def drop_asks(data: bytes, orderbook_no: int) -> bytes:
+    """Remove all sell orders of an orderbook, so that it never has asks"""
+    dropped = set()
+    messages = list()
+    for message in split_messages(data):
+        message_type = message[2:3]
+        if message_type == b"A":
+            (order_no,) = struct.unpack_from(">Q", message, 7)
+            book_side = message[15:16]
+            (this_orderbook_no,) = struct.unpack_from(">I", message, 20)
+            if this_orderbook_no == orderbook_no and book_side == b"S":
+                dropped.add(order_no)
+                continue
+        elif message_type in [b"D", b"E", b"C", b"U"]:
+            (order_no,) = struct.unpack_from(">Q", message, 7)
+            if order_no in dropped:
+                if message_type == b"U":
+                    dropped.add(struct.unpack_from(">Q", message, 15)[0])
+                continue
+        messages.append(message)
+    return b"".join(messages)
+
+
+@pytest.fixture(scope="module", params=["dense", "sparse", "one_sided"])
+def day_path(request, tmp_path_factory):
+    if request.param == "dense":
+        data = generate_day(5_000, num_orderbooks=3, seed=4)
+    elif request.param == "sparse":
+        # few orders, so that the book sides are often empty
+        data = generate_day(300, num_orderbooks=4, seed=5)
+    else:
+        data = drop_asks(generate_day(2_000, num_orderbooks=3, seed=6), 1002)
+    file_path = tmp_path_factory.mktemp(request.param) / FILE_NAME
+    file_path.write_bytes(add_sideless_orders(data))
+    return file_path
+
+
+@pytest.fixture(scope="module")
+def recorded_day(day_path):
+    this_day_imi_data = SingleDayIMIData(day_path, engine="python")
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+def get_window(name: str, recorded_day):
+    if name == "default":
+        return START_MICROSECOND, END_MICROSECOND
+    if name == "around_halt":
+        return HALT_START - 60_000_000, HALT_END + 60_000_000
+    if name == "within_halt":
+        return HALT_START + 10_000_000, HALT_END - 10_000_000
+    if name == "event_edges":
+        # both ends fall exactly on events of the first orderbook
+        timestamps = recorded_day.best_bid_ask[1001].to_frame()["timestamp"]
+        return int(timestamps.iloc[len(timestamps) // 4]), int(
+            timestamps.iloc[3 * len(timestamps) // 4]
+        )
+    return 0, 8 * 3600 * 1_000_000
+
+
+def test_uses_both_sides(day_path, recorded_day):
+    # the one-sided day indeed never has asks in the second orderbook
+    book_sides = set(recorded_day.best_bid_ask[1002].to_frame()["book_side"])
+    assert (b"S" in book_sides) == ("one_sided" not in str(day_path))
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_time_weighted_averages(day_path, recorded_day, window):
+    start_microsecond, end_microsecond = get_window(window, recorded_day)
+    accumulated_day = SingleDayIMIData(
+        day_path,
+        engine="python",
+        time_weighted_window=(start_microsecond, end_microsecond),
+    )
+    accumulated_day.process_messages()
+    accumulated_day.close()
+
+    metadata = prepare_metadata(recorded_day)
+    for orderbook_no in metadata.index:
+        metainfo = metadata.loc[orderbook_no]
+        trading_actions = prepare_trading_actions(recorded_day, orderbook_no)
+        tick_sizes = prepare_tick_sizes(recorded_day, metainfo)
+
+        best_bid_ask_stats = calculate_best_bid_ask_statistics(
+            recorded_day.best_bid_ask[orderbook_no].to_frame(),
+            trading_actions,
+            tick_sizes,
+            start_microsecond,
+            end_microsecond,
+        )
+        np.testing.assert_allclose(
+            accumulated_day.best_bid_ask[orderbook_no].time_weighted_average(),
+            best_bid_ask_stats["quoted_rel_spread_bps_time_weighted"],
+            rtol=1e-9,
+        )
+
+        best_depth_stats = calculate_best_depth_statistics(
+            recorded_day.best_depths[orderbook_no].to_frame(),
+            trading_actions,
+            metainfo,
+            start_microsecond,
+            end_microsecond,
+        )
+        np.testing.assert_allclose(
+            accumulated_day.best_depths[orderbook_no].time_weighted_average(),
+            best_depth_stats["depth_time_weighted_average"],
+            rtol=1e-9,
+        )
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Point-in-time queries equal a replay of the day up to that time"""
+
+# standard libraries
+import random
+import struct
+
+# third-party packages
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, generate_day, split_messages
+from process_messages.book_query import BookQuery
+from process_messages.process_one_day import SingleDayIMIData
+
+
+def message_time(message: bytes, seconds: int) -> int:
+    """Microseconds after midnight of a message with its length bytes"""
+    if message[2:3] == b"T":
+        (seconds,) = struct.unpack_from(">I", message, 3)
+        return seconds * 1_000_000
+    (nanoseconds,) = struct.unpack_from(">I", message, 3)
+    return seconds * 1_000_000 + nanoseconds // 1000
+
+
+def replay_until(messages, timestamp: int, directory) -> SingleDayIMIData:
+    """A full replay of all messages up to and including `timestamp`"""
+    selected_messages = list()
+    seconds = 0
+    for message in messages:
+        time = message_time(message, seconds)
+        if time > timestamp:
+            break
+        seconds = time // 1_000_000
+        selected_messages.append(message)
+    directory.mkdir()
+    file_path = directory / FILE_NAME
+    file_path.write_bytes(b"".join(selected_messages))
+    # the file is empty before the first message, which cannot be mapped
+    imi_data = SingleDayIMIData(file_path, use_mmap=False, engine="python")
+    imi_data.process_messages()
+    imi_data.close()
+    return imi_data
+
+
+@pytest.fixture(scope="module")
+def day(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("day")
+    file_path = directory / FILE_NAME
+    file_path.write_bytes(generate_day(3_000, num_orderbooks=3, seed=5))
+    return file_path
+
+
+@pytest.fixture(scope="module")
+def timestamps(day):
+    messages = split_messages(day.read_bytes())
+    message_times = list()
+    seconds = 0
+    for message in messages:
+        time = message_time(message, seconds)
+        seconds = time // 1_000_000
+        message_times.append(time)
+    assert message_times == sorted(message_times)
+    rng = random.Random(5)
+    timestamps = [0, 5 * 3600 * 1_000_000, message_times[-1] + 1]
+    # at, just before and just after a message, e.g. of a checkpoint second
+    for time in rng.sample(message_times, 20) + [9 * 3600 * 1_000_000]:
+        timestamps += [time - 1, time, time + 1]
+    return sorted(set(timestamps))
+
+
+@pytest.fixture(scope="module")
+def expected_days(day, timestamps, tmp_path_factory):
+    messages = split_messages(day.read_bytes())
+    directory = tmp_path_factory.mktemp("expected")
+    return {
+        timestamp: replay_until(messages, timestamp, directory / str(timestamp))
+        for timestamp in timestamps
+    }
+
+
+@pytest.mark.parametrize("interval", [60, 3600])
+def test_book_query(day, timestamps, expected_days, interval):
+    book_query = BookQuery(day, interval=interval)
+    assert book_query.checkpoint_seconds
+    for timestamp in timestamps:
+        expected_day = expected_days[timestamp]
+        expected_orders = expected_day.orders.to_numpy()
+        for orderbook_no in book_query.metadata:
+            orders = book_query.orders_at(orderbook_no, timestamp)
+            assert {
+                order_no: tuple(order)
+                for order_no, order in zip(
+                    orders.index.tolist(), orders.values.tolist()
+                )
+            } == {
+                order_no: (book_side, price, quantity)
+                for order_no, order_orderbook_no, book_side, price, quantity in (
+                    expected_orders.tolist()
+                )
+                if order_orderbook_no == orderbook_no
+            }
+
+            book = book_query.book_at(orderbook_no, timestamp)
+            for book_side in [b"B", b"S", b" "]:
+                if orderbook_no in expected_day.orderbooks:
+                    expected_levels = [
+                        (price, quantity)
+                        for price, quantity in expected_day.orderbooks[orderbook_no][
+                            book_side
+                        ].items()
+                        if quantity != 0
+                    ]
+                else:
+                    expected_levels = []
+                assert list(book[book_side].items()) == expected_levels
+    book_query.close()
+
+
+def test_unknown_orderbook(day):
+    book_query = BookQuery(day, interval=3600)
+    with pytest.raises(KeyError):
+        book_query.orders_at(-1, 0)
+    with pytest.raises(KeyError):
+        book_query.get_orderbook_no("XX0000000000")
+    book_query.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Typed buffers hold the same data as the dicts and lists they replace"""
+
+# standard libraries
+from collections import namedtuple
+import pickle
+import random
+
+# third-party packages
+import numpy as np
+import pandas as pd
+import pytest
+
+from calculate_statistics.calculate_all import END_MICROSECOND, START_MICROSECOND
+from calculate_statistics.order_stats import calculate_order_stats
+from process_messages.buffers import (
+    BestDepthRecorder,
+    BestPriceRecorder,
+    OrderStatsBuffer,
+    TransactionRecorder,
+)
+
+
+def random_order_stats(seed: int):
+    """Order lifecycles in a buffer and in the former dict of dicts"""
+    rng = random.Random(seed)
+    buffer = OrderStatsBuffer()
+    order_stats = dict()
+    rows = dict()
+    timestamp = START_MICROSECOND - 10_000_000
+    for order_no in range(1, 3_000):
+        timestamp += rng.randrange(0, 20_000)
+        # market orders and orders on empty book sides (NaN best price)
+        price = rng.choice([2147483647] + [1_000_000 + 100 * i for i in range(-5, 5)])
+        best_price = rng.choice([np.nan, 1_000_000, 1_000_100])
+        quantity = 10 * rng.randrange(1, 20)
+        rows[order_no] = buffer.add(order_no, timestamp, price, best_price, quantity)
+        order_stats[order_no] = {
+            "entry_time": timestamp,
+            "price": price,
+            "best_price": best_price,
+            "quantity_entered": quantity,
+            "quantity_filled": 0,
+            "first_fill_time": None,
+            "remove_time": None,
+        }
+        # fill and remove some earlier orders, some at the same microsecond
+        for this_order_no in rng.sample(range(1, order_no + 1), min(order_no, 2)):
+            this_order = order_stats[this_order_no]
+            if this_order["remove_time"] is not None:
+                continue
+            if rng.random() < 0.5:
+                executed_quantity = rng.randrange(1, this_order["quantity_entered"] + 1)
+                buffer.fill(rows[this_order_no], timestamp, executed_quantity)
+                this_order["quantity_filled"] += executed_quantity
+                if this_order["first_fill_time"] is None:
+                    this_order["first_fill_time"] = timestamp
+            else:
+                buffer.remove(rows[this_order_no], timestamp)
+                this_order["remove_time"] = timestamp
+    return buffer, order_stats
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_order_stats(seed):
+    buffer, order_stats = random_order_stats(seed)
+    expected = pd.DataFrame.from_dict(order_stats, orient="index")
+    actual = buffer.to_frame()
+    assert len(buffer) == len(order_stats)
+    pd.testing.assert_frame_equal(
+        actual.astype(float), expected.astype(float), check_index_type=False
+    )
+
+    tick_sizes = pd.DataFrame(
+        {"tick_size": [100, 500], "price_start": [0, 1_000_000]}
+    ).assign(price_end=[1_000_000, np.inf])
+    arguments = [
+        pd.DataFrame(columns=["timestamp", "until"]),
+        pd.Series({"price_decimals": 4}),
+        tick_sizes,
+        START_MICROSECOND,
+        END_MICROSECOND,
+    ]
+    assert calculate_order_stats(actual, *arguments) == pytest.approx(
+        calculate_order_stats(expected, *arguments), nan_ok=True
+    )
+
+
+def random_events(recorder_type, seed: int):
+    """Events in a recorder and in the former list of namedtuples"""
+    rng = random.Random(seed)
+    Event = namedtuple("Event", [name for name, _ in recorder_type.fields])
+    recorder = recorder_type()
+    events = list()
+    timestamp = START_MICROSECOND
+    for _ in range(1_000):
+        timestamp += rng.randrange(0, 3)
+        values = list()
+        for name, code in recorder_type.fields:
+            if name == "timestamp":
+                value = timestamp
+            elif code == "c":
+                value = rng.choice([b"B", b"S", b" "])
+            elif code == "d":
+                # NaN prices of empty book sides
+                value = rng.choice([np.nan, 1_000_000.0, 2147483647.0, 5e9])
+            else:
+                value = rng.randrange(0, 2 ** 40)
+            values.append(value)
+        recorder.append(*values)
+        events.append(
+            Event(
+                *[
+                    value.decode() if name in recorder_type.string_fields else value
+                    for (name, _), value in zip(recorder_type.fields, values)
+                ]
+            )
+        )
+    return recorder, events
+
+
+@pytest.mark.parametrize(
+    "recorder_type", [BestPriceRecorder, BestDepthRecorder, TransactionRecorder]
+)
+def test_event_recorders(recorder_type):
+    recorder, events = random_events(recorder_type, 2)
+    expected = pd.DataFrame(events)
+    pd.testing.assert_frame_equal(recorder.to_frame(), expected, check_dtype=False)
+
+    # recorders are picklable and can be extended by whole arrays
+    copy = pickle.loads(pickle.dumps(recorder))
+    copy.extend(recorder.to_numpy()[:10])
+    assert len(copy) == len(events) + 10
+    pd.testing.assert_frame_equal(
+        copy.to_frame().iloc[len(events) :].reset_index(drop=True),
+        recorder.to_frame().iloc[:10],
+    )
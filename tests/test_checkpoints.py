@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Days resumed from any checkpoint equal a replay from the start"""
+
+# standard libraries
+import gzip
+
+# third-party packages
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, generate_day
+from process_messages.checkpoints import (
+    get_checkpoint_dir,
+    list_checkpoints,
+    remove_checkpoints,
+)
+from process_messages.numba_engine import compare_replays
+from process_messages.process_one_day import SingleDayIMIData
+
+
+def replay(imi_data: SingleDayIMIData) -> SingleDayIMIData:
+    imi_data.process_messages()
+    imi_data.close()
+    return imi_data
+
+
+@pytest.fixture(scope="module", params=["binary", "compressed"])
+def day_path(request, tmp_path_factory):
+    directory = tmp_path_factory.mktemp(request.param)
+    data = generate_day(5_000, num_orderbooks=4, seed=3)
+    if request.param == "compressed":
+        file_path = directory / (FILE_NAME + ".gz")
+        file_path.write_bytes(gzip.compress(data))
+    else:
+        file_path = directory / FILE_NAME
+        file_path.write_bytes(data)
+    return file_path
+
+
+@pytest.fixture(scope="module")
+def full_replay(day_path):
+    return replay(SingleDayIMIData(day_path, engine="python"))
+
+
+@pytest.fixture(scope="module")
+def checkpoint_paths(day_path, full_replay):
+    checkpointed_replay = replay(
+        SingleDayIMIData(day_path, engine="python", checkpoint_interval=3600)
+    )
+    # taking checkpoints does not change the replay
+    assert compare_replays(checkpointed_replay, full_replay) == []
+    checkpoint_paths = list_checkpoints(get_checkpoint_dir(day_path))
+    assert len(checkpoint_paths) > 2
+    return checkpoint_paths
+
+
+def test_resume(day_path, full_replay, checkpoint_paths):
+    for second in checkpoint_paths:
+        resumed_replay = SingleDayIMIData.from_checkpoint(day_path, second=second)
+        assert resumed_replay.checkpoint_second == second
+        assert compare_replays(replay(resumed_replay), full_replay) == []
+
+
+def test_latest_checkpoint(day_path, full_replay, checkpoint_paths):
+    seconds = list(checkpoint_paths)
+    resumed_replay = SingleDayIMIData.from_checkpoint(day_path, second=seconds[1] + 1)
+    assert resumed_replay.checkpoint_second == seconds[1]
+    resumed_replay = SingleDayIMIData.from_checkpoint(day_path)
+    assert resumed_replay.checkpoint_second == seconds[-1]
+    assert compare_replays(replay(resumed_replay), full_replay) == []
+
+
+def test_missing_checkpoint(day_path, checkpoint_paths, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        SingleDayIMIData.from_checkpoint(day_path, second=min(checkpoint_paths) - 1)
+
+    # checkpoints of another file are rejected
+    other_path = tmp_path / day_path.name
+    other_path.write_bytes(day_path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        SingleDayIMIData.from_checkpoint(
+            other_path, checkpoint_dir=get_checkpoint_dir(day_path)
+        )
+
+
+def test_remove_checkpoints(tmp_path):
+    file_path = tmp_path / FILE_NAME
+    file_path.write_bytes(generate_day(1_000, num_orderbooks=2, seed=4))
+    replay(SingleDayIMIData(file_path, engine="python", checkpoint_interval=3600))
+    checkpoint_dir = get_checkpoint_dir(file_path)
+    assert list_checkpoints(checkpoint_dir)
+    remove_checkpoints(checkpoint_dir)
+    assert not checkpoint_dir.exists()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Executors that run the tasks of process_all.py"""
+
+# standard libraries
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import os
+from pathlib import Path
+import time
+
+# third-party packages
+import pytest
+
+from executors import DASK_AVAILABLE, AdaptiveExecutor, DaskExecutor
+from process_messages.profiling import peak_memory, reset_peak_memory
+
+
+class FixedMemoryExecutor(AdaptiveExecutor):
+    """AdaptiveExecutor with a fixed amount of memory for the tasks
+
+    Records the memory estimate of every task that is started.
+    """
+
+    def __init__(self, memory: float, **kwargs):
+        super().__init__(poll_interval=0.05, **kwargs)
+        self.memory = memory
+        self.started = list()
+
+    def headroom(self, running):
+        return self.memory - sum(estimate for _, estimate, _, _, _ in running.values())
+
+    def submit(self, function, task, estimate, attempt, crashes, running):
+        self.started.append((task, estimate))
+        super().submit(function, task, estimate, attempt, crashes, running)
+
+
+def sleep_task(task):
+    start = time.time()
+    time.sleep(0.3)
+    return task, start, time.time()
+
+
+def record_attempt(directory: Path, task) -> int:
+    """Number of earlier attempts of a task"""
+    attempts = len(list(directory.glob(f"{task}-*")))
+    (directory / f"{task}-{attempts}").touch()
+    return attempts
+
+
+def crash_once(directory, task):
+    if task == 1 and record_attempt(directory, task) == 0:
+        os._exit(1)
+    return task
+
+
+def crash_always(directory, task):
+    if task == 1:
+        record_attempt(directory, task)
+        os._exit(1)
+    return task
+
+
+def fail_always(directory, task):
+    if task == 1:
+        record_attempt(directory, task)
+        raise ValueError(f"task {task} failed")
+    return task
+
+
+def overlaps(results, first, second) -> bool:
+    times = {task: (start, end) for task, start, end in results}
+    return times[first][0] < times[second][1] and times[second][0] < times[first][1]
+
+
+def test_admission():
+    # only one of the tasks fits into the memory at a time
+    with FixedMemoryExecutor(100, num_workers=3) as executor:
+        results = list(executor.map_unordered(sleep_task, [0, 1, 2], [60, 60, 60]))
+    assert sorted(task for task, _, _ in results) == [0, 1, 2]
+    assert not any(
+        overlaps(results, first, second) for first, second in [(0, 1), (0, 2), (1, 2)]
+    )
+
+
+def test_too_large_task_runs_alone():
+    with FixedMemoryExecutor(100, num_workers=2) as executor:
+        results = list(executor.map_unordered(sleep_task, [0, 1], [500, 10]))
+    assert sorted(task for task, _, _ in results) == [0, 1]
+    assert not overlaps(results, 0, 1)
+
+
+def test_skip_ahead():
+    # the second task does not fit next to the first one, but the third does
+    with FixedMemoryExecutor(100, num_workers=3) as executor:
+        results = list(executor.map_unordered(sleep_task, [0, 1, 2], [60, 70, 30]))
+    assert [task for task, _ in executor.started] == [0, 2, 1]
+    assert overlaps(results, 0, 2)
+    assert not overlaps(results, 0, 1)
+
+
+def test_crash_restart(tmp_path):
+    with FixedMemoryExecutor(100, num_workers=2) as executor:
+        results = executor.map_unordered(
+            partial(crash_once, tmp_path), [0, 1, 2, 3], [10, 20, 10, 10]
+        )
+        assert sorted(results) == [0, 1, 2, 3]
+    # the crashed task is started again with twice its estimate
+    assert [estimate for task, estimate in executor.started if task == 1] == [20, 40]
+
+
+def test_crash_retries(tmp_path):
+    with pytest.raises(BrokenProcessPool):
+        with FixedMemoryExecutor(100, num_workers=2, crash_retries=2) as executor:
+            list(executor.map_unordered(partial(crash_always, tmp_path), [0, 1, 2]))
+    assert len(list(tmp_path.glob("1-*"))) == 3
+
+
+def test_retries(tmp_path):
+    with pytest.raises(ValueError, match="task 1 failed"):
+        with FixedMemoryExecutor(100, num_workers=2, retries=1) as executor:
+            list(executor.map_unordered(partial(fail_always, tmp_path), [0, 1, 2]))
+    assert len(list(tmp_path.glob("1-*"))) == 2
+
+
+@pytest.mark.skipif(not DASK_AVAILABLE, reason="needs dask.distributed")
+def test_dask_memory_limit_of_existing_cluster():
+    with pytest.raises(ValueError, match="memory limit"):
+        DaskExecutor(scheduler_address="tcp://127.0.0.1:1", memory_limit=8e9)
+
+
+def test_peak_memory_of_each_task():
+    # e.g. the second task of a reused worker
+    memory = bytearray(256 * 1024 ** 2)
+    del memory
+    peak_of_first_task = peak_memory()
+    if not reset_peak_memory():
+        pytest.skip("the peak memory can only be reset on Linux")
+    assert peak_memory() < peak_of_first_task - 128 * 1024 ** 2
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Both replay engines give bit-identical results on synthetic days"""
+
+# standard libraries
+import gzip
+
+# third-party packages
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, generate_day, split_messages
+from process_messages import numba_engine
+from process_messages.process_one_day import OrderbookFilter, SingleDayIMIData
+
+ORDERBOOK_FILTERS = [
+    None,
+    OrderbookFilter(groups=["ACoK"]),
+    OrderbookFilter(num_shards=2, shard=1),
+    OrderbookFilter(isins=["CH0000001002", "CH0000001003"]),
+]
+
+
+def late_directory_day(**kwargs) -> bytes:
+    """A synthetic day whose first directory message comes after a trading
+    action and some orders of its orderbook"""
+    messages = split_messages(generate_day(**kwargs))
+    directory = messages.pop(
+        next(index for index, message in enumerate(messages) if message[2:3] == b"R")
+    )
+    trading_action = next(
+        index for index, message in enumerate(messages) if message[2:3] == b"H"
+    )
+    messages.insert(trading_action + 200, directory)
+    return b"".join(messages)
+
+
+@pytest.fixture(
+    scope="module",
+    params=["late_directory", "deep_books", "compressed"],
+)
+def day_path(request, tmp_path_factory):
+    directory = tmp_path_factory.mktemp(request.param)
+    if request.param == "late_directory":
+        data = late_directory_day(num_events=5_000, num_orderbooks=4, seed=1)
+    else:
+        data = generate_day(5_000, num_orderbooks=3, seed=2, price_levels=300)
+    if request.param == "compressed":
+        file_path = directory / (FILE_NAME + ".gz")
+        file_path.write_bytes(gzip.compress(data))
+    else:
+        file_path = directory / FILE_NAME
+        file_path.write_bytes(data)
+    return file_path
+
+
+@pytest.fixture(params=["default", "small"])
+def buffer_sizes(request, monkeypatch):
+    # small buffers flush the events and grow the state many times
+    if request.param == "small":
+        monkeypatch.setattr(numba_engine, "CHUNK_ROWS", 16)
+        monkeypatch.setattr(numba_engine, "LEVEL_CAPACITY", 2)
+
+
+@pytest.mark.parametrize("orderbook_filter", ORDERBOOK_FILTERS)
+def test_compare_engines(day_path, buffer_sizes, orderbook_filter):
+    assert (
+        numba_engine.compare_engines(day_path, orderbook_filter=orderbook_filter) == []
+    )
+
+
+@pytest.mark.parametrize("orderbook_filter", ORDERBOOK_FILTERS[:2])
+def test_compiled_kernel(day_path, orderbook_filter):
+    numba = pytest.importorskip("numba")
+    assert isinstance(numba_engine.replay_kernel, numba.core.dispatcher.Dispatcher)
+    assert (
+        numba_engine.compare_engines(day_path, orderbook_filter=orderbook_filter) == []
+    )
+    assert numba_engine.replay_kernel.signatures
+
+
+def test_auto_engine(day_path):
+    imi_data = SingleDayIMIData(day_path)
+    imi_data.close()
+    if numba_engine.NUMBA_AVAILABLE and day_path.suffix != ".gz":
+        assert imi_data.engine == "numba"
+    else:
+        # compressed days are streamed by the handlers
+        assert imi_data.engine == "python"
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Observed replays give the same results as the built-in recorders"""
+
+# third-party packages
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, add_sideless_orders, generate_day
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    calculate_orderbook_stats,
+)
+from process_messages.observers import EffectiveSpreadObserver, TransactionObserver
+from process_messages.process_one_day import SingleDayIMIData
+
+TRANSACTION_STATS = [
+    "turnover",
+    "eff_rel_spread_bps_weighted",
+    "price_mean",
+    "num_transactions",
+    "eff_spread_mean",
+    "eff_spread_median",
+    "eff_rel_spread_bps_mean",
+    "eff_rel_spread_bps_median",
+    "trade_value_mean",
+    "trade_value_median",
+]
+
+
+@pytest.fixture(scope="module", params=[5_000, 300])
+def day_path(request, tmp_path_factory):
+    # the small day has few orders, so that book sides are often empty
+    file_path = tmp_path_factory.mktemp(str(request.param)) / FILE_NAME
+    data = generate_day(request.param, num_orderbooks=4, seed=7)
+    file_path.write_bytes(add_sideless_orders(data))
+    return file_path
+
+
+@pytest.fixture(scope="module")
+def recorded_day(day_path):
+    this_day_imi_data = SingleDayIMIData(day_path, engine="python")
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+def replay(day_path, observers):
+    this_day_imi_data = SingleDayIMIData(day_path, observers=observers)
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+def test_transactions(day_path, recorded_day):
+    observer = TransactionObserver()
+    observed_day = replay(day_path, [observer])
+    assert observer.transactions.keys() == recorded_day.transactions.keys()
+    for orderbook_no, transactions in observer.transactions.items():
+        assert transactions.buffer == recorded_day.transactions[orderbook_no].buffer
+    assert observed_day.trading_actions == recorded_day.trading_actions
+    # only the order books are maintained
+    for recorders in [
+        observed_day.message_counts,
+        observed_day.best_bid_ask,
+        observed_day.best_depths,
+        observed_day.transactions,
+        observed_day.order_stats,
+        observed_day.open_close,
+        observed_day.snapshots.dirty,
+    ]:
+        assert len(recorders) == 0
+
+
+def test_effective_spreads(day_path, recorded_day):
+    observed_day = replay(
+        day_path, [EffectiveSpreadObserver(START_MICROSECOND, END_MICROSECOND)]
+    )
+    observed_stats = calculate_orderbook_stats(observed_day)
+    recorded_stats = calculate_orderbook_stats(recorded_day)
+    assert list(observed_stats.index) == list(recorded_stats.index)
+    assert list(observed_stats["date"]) == list(recorded_stats["date"])
+    for column in TRANSACTION_STATS:
+        np.testing.assert_allclose(
+            observed_stats[column].astype(float),
+            recorded_stats[column].astype(float),
+            rtol=1e-9,
+            err_msg=column,
+        )
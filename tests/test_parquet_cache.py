@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Cached days give the same statistics as the replayed days"""
+
+# third-party packages
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, add_sideless_orders, generate_day
+from calculate_statistics.calculate_all import calculate_orderbook_stats
+from process_messages import parquet_cache
+from process_messages.process_one_day import OrderbookFilter, SingleDayIMIData
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(scope="module")
+def day_path(tmp_path_factory):
+    file_path = tmp_path_factory.mktemp("day") / FILE_NAME
+    data = generate_day(5_000, num_orderbooks=4, seed=6)
+    file_path.write_bytes(add_sideless_orders(data))
+    return file_path
+
+
+def replay(file_path, orderbook_filter=None) -> SingleDayIMIData:
+    imi_data = SingleDayIMIData(file_path, orderbook_filter=orderbook_filter)
+    imi_data.process_messages()
+    imi_data.close()
+    return imi_data
+
+
+def assert_same_outputs(cached_day, imi_data):
+    for attribute in [
+        "metadata",
+        "price_tick_sizes",
+        "trading_actions",
+        "message_counts",
+    ]:
+        assert getattr(cached_day, attribute) == getattr(imi_data, attribute)
+    for attribute in parquet_cache.EVENT_RECORDERS:
+        assert {
+            orderbook_no: recorder.buffer
+            for orderbook_no, recorder in getattr(cached_day, attribute).items()
+        } == {
+            orderbook_no: recorder.buffer
+            for orderbook_no, recorder in getattr(imi_data, attribute).items()
+        }
+    assert {
+        orderbook_no: buffer.records
+        for orderbook_no, buffer in cached_day.order_stats.items()
+    } == {
+        orderbook_no: buffer.records
+        for orderbook_no, buffer in imi_data.order_stats.items()
+    }
+    assert cached_day.snapshots.seconds == imi_data.snapshots.seconds
+    assert cached_day.snapshots.positions == imi_data.snapshots.positions
+    # compared as bytes, NaN values are not equal to themselves
+    assert {
+        orderbook_no: values.tobytes()
+        for orderbook_no, values in cached_day.snapshots.values.items()
+    } == {
+        orderbook_no: values.tobytes()
+        for orderbook_no, values in imi_data.snapshots.values.items()
+    }
+
+
+@pytest.mark.parametrize(
+    "orderbook_filter", [None, OrderbookFilter(num_shards=2, shard=1)]
+)
+def test_round_trip(day_path, tmp_path, orderbook_filter):
+    imi_data = replay(day_path, orderbook_filter)
+    checksum = parquet_cache.get_checksum(day_path)
+    cache_path = parquet_cache.write_day_cache(imi_data, tmp_path, checksum)
+    assert parquet_cache.find_cached_days(tmp_path) == [cache_path]
+    assert not list(tmp_path.rglob("*.tmp"))
+
+    cached_day = parquet_cache.load_day_cache(
+        day_path, tmp_path, orderbook_filter, checksum
+    )
+    assert cached_day is not None
+    assert cached_day.date == imi_data.date
+    assert_same_outputs(cached_day, imi_data)
+    pd.testing.assert_frame_equal(
+        calculate_orderbook_stats(cached_day), calculate_orderbook_stats(imi_data)
+    )
+
+    # the orderbooks of another selection are not cached yet
+    other_filter = OrderbookFilter(num_shards=2, shard=0)
+    assert (
+        parquet_cache.load_day_cache(day_path, tmp_path, other_filter, checksum) is None
+    )
+
+
+def test_versioning(day_path, tmp_path, monkeypatch):
+    imi_data = replay(day_path)
+    checksum = parquet_cache.get_checksum(day_path)
+    cache_path = parquet_cache.write_day_cache(imi_data, tmp_path)
+    assert parquet_cache.load_day_cache(day_path, tmp_path).cache_path == cache_path
+
+    # a changed file is not read from the cache
+    changed_path = tmp_path / "changed" / FILE_NAME
+    changed_path.parent.mkdir()
+    changed_path.write_bytes(day_path.read_bytes() + b"\x00")
+    assert parquet_cache.get_checksum(changed_path) != checksum
+    assert parquet_cache.load_day_cache(changed_path, tmp_path) is None
+    assert parquet_cache.load_day_cache(day_path, tmp_path, checksum="other") is None
+
+    # neither are the outputs of another parser version
+    parser_version = parquet_cache.PARSER_VERSION + 1
+    monkeypatch.setattr(parquet_cache, "PARSER_VERSION", parser_version)
+    assert parquet_cache.get_cache_path(tmp_path, imi_data.date, checksum) != cache_path
+    assert parquet_cache.load_day_cache(day_path, tmp_path, checksum=checksum) is None
+    assert parquet_cache.find_cached_days(tmp_path) == []
+
+
+def test_unfinished_write(day_path, tmp_path):
+    imi_data = replay(day_path)
+    checksum = parquet_cache.get_checksum(day_path)
+    cache_path = parquet_cache.get_cache_path(tmp_path, imi_data.date, checksum)
+    # the leftover of an interrupted write is neither read nor kept
+    temporary_path = cache_path.with_name(cache_path.name + ".tmp")
+    temporary_path.mkdir(parents=True)
+    (temporary_path / "metadata.parquet").write_bytes(b"")
+    assert parquet_cache.load_day_cache(day_path, tmp_path, checksum=checksum) is None
+    assert parquet_cache.write_day_cache(imi_data, tmp_path, checksum) == cache_path
+    assert not temporary_path.exists()
+    assert_same_outputs(
+        parquet_cache.load_day_cache(day_path, tmp_path, checksum=checksum), imi_data
+    )
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Ladder book sides give the same replay as sorted book sides"""
+
+# standard libraries
+import random
+from functools import partial
+from operator import neg
+
+# third-party packages
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, generate_day
+from process_messages import process_one_day
+from process_messages.numba_engine import compare_replays
+from process_messages.process_one_day import OrderBookSide
+from process_messages.price_ladder import LadderBookSide
+
+
+def replay(file_path, book_side_type):
+    this_day_imi_data = process_one_day.SingleDayIMIData(
+        file_path, book_side_type=book_side_type, engine="python"
+    )
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+@pytest.mark.parametrize("price_levels", [10, 1000])
+@pytest.mark.parametrize("window", [16, None])
+def test_replay_parity(tmp_path, monkeypatch, price_levels, window):
+    # a small window forces the overflow levels and recentering
+    if window is not None:
+        monkeypatch.setattr(
+            process_one_day, "LadderBookSide", partial(LadderBookSide, window=window)
+        )
+    file_path = tmp_path / FILE_NAME
+    file_path.write_bytes(
+        generate_day(5_000, num_orderbooks=3, seed=3, price_levels=price_levels)
+    )
+    sorted_replay = replay(file_path, "sorted")
+    ladder_replay = replay(file_path, "ladder")
+    assert compare_replays(sorted_replay, ladder_replay) == []
+
+
+@pytest.mark.parametrize("is_bid", [True, False])
+def test_random_updates(is_bid):
+    rng = random.Random(0)
+    tick_sizes = {5: 0, 50: 10000}
+    sorted_side = OrderBookSide(neg) if is_bid else OrderBookSide()
+    ladder_side = LadderBookSide(is_bid, tick_sizes, window=8)
+    for _ in range(5_000):
+        price = rng.choice([5 * rng.randrange(1, 2000), 10000 + 50 * rng.randrange(40)])
+        if price in sorted_side and rng.random() < 0.5:
+            assert ladder_side.pop(price) == sorted_side.pop(price)
+        else:
+            quantity = (
+                sorted_side[price] + rng.randrange(10) if price in sorted_side else 0
+            )
+            sorted_side[price] = quantity
+            ladder_side[price] = quantity
+        assert len(ladder_side) == len(sorted_side)
+        assert ladder_side.peekitem(0) == sorted_side.peekitem(0)
+    assert list(ladder_side.items()) == list(sorted_side.items())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Runs of process_all.py on a synthetic day"""
+
+# third-party packages
+import pytest
+
+import results_manifest
+from benchmarks.synthetic import FILE_NAME, generate_day
+from executors import make_executor
+from process_all import load_and_process_all
+from process_messages.parquet_cache import get_checksum
+from results_manifest import ResultsManifest
+
+
+@pytest.fixture
+def day_path(tmp_path):
+    file_path = tmp_path / "unzipped" / FILE_NAME
+    file_path.parent.mkdir()
+    file_path.write_bytes(generate_day(5_000, num_orderbooks=4))
+    return file_path
+
+
+@pytest.mark.parametrize("profile", [False, True])
+def test_profile_files(tmp_path, day_path, profile):
+    manifest = ResultsManifest(tmp_path / "statistics")
+    with make_executor("futures", num_workers=1) as executor:
+        runtime_profile = load_and_process_all(
+            [day_path], manifest, executor=executor, profile=profile
+        )
+
+    assert manifest.is_done(day_path)
+    assert len(manifest.assemble([day_path])) == 4
+    profile_files = list((tmp_path / "statistics").glob("profiles/*.json"))
+    if profile:
+        assert len(runtime_profile.day_profiles) == 1
+        assert [path.name for path in profile_files] == ["2019-07-03.json"]
+    else:
+        assert runtime_profile.day_profiles == []
+        assert profile_files == []
+
+
+def test_rerun_keeps_history(tmp_path, day_path, monkeypatch):
+    with make_executor("futures", num_workers=1) as executor:
+        load_and_process_all(
+            [day_path], ResultsManifest(tmp_path / "statistics"), executor=executor
+        )
+        entry = dict(ResultsManifest(tmp_path / "statistics").days["2019-07-03"])
+
+        # a run that crashes after the day was cleared
+        manifest = ResultsManifest(tmp_path / "statistics")
+        manifest.clear(day_path)
+        manifest = ResultsManifest(tmp_path / "statistics")
+        assert not manifest.is_done(day_path)
+        assert manifest.days["2019-07-03"]["runtime"] == entry["runtime"]
+        assert manifest.days["2019-07-03"]["peak_memory"] == entry["peak_memory"]
+        with pytest.warns(UserWarning, match="unfinished"):
+            assert manifest.assemble([day_path]).empty
+
+        # the unchanged file is not hashed again
+        calls = list()
+        monkeypatch.setattr(
+            results_manifest, "get_checksum", lambda path: calls.append(path)
+        )
+        load_and_process_all([day_path], manifest, executor=executor)
+    assert calls == []
+    assert manifest.is_done(day_path)
+    assert manifest.days["2019-07-03"]["checksum"] == entry["checksum"]
+    assert len(manifest.assemble([day_path])) == 4
+
+
+def test_cached_day_checksum(tmp_path, day_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    manifest = ResultsManifest(tmp_path / "statistics")
+    # the checksum of the worker is recorded instead of hashing the day again
+    monkeypatch.setattr(results_manifest, "get_checksum", None)
+    with make_executor("futures", num_workers=1) as executor:
+        load_and_process_all(
+            [day_path],
+            manifest,
+            executor=executor,
+            parquet_cache_dir=tmp_path / "cache",
+        )
+    assert manifest.days["2019-07-03"]["checksum"] == get_checksum(day_path)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Incremental snapshots equal the best levels of all books at every second"""
+
+# third-party packages
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import FILE_NAME, add_sideless_orders, generate_day
+from calculate_statistics.calculate_all import (
+    END_MICROSECOND,
+    START_MICROSECOND,
+    prepare_metadata,
+    prepare_tick_sizes,
+    prepare_trading_actions,
+)
+from calculate_statistics.snapshots import calculate_snapshot_statistics
+from process_messages.buffers import SnapshotRecorder
+from process_messages.observers import ReplayObserver
+from process_messages.process_one_day import SingleDayIMIData
+
+
+class AllBooksObserver(ReplayObserver):
+    """The former snapshots: every orderbook at every second of the day"""
+
+    def __init__(self):
+        self.snapshots = dict()
+
+    def orderbook_added(self, orderbook_no, metadata):
+        self.snapshots[orderbook_no] = dict()
+
+    def second(self, seconds):
+        if not 8 * 3600 <= seconds < 18 * 3600:
+            return
+        for orderbook_no, this_orderbook in self.imi_data.orderbooks.items():
+            best_bid_price, best_bid_quantity = this_orderbook[b"B"].peekitem(0)
+            best_ask_price, best_ask_quantity = this_orderbook[b"S"].peekitem(0)
+            self.snapshots[orderbook_no][seconds] = {
+                "best_bid": best_bid_price,
+                "best_ask": best_ask_price,
+                "best_bid_quantity": best_bid_quantity,
+                "best_ask_quantity": best_ask_quantity,
+            }
+
+
+def replay(file_path, engine="python", **kwargs):
+    this_day_imi_data = SingleDayIMIData(file_path, engine=engine, **kwargs)
+    this_day_imi_data.process_messages()
+    this_day_imi_data.close()
+    return this_day_imi_data
+
+
+@pytest.mark.parametrize("engine", ["python", "numba"])
+@pytest.mark.parametrize("num_events", [5_000, 300])
+def test_snapshots(tmp_path, num_events, engine):
+    if engine == "numba":
+        pytest.importorskip("numba")
+    # the small day has books that rarely change, and empty book sides
+    file_path = tmp_path / FILE_NAME
+    data = generate_day(num_events, num_orderbooks=4, seed=8)
+    file_path.write_bytes(add_sideless_orders(data))
+    # the synthetic day ends with several 'T' messages of the same second
+    recorded_day = replay(file_path, engine)
+    observer = AllBooksObserver()
+    replay(file_path, observers=[observer])
+
+    snapshots: SnapshotRecorder = recorded_day.snapshots
+    start_second = int(START_MICROSECOND * 1e-6)
+    end_second = int(END_MICROSECOND * 1e-6)
+    matrix = snapshots.matrix(start_second=start_second, end_second=end_second)
+    metadata = prepare_metadata(recorded_day)
+    for row, orderbook_no in enumerate(sorted(observer.snapshots)):
+        expected = pd.DataFrame.from_dict(
+            observer.snapshots[orderbook_no], orient="index"
+        )
+        pd.testing.assert_frame_equal(
+            snapshots.frame(orderbook_no), expected, check_index_type=False
+        )
+
+        expected = expected.loc[start_second:end_second]
+        for column in SnapshotRecorder.columns:
+            np.testing.assert_array_equal(matrix[column][row], expected[column])
+
+        metainfo = metadata.loc[orderbook_no]
+        arguments = [
+            prepare_trading_actions(recorded_day, orderbook_no),
+            prepare_tick_sizes(recorded_day, metainfo),
+            metainfo,
+        ]
+        actual_stats = calculate_snapshot_statistics(
+            snapshots.frame(orderbook_no, start_second, end_second), *arguments
+        )
+        expected_stats = calculate_snapshot_statistics(expected, *arguments)
+        assert actual_stats == pytest.approx(expected_stats, nan_ok=True)